@@ -0,0 +1,122 @@
+import argparse
+import asyncio
+import json
+import time
+import httpx
+from fastapi import FastAPI
+from src.admission import AdmissionMiddleware, Limiter
+
+# Benchmark of admission control (src/admission.py) without a database: an
+# app whose routes hold one of `--pool` fake connections while they "query",
+# a slow list search and a fast detail lookup. Saturates the search with
+# `--heavy` concurrent clients while `--cheap` clients hit the lookup, with
+# and without the middleware, and reports each route's throughput, 503s and
+# latency percentiles. Usage: python -m bench.admission --seconds 5
+
+
+def make_app(pool_size, heavy_seconds, cheap_seconds, limiters):
+    app = FastAPI()
+    pool = asyncio.Semaphore(pool_size)
+
+    @app.get("/lines/", tags=["lines"])
+    async def search():
+        async with pool:
+            await asyncio.sleep(heavy_seconds)
+        return []
+
+    @app.get("/movies/{movie_id}", tags=["movies"])
+    async def lookup(movie_id: int):
+        async with pool:
+            await asyncio.sleep(cheap_seconds)
+        return {"movie_id": movie_id}
+
+    if limiters is not None:
+        app.add_middleware(
+            AdmissionMiddleware, limiters=limiters, route_classes={"/lines/": "list"}
+        )
+    return app
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 2)
+
+
+async def drive(app, path, clients, deadline, results):
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=None
+    ) as client:
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(path)
+                elapsed = time.perf_counter() - start
+                if response.status_code == 503:
+                    results["shed"] += 1
+                    # honour Retry-After, scaled down to the benchmark's length
+                    await asyncio.sleep(0.05)
+                else:
+                    results["latencies"].append(elapsed)
+
+        await asyncio.gather(*(worker() for _ in range(clients)))
+
+
+async def run(args, limited):
+    limiters = None
+    if limited:
+        detail = Limiter("detail", args.detail_limit, args.detail_queue, args.timeout)
+        heavy = Limiter("list", args.list_limit, args.list_queue, args.timeout)
+        limiters = {"detail": detail, "list": heavy}
+    app = make_app(args.pool, args.heavy_ms / 1000, args.cheap_ms / 1000, limiters)
+    deadline = time.perf_counter() + args.seconds
+    routes = {name: {"latencies": [], "shed": 0} for name in ("search", "lookup")}
+    await asyncio.gather(
+        drive(app, "/lines/", args.heavy, deadline, routes["search"]),
+        drive(app, "/movies/1", args.cheap, deadline, routes["lookup"]),
+    )
+    return {
+        name: {
+            "ok_per_second": round(len(result["latencies"]) / args.seconds, 1),
+            "shed": result["shed"],
+            "p50_ms": percentile(result["latencies"], 50),
+            "p99_ms": percentile(result["latencies"], 99),
+        }
+        for name, result in routes.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument(
+        "--pool",
+        type=int,
+        default=15,
+        help="fake connections (pool size plus overflow)",
+    )
+    parser.add_argument(
+        "--heavy", type=int, default=64, help="concurrent search clients"
+    )
+    parser.add_argument(
+        "--cheap", type=int, default=8, help="concurrent lookup clients"
+    )
+    parser.add_argument("--heavy-ms", type=float, default=200)
+    parser.add_argument("--cheap-ms", type=float, default=2)
+    parser.add_argument("--list-limit", type=int, default=8)
+    parser.add_argument("--list-queue", type=int, default=32)
+    parser.add_argument("--detail-limit", type=int, default=32)
+    parser.add_argument("--detail-queue", type=int, default=256)
+    parser.add_argument("--timeout", type=float, default=5)
+    args = parser.parse_args()
+    report = {
+        "unlimited": asyncio.run(run(args, limited=False)),
+        "admission_control": asyncio.run(run(args, limited=True)),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import argparse
+import asyncio
+import json
+from bench.load import drive, get
+from bench.server import Server
+
+# Compares the sync (threadpool) and async (asyncpg) database paths at the
+# same concurrency. The entity cache is turned off so every request reaches
+# Postgres. Usage: python -m bench.async_path --concurrency 200 --seconds 20
+
+REQUESTS = [
+    get("/movies/{movie_id}", "/movies/44"),
+    get("/characters/{id}", "/characters/7421"),
+    get("/lines/{line_id}", "/lines/238"),
+    get("/lines/conv/{conv_id}", "/lines/conv/500"),
+    get("/characters/", "/characters/?sort=number_of_lines"),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8100)
+    args = parser.parse_args()
+
+    results = {}
+    for mode, port in (("sync", args.port), ("async", args.port + 1)):
+        env = {
+            "POSTGRES_ASYNC": "1" if mode == "async" else "0",
+            "ENTITY_CACHE_SIZE": "0",
+        }
+        with Server(port, env) as server:
+            results[mode] = asyncio.run(
+                drive(server.url, REQUESTS, args.concurrency, args.seconds)
+            )
+
+    sync_rps = results["sync"]["all"]["throughput_rps"]
+    results["async_speedup"] = (
+        round(results["async"]["all"]["throughput_rps"] / sync_rps, 2)
+        if sync_rps
+        else None
+    )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import argparse
+import json
+
+# Prints per-route throughput and p99 changes between two bench.run reports.
+# Usage: python -m bench.compare before.json after.json
+
+
+def change(before, after):
+    if not before or after is None:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("before")
+    parser.add_argument("after")
+    args = parser.parse_args()
+
+    with open(args.before, encoding="utf-8") as f:
+        before = json.load(f)["results"]
+    with open(args.after, encoding="utf-8") as f:
+        after = json.load(f)["results"]
+
+    for concurrency in sorted(before.keys() & after.keys(), key=int):
+        print(f"concurrency {concurrency}")
+        for route in sorted(before[concurrency].keys() & after[concurrency].keys()):
+            old, new = before[concurrency][route], after[concurrency][route]
+            old_rps, new_rps = old["throughput_rps"], new["throughput_rps"]
+            print(
+                f"  {route:40} rps {old_rps:>9} -> {new_rps:>9}"
+                f" ({change(old_rps, new_rps)})"
+                f"  p99 {old['p99_ms']} -> {new['p99_ms']} ms"
+                f" ({change(old['p99_ms'], new['p99_ms'])})"
+            )
+
+
+if __name__ == "__main__":
+    main()
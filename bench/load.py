@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import namedtuple
+import httpx
+
+# Minimal closed-loop HTTP load driver: `concurrency` workers each send
+# requests back to back for `seconds`, cycling through a list of requests.
+# Results are grouped by request name (normally the route's path template).
+
+Request = namedtuple("Request", ["name", "method", "path", "body"])
+
+
+def get(name, path):
+    return Request(name, "GET", path, None)
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+    }
+
+
+async def drive(base_url, requests, concurrency, seconds):
+    """
+    Returns {name: summary} plus an "all" entry, where each summary has the
+    request count, error count, throughput and p50/p95/p99 latency. Responses
+    with a 5xx status or no response at all count as errors.
+    """
+    names = sorted({request.name for request in requests})
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    deadline = time.perf_counter() + seconds
+
+    async with httpx.AsyncClient(
+        base_url=base_url, limits=limits, timeout=60
+    ) as client:
+
+        async def worker(offset):
+            i = offset
+            while time.perf_counter() < deadline:
+                request = requests[i % len(requests)]
+                i += 1
+                start = time.perf_counter()
+                try:
+                    response = await client.request(
+                        request.method, request.path, content=request.body
+                    )
+                    ok = response.status_code < 500
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies[request.name].append(time.perf_counter() - start)
+                else:
+                    errors[request.name] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    report = {name: summarize(latencies[name], errors[name], elapsed) for name in names}
+    report["all"] = summarize(
+        [value for name in names for value in latencies[name]],
+        sum(errors.values()),
+        elapsed,
+    )
+    return report
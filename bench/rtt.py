@@ -0,0 +1,151 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import threading
+import dotenv
+import httpx
+from bench.load import drive, get
+from bench.server import Server
+
+# Measures the entity routes with a simulated network distance to Postgres:
+# the app connects through a local TCP proxy that delays everything it
+# forwards by half the round trip time each way, so each round trip a request
+# makes costs it the full RTT. Runs every --rtt with server-side prepared
+# statements on and off (PREPARED_STATEMENTS), the entity cache off, and
+# reports per-route latency and the database queries each request ran (from
+# Server-Timing). Run it before and after a change to see how many round trips
+# the change saved. Usage: python -m bench.rtt --rtt 1 10 --seconds 10
+
+REQUESTS = [
+    get("/movies/{movie_id}", "/movies/44"),
+    get("/characters/{id}", "/characters/7421"),
+    get("/lines/{line_id}", "/lines/238"),
+    get("/lines/conv/{conv_id}", "/lines/conv/500"),
+]
+
+QUERIES = re.compile(r'db;desc="(\d+) queries"')
+
+
+class DelayProxy:
+    """A TCP proxy to Postgres adding `delay` seconds in each direction."""
+
+    def __init__(self, host, port, delay):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.listen_port = None
+        self._ready = threading.Event()
+        self._loop = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        self._ready.wait(10)
+        return self
+
+    def __exit__(self, *exc):
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(10)
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, "127.0.0.1", 0)
+        )
+        self.listen_port = server.sockets[0].getsockname()[1]
+        self._ready.set()
+        self._loop.run_forever()
+
+    async def _handle(self, client_reader, client_writer):
+        try:
+            upstream_reader, upstream_writer = await asyncio.open_connection(
+                self.host, self.port
+            )
+        except OSError:
+            client_writer.close()
+            return
+        await asyncio.gather(
+            self._pipe(client_reader, upstream_writer),
+            self._pipe(upstream_reader, client_writer),
+            return_exceptions=True,
+        )
+
+    async def _pipe(self, reader, writer):
+        # delay each chunk without holding back the ones behind it, so the
+        # proxy adds latency but doesn't limit throughput
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+
+        async def forward():
+            while True:
+                due, data = await queue.get()
+                await asyncio.sleep(max(0.0, due - loop.time()))
+                if not data:
+                    writer.close()
+                    return
+                writer.write(data)
+                await writer.drain()
+
+        forwarding = asyncio.ensure_future(forward())
+        try:
+            while True:
+                data = await reader.read(65536)
+                queue.put_nowait((loop.time() + self.delay, data))
+                if not data:
+                    break
+        finally:
+            await forwarding
+
+
+def queries_per_request(url):
+    counts = {}
+    for request in REQUESTS:
+        timing = httpx.get(url + request.path).headers.get("server-timing", "")
+        match = QUERIES.search(timing)
+        counts[request.name] = int(match.group(1)) if match else None
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--rtt", type=float, nargs="+", default=[1, 10], help="round trip times in ms"
+    )
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    dotenv.load_dotenv()
+    host = os.environ.get("POSTGRES_SERVER", "localhost")
+    port = int(os.environ.get("POSTGRES_PORT", "5432"))
+
+    results = {}
+    for rtt in args.rtt:
+        with DelayProxy(host, port, rtt / 2000) as proxy:
+            for mode in ("unprepared", "prepared"):
+                env = {
+                    "POSTGRES_SERVER": "127.0.0.1",
+                    "POSTGRES_PORT": str(proxy.listen_port),
+                    "PREPARED_STATEMENTS": "1" if mode == "prepared" else "0",
+                    "ENTITY_CACHE_SIZE": "0",
+                }
+                with Server(args.port, env) as server:
+                    report = asyncio.run(
+                        drive(server.url, REQUESTS, args.concurrency, args.seconds)
+                    )
+                    report["queries_per_request"] = queries_per_request(server.url)
+                results.setdefault(f"rtt_{rtt:g}ms", {})[mode] = report
+
+    output = json.dumps({"rtt_ms": args.rtt, "results": results}, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
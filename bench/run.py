@@ -0,0 +1,279 @@
+import argparse
+import asyncio
+import json
+import random
+import re
+import subprocess
+import sys
+import time
+import sqlalchemy
+from fastapi.routing import APIRoute
+from bench.load import Request, drive, get
+from bench.server import Server
+from src import database as db
+
+# Drives every route of the API at each concurrency level and reports
+# throughput and p50/p95/p99 latency per route as JSON, for comparing runs
+# before and after a change. Seed the database first with bench.seed.
+#
+# Usage: python -m bench.run --concurrency 1 16 64 --seconds 15 --output before.json
+
+SAMPLE_SIZE = 50
+
+
+def sample_ids(seed):
+    """Random existing ids to spread requests across the dataset."""
+    engine = sqlalchemy.create_engine(db.database_connection_url())
+    with engine.connect() as conn:
+        conn.execute(
+            sqlalchemy.text("SELECT setseed(:seed)"), [{"seed": seed / 2**31}]
+        )
+
+        def ids(sql):
+            return conn.execute(sqlalchemy.text(sql), [{"n": SAMPLE_SIZE}]).all()
+
+        samples = {
+            "movies": [
+                row[0]
+                for row in ids("SELECT movie_id FROM movies ORDER BY random() LIMIT :n")
+            ],
+            "characters": [
+                row[0]
+                for row in ids(
+                    "SELECT character_id FROM characters ORDER BY random() LIMIT :n"
+                )
+            ],
+            "lines": [
+                row[0]
+                for row in ids("SELECT line_id FROM lines ORDER BY random() LIMIT :n")
+            ],
+            "conversations": ids(
+                """
+                SELECT conversation_id, character1_id, character2_id, movie_id
+                FROM conversations ORDER BY random() LIMIT :n
+            """
+            ),
+        }
+    engine.dispose()
+    return samples
+
+
+def conversation_body(conv, with_movie=False):
+    _, ch_id1, ch_id2, movie_id = conv
+    body = {
+        "character_1_id": ch_id1,
+        "character_2_id": ch_id2,
+        "lines": [
+            {"character_id": ch_id1, "line_text": "Benchmark line one."},
+            {"character_id": ch_id2, "line_text": "Benchmark line two."},
+        ],
+    }
+    if with_movie:
+        body["movie_id"] = movie_id
+    return body
+
+
+def route_requests(samples):
+    """Concrete requests for each route path of the app, keyed by that path."""
+    movies = samples["movies"]
+    characters = samples["characters"]
+    lines = samples["lines"]
+    conversations = samples["conversations"]
+    return {
+        "/": [get("/", "/")],
+        "/movies/{movie_id}": [
+            get("/movies/{movie_id}", f"/movies/{id}") for id in movies
+        ],
+        "/movies/": [
+            get("/movies/", "/movies/"),
+            get("/movies/", "/movies/?sort=rating&limit=250"),
+            get("/movies/", "/movies/?sort=year&offset=200"),
+            get("/movies/", "/movies/?name=a&cursor="),
+            get("/movies/", "/movies/?ids=" + ",".join(map(str, movies[:25]))),
+        ],
+        "/movies/{movie_id}/stats": [
+            get("/movies/{movie_id}/stats", f"/movies/{id}/stats") for id in movies
+        ],
+        "/movies/{movie_id}/vocabulary": [
+            get("/movies/{movie_id}/vocabulary", f"/movies/{id}/vocabulary")
+            for id in movies
+        ],
+        "/movies/{movie_id}/lines/export": [
+            get("/movies/{movie_id}/lines/export", f"/movies/{id}/lines/export")
+            for id in movies[:5]
+        ],
+        "/movies/{movie_id}/conversations/": [
+            Request(
+                "/movies/{movie_id}/conversations/",
+                "POST",
+                f"/movies/{conv[3]}/conversations/",
+                json.dumps(conversation_body(conv)),
+            )
+            for conv in conversations
+        ],
+        "/conversations/bulk": [
+            Request(
+                "/conversations/bulk",
+                "POST",
+                "/conversations/bulk",
+                "\n".join(
+                    json.dumps(conversation_body(conv, with_movie=True))
+                    for conv in conversations
+                ),
+            )
+        ],
+        "/characters/{id}": [
+            get("/characters/{id}", f"/characters/{id}") for id in characters
+        ],
+        "/characters/{id}/network": [
+            get(
+                "/characters/{id}/network",
+                f"/characters/{id}/network?depth={1 + n % 3}",
+            )
+            for n, id in enumerate(characters)
+        ],
+        "/characters/{id}/vocabulary": [
+            get("/characters/{id}/vocabulary", f"/characters/{id}/vocabulary")
+            for id in characters
+        ],
+        "/characters/{a}/path/{b}": [
+            get("/characters/{a}/path/{b}", f"/characters/{conv[1]}/path/{conv[2]}")
+            for conv in conversations
+        ],
+        "/characters/": [
+            get("/characters/", "/characters/"),
+            get("/characters/", "/characters/?sort=number_of_lines&limit=250"),
+            get("/characters/", "/characters/?sort=movie&offset=1000"),
+            get("/characters/", "/characters/?name=ka&cursor="),
+            get(
+                "/characters/",
+                "/characters/?ids=" + ",".join(map(str, characters[:25])),
+            ),
+        ],
+        "/lines/{line_id}": [get("/lines/{line_id}", f"/lines/{id}") for id in lines],
+        "/lines/conv/{conv_id}": [
+            get("/lines/conv/{conv_id}", f"/lines/conv/{conv[0]}")
+            for conv in conversations
+        ],
+        "/lines/conv/": [
+            get(
+                "/lines/conv/",
+                "/lines/conv/?ids="
+                + ",".join(str(conv[0]) for conv in conversations[:25]),
+            )
+        ],
+        "/lines/": [
+            get("/lines/", "/lines/"),
+            get("/lines/", "/lines/?name=what&sort=character_name"),
+            get("/lines/", "/lines/?name=ka&match=words&rank=true"),
+            get("/lines/", "/lines/?offset=5000"),
+            get("/lines/", "/lines/?ids=" + ",".join(map(str, lines[:25]))),
+        ],
+        "/lines/{line_id}/similar": [
+            get("/lines/{line_id}/similar", f"/lines/{id}/similar?k={10 + n % 3 * 20}")
+            for n, id in enumerate(lines)
+        ],
+        "/lines/similar": [
+            Request(
+                "/lines/similar",
+                "POST",
+                "/lines/similar",
+                json.dumps({"text": "I don't know."}),
+            ),
+            Request(
+                "/lines/similar",
+                "POST",
+                "/lines/similar?k=50",
+                json.dumps({"text": "Where were you?"}),
+            ),
+        ],
+        "/pyversion/": [get("/pyversion/", "/pyversion/")],
+        "/pkgsize/": [get("/pkgsize/", "/pkgsize/")],
+        "/cache/": [get("/cache/", "/cache/")],
+        "/replicas/": [get("/replicas/", "/replicas/")],
+        "/similarity/": [get("/similarity/", "/similarity/")],
+        "/metrics": [get("/metrics", "/metrics")],
+    }
+
+
+def app_routes():
+    from src.api.server import app
+
+    return {route.path for route in app.routes if isinstance(route, APIRoute)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument(
+        "--url", help="benchmark a running server instead of starting one"
+    )
+    parser.add_argument("--port", type=int, default=8200)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--routes", default=".*", help="regex of route paths to include"
+    )
+    parser.add_argument("--no-writes", action="store_true", help="skip POST routes")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", help="write the JSON report here as well as to stdout"
+    )
+    args = parser.parse_args()
+
+    routes = route_requests(sample_ids(args.seed))
+    untested = sorted(app_routes() - routes.keys())
+    if untested:
+        print(f"warning: no benchmark requests for {untested}", file=sys.stderr)
+
+    requests = [
+        request
+        for path, path_requests in routes.items()
+        if re.search(args.routes, path)
+        for request in path_requests
+        if not (args.no_writes and request.method != "GET")
+    ]
+    # interleave routes so every worker mixes cheap and expensive requests
+    random.Random(args.seed).shuffle(requests)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "seconds": args.seconds,
+            "workers": args.workers,
+            "untested_routes": untested,
+        },
+        "results": {},
+    }
+    for concurrency in args.concurrency:
+        if args.url:
+            results = asyncio.run(drive(args.url, requests, concurrency, args.seconds))
+        else:
+            with Server(args.port, workers=args.workers) as server:
+                results = asyncio.run(
+                    drive(server.url, requests, concurrency, args.seconds)
+                )
+        report["results"][str(concurrency)] = results
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import csv
+import io
+import random
+import time
+import sqlalchemy
+from src import database as db
+from src import migrate, rollups
+
+# Fills the database named by the POSTGRES_* variables with a synthetic
+# movies/characters/conversations/lines corpus, then applies the migrations and
+# builds the rollups, so benchmarks run against a known, reproducible dataset.
+# Scale 1 matches the size of the real dataset.
+#
+# Usage: python -m bench.seed --scale 10 --reset
+# --reset drops EVERY table in the current schema first; only point it at a
+# database used for benchmarking.
+
+MOVIES_PER_SCALE = 617
+CHARACTERS_PER_MOVIE = 15
+CONVERSATIONS_PER_MOVIE = 135
+LINES_PER_CONVERSATION = (2, 6)
+WORDS_PER_LINE = (1, 25)
+VOCABULARY_SIZE = 5000
+
+SYLLABLES = [
+    "ka",
+    "lo",
+    "mi",
+    "ra",
+    "te",
+    "so",
+    "vin",
+    "dar",
+    "el",
+    "ny",
+    "qua",
+    "bre",
+    "tho",
+    "zu",
+    "an",
+    "mer",
+    "is",
+    "pol",
+    "gat",
+    "ry",
+]
+
+
+def make_word(rng, syllables):
+    return "".join(rng.choice(SYLLABLES) for _ in range(syllables))
+
+
+def make_vocabulary(rng):
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        words.add(make_word(rng, rng.randint(1, 4)))
+    words = sorted(words)
+    rng.shuffle(words)
+    # Zipf-like weights, so a few words are very common as in real dialog
+    weights = [1 / (rank + 1) for rank in range(len(words))]
+    return words, weights
+
+
+# movies whose conversations and lines are generated and copied at a time,
+# so memory stays flat at large scales
+MOVIES_PER_CHUNK = 200
+
+CONVERSATION_COLUMNS = ["conversation_id", "character1_id", "character2_id", "movie_id"]
+LINE_COLUMNS = [
+    "line_id",
+    "character_id",
+    "movie_id",
+    "conversation_id",
+    "line_sort",
+    "line_text",
+]
+
+
+def generate(scale, seed):
+    """
+    Yields (table name, columns, rows) batches, parents before children.
+    The same scale and seed always give the same data.
+    """
+    rng = random.Random(seed)
+    words, weights = make_vocabulary(rng)
+    num_movies = max(1, round(MOVIES_PER_SCALE * scale))
+
+    movies = []
+    characters = []
+    for movie_id in range(num_movies):
+        title = " ".join(
+            make_word(rng, rng.randint(1, 3)) for _ in range(rng.randint(1, 4))
+        )
+        movies.append(
+            (
+                movie_id,
+                title,
+                str(rng.randint(1927, 2010)),
+                round(rng.uniform(2.5, 9.5), 1),
+                rng.randint(100, 500000),
+                f"http://example.com/scripts/{movie_id}.html",
+            )
+        )
+        for n in range(CHARACTERS_PER_MOVIE):
+            characters.append(
+                (
+                    len(characters),
+                    make_word(rng, rng.randint(1, 3)).upper(),
+                    movie_id,
+                    rng.choice(["M", "F", None]),
+                    None,
+                )
+            )
+    yield "movies", [
+        "movie_id",
+        "title",
+        "year",
+        "imdb_rating",
+        "imdb_votes",
+        "raw_script_url",
+    ], movies
+    yield "characters", [
+        "character_id",
+        "name",
+        "movie_id",
+        "gender",
+        "age",
+    ], characters
+
+    conversations = []
+    lines = []
+    next_conv_id = 0
+    next_line_id = 0
+    for movie_id in range(num_movies):
+        cast = range(
+            movie_id * CHARACTERS_PER_MOVIE, (movie_id + 1) * CHARACTERS_PER_MOVIE
+        )
+        # a few characters get most of the dialog
+        cast_weights = [1 / (rank + 1) for rank in range(len(cast))]
+        for _ in range(CONVERSATIONS_PER_MOVIE):
+            ch_id1, ch_id2 = rng.choices(cast, cast_weights, k=1)[0], rng.choice(cast)
+            while ch_id2 == ch_id1:
+                ch_id2 = rng.choice(cast)
+            conv_id = next_conv_id
+            next_conv_id += 1
+            conversations.append((conv_id, ch_id1, ch_id2, movie_id))
+            for line_sort in range(1, rng.randint(*LINES_PER_CONVERSATION) + 1):
+                text = " ".join(
+                    rng.choices(words, weights, k=rng.randint(*WORDS_PER_LINE))
+                )
+                next_line_id += 1
+                lines.append(
+                    (
+                        next_line_id - 1,
+                        ch_id1 if line_sort % 2 else ch_id2,
+                        movie_id,
+                        conv_id,
+                        line_sort,
+                        text.capitalize() + rng.choice([".", "?", "!", "..."]),
+                    )
+                )
+        if (movie_id + 1) % MOVIES_PER_CHUNK == 0 or movie_id == num_movies - 1:
+            yield "conversations", CONVERSATION_COLUMNS, conversations
+            yield "lines", LINE_COLUMNS, lines
+            conversations = []
+            lines = []
+
+
+def copy_rows(conn, table, columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(["\\N" if value is None else value for value in row])
+    buffer.seek(0)
+    cursor = conn.connection.cursor()
+    cursor.copy_expert(
+        f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+        buffer,
+    )
+
+
+def reset(conn):
+    tables = (
+        conn.execute(
+            sqlalchemy.text(
+                """
+        SELECT tablename FROM pg_tables WHERE schemaname = current_schema()
+    """
+            )
+        )
+        .scalars()
+        .all()
+    )
+    for table in tables:
+        conn.execute(sqlalchemy.text(f'DROP TABLE IF EXISTS "{table}" CASCADE'))
+
+
+def seed(scale, seed_value=0, drop=False):
+    engine = sqlalchemy.create_engine(db.database_connection_url())
+    counts = {}
+    with engine.begin() as conn:
+        if drop:
+            reset(conn)
+        db.metadata_obj.create_all(conn)
+        for table, columns, rows in generate(scale, seed_value):
+            copy_rows(conn, table, columns, rows)
+            counts[table] = counts.get(table, 0) + len(rows)
+        migrate.apply_migrations(conn)
+        rollups.rebuild(conn)
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(sqlalchemy.text("ANALYZE"))
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--scale", type=float, default=1, help="1 is the size of the real dataset"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--reset", action="store_true", help="drop every table in the schema first"
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = seed(args.scale, args.seed, args.reset)
+    print(f"seeded {counts} in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+import argparse
+import itertools
+import json
+import os
+import random
+import tempfile
+import time
+from src import similarity
+
+# Micro-benchmark of the similar-line index (src/similarity.py) without a
+# database or HTTP: builds an index of synthetic lines the size of the movie
+# corpus, with words drawn from a Zipf-like distribution as in real dialogue,
+# saves it, maps it back in as a worker would and times queries by line and
+# by text. Reports build and load time, the size on disk and query latency
+# percentiles. Usage: python -m bench.similarity --lines 300000
+
+
+def fake_lines(num_lines, vocabulary_size, seed):
+    rng = random.Random(seed)
+    words = [f"w{i}" for i in range(vocabulary_size)]
+    cumulative = list(
+        itertools.accumulate(1 / (rank + 1) for rank in range(vocabulary_size))
+    )
+    return (
+        [
+            (
+                line_id,
+                " ".join(
+                    rng.choices(words, cum_weights=cumulative, k=rng.randint(1, 20))
+                ),
+            )
+            for line_id in range(1, num_lines + 1)
+        ],
+        words,
+        cumulative,
+    )
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000, 3)
+
+
+def time_queries(queries, k):
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        query(k)
+        latencies.append(time.perf_counter() - start)
+    return {
+        "queries_per_second": round(len(latencies) / sum(latencies), 1),
+        "p50_ms": percentile(latencies, 50),
+        "p99_ms": percentile(latencies, 99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lines", type=int, default=300000)
+    parser.add_argument("--vocabulary", type=int, default=40000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    lines, words, cumulative = fake_lines(args.lines, args.vocabulary, args.seed)
+    start = time.perf_counter()
+    built = similarity.build(lines)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index")
+        similarity.save(built, path)
+        size = sum(entry.stat().st_size for entry in os.scandir(path))
+        start = time.perf_counter()
+        index = similarity.load(path)
+        load_seconds = time.perf_counter() - start
+
+        rng = random.Random(args.seed + 1)
+        by_line = [
+            lambda k, line_id=rng.randint(1, args.lines): index.top_k(
+                index.line_vector(line_id), k, line_id
+            )
+            for _ in range(args.queries)
+        ]
+        by_text = [
+            lambda k, text=" ".join(
+                rng.choices(words, cum_weights=cumulative, k=8)
+            ): index.top_k(index.vectorize(text), k)
+            for _ in range(args.queries)
+        ]
+        report = {
+            "lines": index.size,
+            "terms": len(index.terms),
+            "postings": len(index.term_lines),
+            "build_seconds": round(build_seconds, 2),
+            "load_ms": round(load_seconds * 1000, 2),
+            "index_mb": round(size / 2**20, 1),
+            "by_line": time_queries(by_line, args.k),
+            "by_text": time_queries(by_text, args.k),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
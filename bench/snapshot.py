@@ -0,0 +1,144 @@
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from src.responses import RenderedJSONResponse
+from src.snapshot import Snapshot
+
+# Micro-benchmark of the in-memory list routes (src/snapshot.py), without a
+# database or HTTP: builds a snapshot of synthetic tables the size of the
+# movie corpus, then times each query shape from walking the sort order to
+# building the response. Reports pages per second on one core and the
+# memory the snapshot holds. Usage: python -m bench.snapshot --lines 300000
+
+WORDS = "the a you I to it what is that of and in me no know not this be on do".split()
+
+
+def ranks(rows, key):
+    order = sorted(range(len(rows)), key=lambda i: key(rows[i]))
+    place = [0] * len(rows)
+    for p, i in enumerate(order):
+        place[i] = p
+    return place
+
+
+def fake_tables(num_movies, num_characters, num_lines, seed):
+    rng = random.Random(seed)
+    movies = [
+        (
+            m,
+            f"movie {rng.randint(0, 10 ** 6)}",
+            str(rng.randint(1927, 2010)),
+            round(rng.uniform(2.5, 9.5), 1),
+            rng.randint(100, 500000),
+        )
+        for m in range(num_movies)
+    ]
+    characters = [
+        (c, f"CHARACTER {rng.randint(0, 10 ** 5)}", rng.randrange(num_movies), 0)
+        for c in range(num_characters)
+    ]
+    lines = []
+    counts = [0] * num_characters
+    for line_id in range(num_lines):
+        c = rng.randrange(num_characters)
+        counts[c] += 1
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 20)))
+        lines.append(
+            (line_id, characters[c][2], characters[c][1], rng.randint(1, 10), text)
+        )
+    characters = [row[:3] + (counts[row[0]],) for row in characters]
+
+    titles = [row[1] for row in movies]
+    movies = [
+        row + places
+        for row, places in zip(
+            movies,
+            zip(
+                ranks(movies, lambda r: (r[1], r[0])),
+                ranks(movies, lambda r: (r[2], r[0])),
+                ranks(movies, lambda r: (-r[3], r[0])),
+            ),
+        )
+    ]
+    characters = [
+        row + places
+        for row, places in zip(
+            characters,
+            zip(
+                ranks(characters, lambda r: (r[1], r[0])),
+                ranks(characters, lambda r: (titles[r[2]], r[0])),
+                ranks(characters, lambda r: (-r[3], r[0])),
+            ),
+        )
+    ]
+    lines = [
+        row + places
+        for row, places in zip(
+            lines,
+            zip(
+                ranks(lines, lambda r: (titles[r[1]], r[0])),
+                ranks(lines, lambda r: (r[2], r[0])),
+            ),
+        )
+    ]
+    return movies, characters, lines
+
+
+QUERIES = {
+    "movies_by_title": lambda s: s.list_movies("", "movie_title", 50, 0, None),
+    "movies_by_rating_name_filter": lambda s: s.list_movies("1", "rating", 50, 0, None),
+    "characters_by_lines_offset_200": lambda s: s.list_characters(
+        "", "number_of_lines", 50, 200, None
+    ),
+    "lines_by_movie_title": lambda s: s.list_lines("", "movie_title", 50, 0, None),
+    "lines_by_character_limit_250": lambda s: s.list_lines(
+        "", "character_name", 250, 0, None
+    ),
+    "lines_substring_common": lambda s: s.list_lines("you", "movie_title", 50, 0, None),
+    "lines_substring_rare": lambda s: s.list_lines(
+        "what is that of and", "movie_title", 50, 0, None
+    ),
+}
+
+
+def pages_per_second(query, columns, seconds):
+    calls = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        RenderedJSONResponse(query(columns))
+        calls += 1
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--movies", type=int, default=617)
+    parser.add_argument("--characters", type=int, default=9035)
+    parser.add_argument("--lines", type=int, default=300000)
+    parser.add_argument("--seconds", type=float, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tables = fake_tables(args.movies, args.characters, args.lines, args.seed)
+    tracemalloc.start()
+    start = time.perf_counter()
+    columns = Snapshot(*tables)
+    build_seconds = time.perf_counter() - start
+    held, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    report = {
+        "build_seconds": round(build_seconds, 2),
+        "snapshot_mb": round(held / 2**20, 1),
+        "pages_per_second": {
+            name: round(pages_per_second(query, columns, args.seconds))
+            for name, query in QUERIES.items()
+        },
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
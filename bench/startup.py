@@ -0,0 +1,67 @@
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+# Measures cold-start cost: importing the app in a fresh interpreter, and the
+# time until it has answered its first request (startup events included).
+# Exits non-zero if the median import time is over --max-import-ms, so it can
+# run in CI. Usage: python -m bench.startup --runs 10
+
+PROBE = """
+import asyncio, json, time
+start = time.perf_counter()
+from src.api.server import app
+imported = time.perf_counter()
+
+import httpx
+
+async def first_request():
+    transport = httpx.ASGITransport(app=app)
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+    async with client:
+        for handler in app.router.on_startup:
+            await handler()
+        response = await client.get("/")
+        assert response.status_code == 200
+
+asyncio.run(first_request())
+served = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (served - start) * 1000,
+}))
+"""
+
+
+def measure_once():
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE], check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=None)
+    args = parser.parse_args()
+
+    runs = [measure_once() for _ in range(args.runs)]
+    report = {
+        key: {
+            "median": round(statistics.median(run[key] for run in runs), 1),
+            "max": round(max(run[key] for run in runs), 1),
+        }
+        for key in ("import_ms", "first_response_ms")
+    }
+    print(json.dumps(report, indent=2))
+
+    median = report["import_ms"]["median"]
+    if args.max_import_ms is not None and median > args.max_import_ms:
+        sys.exit(f"median import time {median} ms is over {args.max_import_ms} ms")
+
+
+if __name__ == "__main__":
+    main()
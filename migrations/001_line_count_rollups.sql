@@ -0,0 +1,51 @@
+-- Line-count rollups maintained by add_conversation, filled here from the
+-- existing lines.
+-- Repair with: python -m src.rollups
+
+CREATE TABLE IF NOT EXISTS character_line_counts (
+    character_id integer PRIMARY KEY REFERENCES characters (character_id),
+    movie_id integer NOT NULL REFERENCES movies (movie_id),
+    number_of_lines integer NOT NULL DEFAULT 0
+);
+
+CREATE INDEX IF NOT EXISTS character_line_counts_lines_idx
+    ON character_line_counts (number_of_lines DESC, character_id ASC);
+
+CREATE INDEX IF NOT EXISTS character_line_counts_movie_idx
+    ON character_line_counts (movie_id, number_of_lines DESC, character_id ASC);
+
+CREATE TABLE IF NOT EXISTS movie_line_counts (
+    movie_id integer PRIMARY KEY REFERENCES movies (movie_id),
+    number_of_lines integer NOT NULL DEFAULT 0
+);
+
+-- keyed the same way as conversations, so (a, b) and (b, a) stay separate rows
+CREATE TABLE IF NOT EXISTS character_pair_line_counts (
+    character1_id integer NOT NULL REFERENCES characters (character_id),
+    character2_id integer NOT NULL REFERENCES characters (character_id),
+    number_of_lines integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (character1_id, character2_id)
+);
+
+CREATE INDEX IF NOT EXISTS character_pair_line_counts_c2_idx
+    ON character_pair_line_counts (character2_id, character1_id);
+
+INSERT INTO character_line_counts (character_id, movie_id, number_of_lines)
+SELECT characters.character_id, characters.movie_id, COUNT(*)
+FROM characters
+JOIN lines ON lines.character_id = characters.character_id
+GROUP BY characters.character_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO movie_line_counts (movie_id, number_of_lines)
+SELECT movie_id, COUNT(*)
+FROM lines
+GROUP BY movie_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO character_pair_line_counts (character1_id, character2_id, number_of_lines)
+SELECT character1_id, character2_id, COUNT(*)
+FROM conversations
+JOIN lines ON lines.conversation_id = conversations.conversation_id
+GROUP BY character1_id, character2_id
+ON CONFLICT DO NOTHING;
@@ -0,0 +1,12 @@
+-- Indexes matching the ORDER BY of each list endpoint, so cursor pages start
+-- with an index seek.
+
+CREATE INDEX IF NOT EXISTS movies_title_idx ON movies (title, movie_id);
+CREATE INDEX IF NOT EXISTS movies_year_idx ON movies (year, movie_id);
+CREATE INDEX IF NOT EXISTS movies_rating_idx ON movies (imdb_rating DESC, movie_id);
+
+CREATE INDEX IF NOT EXISTS characters_name_idx ON characters (name, character_id);
+CREATE INDEX IF NOT EXISTS characters_movie_idx ON characters (movie_id, character_id);
+
+CREATE INDEX IF NOT EXISTS lines_movie_idx ON lines (movie_id, line_id);
+CREATE INDEX IF NOT EXISTS lines_character_idx ON lines (character_id, line_id);
@@ -0,0 +1,12 @@
+-- Indexes behind GET /lines/?name=...
+-- match=substring uses the trigram index for ILIKE substring matches;
+-- match=words and match=phrase use the full-text index. The expression must
+-- stay identical to the one in src/api/lines.py for the planner to use it.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS lines_text_trgm_idx
+    ON lines USING gin (line_text gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS lines_text_tsv_idx
+    ON lines USING gin (to_tsvector('english', coalesce(line_text, '')));
@@ -0,0 +1,22 @@
+-- Let Postgres allocate conversation and line ids, so concurrent inserts
+-- can never pick the same id.
+
+CREATE SEQUENCE IF NOT EXISTS conversations_conversation_id_seq
+    OWNED BY conversations.conversation_id;
+SELECT setval(
+    'conversations_conversation_id_seq',
+    COALESCE((SELECT MAX(conversation_id) FROM conversations), 0) + 1,
+    false
+);
+ALTER TABLE conversations
+    ALTER COLUMN conversation_id SET DEFAULT nextval('conversations_conversation_id_seq');
+
+CREATE SEQUENCE IF NOT EXISTS lines_line_id_seq
+    OWNED BY lines.line_id;
+SELECT setval(
+    'lines_line_id_seq',
+    COALESCE((SELECT MAX(line_id) FROM lines), 0) + 1,
+    false
+);
+ALTER TABLE lines
+    ALTER COLUMN line_id SET DEFAULT nextval('lines_line_id_seq');
@@ -0,0 +1,5 @@
+-- Lets /movies/{movie_id}/lines/export read a movie's lines already in
+-- conversation and line_sort order, so it can stream without sorting first.
+
+CREATE INDEX IF NOT EXISTS lines_movie_conversation_idx
+    ON lines (movie_id, conversation_id, line_sort);
@@ -0,0 +1,4 @@
+-- Counting the conversations between two characters in get_line.
+
+CREATE INDEX IF NOT EXISTS conversations_pair_idx
+    ON conversations (character1_id, character2_id);
@@ -0,0 +1,8 @@
+-- Per-movie data version behind the ETags of the entity endpoints. Bumped by
+-- LineCounts.apply in the same transaction as every conversation insert, and
+-- by rebuild(). A movie without a row is at version 0.
+
+CREATE TABLE IF NOT EXISTS movie_versions (
+    movie_id integer PRIMARY KEY REFERENCES movies (movie_id),
+    version bigint NOT NULL DEFAULT 0
+);
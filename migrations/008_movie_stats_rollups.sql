@@ -0,0 +1,50 @@
+-- Rollups behind GET /movies/{movie_id}/stats, maintained by add_conversation
+-- alongside the line counts of 001. Words are runs of non-whitespace and line
+-- lengths are in characters.
+-- Repair with: python -m src.rollups
+
+ALTER TABLE character_line_counts
+    ADD COLUMN IF NOT EXISTS number_of_words integer NOT NULL DEFAULT 0;
+
+-- conversations of each movie by how many lines they have
+CREATE TABLE IF NOT EXISTS movie_conversation_lengths (
+    movie_id integer NOT NULL REFERENCES movies (movie_id),
+    number_of_lines integer NOT NULL,
+    number_of_conversations integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (movie_id, number_of_lines)
+);
+
+-- lines of each movie by their length, for the median
+CREATE TABLE IF NOT EXISTS movie_line_lengths (
+    movie_id integer NOT NULL REFERENCES movies (movie_id),
+    line_length integer NOT NULL,
+    number_of_lines integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (movie_id, line_length)
+);
+
+UPDATE character_line_counts
+SET number_of_words = words.number_of_words
+FROM (
+    SELECT character_id,
+           SUM((SELECT COUNT(*) FROM regexp_matches(coalesce(line_text, ''), '\S+', 'g'))) AS number_of_words
+    FROM lines
+    GROUP BY character_id
+) AS words
+WHERE words.character_id = character_line_counts.character_id;
+
+INSERT INTO movie_conversation_lengths (movie_id, number_of_lines, number_of_conversations)
+SELECT movie_id, number_of_lines, COUNT(*)
+FROM (
+    SELECT conversations.movie_id, COUNT(lines.line_id) AS number_of_lines
+    FROM conversations
+    LEFT JOIN lines ON lines.conversation_id = conversations.conversation_id
+    GROUP BY conversations.conversation_id
+) AS conversation_lengths
+GROUP BY movie_id, number_of_lines
+ON CONFLICT DO NOTHING;
+
+INSERT INTO movie_line_lengths (movie_id, line_length, number_of_lines)
+SELECT movie_id, char_length(coalesce(line_text, '')), COUNT(*)
+FROM lines
+GROUP BY movie_id, char_length(coalesce(line_text, ''))
+ON CONFLICT DO NOTHING;
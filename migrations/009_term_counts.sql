@@ -0,0 +1,48 @@
+-- Term counts behind GET /movies/{movie_id}/vocabulary and
+-- GET /characters/{id}/vocabulary, maintained by add_conversation: an inverted
+-- index of the lines, with each term's uses per character and per movie.
+-- Terms are lowercased runs of letters and digits joined across apostrophes
+-- (src/vocabulary.py); the pattern below must stay identical to TERM_PATTERN.
+-- Words in character_line_counts are counted as terms from now on.
+-- Repair with: python -m src.rollups
+
+CREATE TABLE IF NOT EXISTS character_term_counts (
+    character_id integer NOT NULL REFERENCES characters (character_id),
+    term text NOT NULL,
+    number_of_uses integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (character_id, term)
+);
+
+CREATE INDEX IF NOT EXISTS character_term_counts_term_idx
+    ON character_term_counts (term);
+
+CREATE TABLE IF NOT EXISTS movie_term_counts (
+    movie_id integer NOT NULL REFERENCES movies (movie_id),
+    term text NOT NULL,
+    number_of_uses integer NOT NULL DEFAULT 0,
+    PRIMARY KEY (movie_id, term)
+);
+
+-- a term's uses across the corpus, for the distinctive terms of a movie
+CREATE INDEX IF NOT EXISTS movie_term_counts_term_idx
+    ON movie_term_counts (term) INCLUDE (number_of_uses);
+
+INSERT INTO character_term_counts (character_id, term, number_of_uses)
+SELECT character_id, term_match[1], COUNT(*)
+FROM lines, regexp_matches(lower(coalesce(line_text, '')), '[a-z0-9]+(?:''[a-z0-9]+)*', 'g') AS term_match
+GROUP BY character_id, term_match[1]
+ON CONFLICT DO NOTHING;
+
+INSERT INTO movie_term_counts (movie_id, term, number_of_uses)
+SELECT characters.movie_id, term, SUM(number_of_uses)
+FROM character_term_counts
+JOIN characters ON characters.character_id = character_term_counts.character_id
+GROUP BY characters.movie_id, term
+ON CONFLICT DO NOTHING;
+
+UPDATE character_line_counts
+SET number_of_words = COALESCE((
+    SELECT SUM(number_of_uses)
+    FROM character_term_counts
+    WHERE character_term_counts.character_id = character_line_counts.character_id
+), 0);
@@ -0,0 +1,184 @@
+import asyncio
+import os
+import time
+from collections import deque
+import dotenv
+from starlette.routing import Match
+from src import metrics
+from src.responses import ORJSONResponse
+
+# Admission control. Each API route belongs to a route class with its own
+# concurrency limit and bounded wait queue, so a burst of heavy list and search
+# requests, or of long bulk uploads, can't take every pooled connection and
+# starve the cheap lookups.
+# A request beyond the limit waits in its class's queue; once the queue is
+# full, or it has waited ADMISSION_QUEUE_TIMEOUT seconds, it gets a 503 with
+# Retry-After right away instead of queueing for a connection until the client
+# gives up. Limits are per worker process, like the connection pool.
+
+dotenv.load_dotenv()
+
+# routes not listed here are "detail" routes: primary key lookups, rollups and
+# the in-memory graph
+ROUTE_CLASSES = {
+    "/movies/": "list",
+    "/characters/": "list",
+    "/lines/": "list",
+    "/movies/{movie_id}/lines/export": "list",
+    # a bulk upload holds its slot for as long as the client keeps sending
+    "/movies/{movie_id}/conversations/": "write",
+    "/conversations/bulk": "write",
+}
+
+
+def admission_settings():
+    """{route class: (limit, queue size)}, the queue timeout and Retry-After."""
+    dotenv.load_dotenv()
+    classes = {
+        "detail": (
+            int(os.environ.get("ADMISSION_DETAIL_LIMIT", "32")),
+            int(os.environ.get("ADMISSION_DETAIL_QUEUE", "256")),
+        ),
+        "list": (
+            int(os.environ.get("ADMISSION_LIST_LIMIT", "8")),
+            int(os.environ.get("ADMISSION_LIST_QUEUE", "32")),
+        ),
+        "write": (
+            int(os.environ.get("ADMISSION_WRITE_LIMIT", "4")),
+            int(os.environ.get("ADMISSION_WRITE_QUEUE", "32")),
+        ),
+    }
+    timeout = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "5"))
+    retry_after = int(os.environ.get("ADMISSION_RETRY_AFTER", "1"))
+    return classes, timeout, retry_after
+
+
+class Limiter:
+    """
+    A semaphore with a bounded FIFO queue. It is only used from the event
+    loop, so it needs no lock. A limit of 0 admits everything.
+    """
+
+    def __init__(self, name, limit, queue_size, timeout):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters = deque()
+
+    async def acquire(self):
+        """
+        Takes a slot, waiting for one if needed. Returns the reason the
+        request is shed ("queue_full" or "timeout") instead, or None.
+        """
+        if self.limit <= 0:
+            return None
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return None
+        if len(self.waiters) >= self.queue_size:
+            return "queue_full"
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as error:
+            if waiter.done():
+                # release() handed this request a slot as the wait ended
+                if isinstance(error, asyncio.CancelledError):
+                    self.release()
+                    raise
+            else:
+                waiter.cancel()
+                self.waiters.remove(waiter)
+                if isinstance(error, asyncio.CancelledError):
+                    raise
+                return "timeout"
+        finally:
+            metrics.admission_wait.observe(time.perf_counter() - start, self.name)
+        return None
+
+    def release(self):
+        if self.limit <= 0:
+            return
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                # the slot passes straight to the next waiter
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": len(self.waiters),
+        }
+
+
+CLASS_LIMITS, QUEUE_TIMEOUT, RETRY_AFTER = admission_settings()
+limiters = {
+    name: Limiter(name, limit, queue_size, QUEUE_TIMEOUT)
+    for name, (limit, queue_size) in CLASS_LIMITS.items()
+}
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying the route class limits."""
+
+    def __init__(
+        self,
+        app,
+        limiters=limiters,
+        route_classes=ROUTE_CLASSES,
+        retry_after=RETRY_AFTER,
+    ):
+        self.app = app
+        self.limiters = limiters
+        self.route_classes = route_classes
+        self.retry_after = retry_after
+        self._routes = None
+
+    def route_class(self, scope):
+        # the middleware runs before routing, so match the path itself; only
+        # routes with OpenAPI tags are limited, not /metrics, /docs and the like
+        if self._routes is None:
+            self._routes = [
+                (route, self.route_classes.get(route.path, "detail"))
+                for route in scope["app"].routes
+                if getattr(route, "tags", None)
+            ]
+        for route, route_class in self._routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route_class
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        limiter = self.limiters.get(self.route_class(scope))
+        if limiter is None:
+            await self.app(scope, receive, send)
+            return
+
+        shed = await limiter.acquire()
+        if shed is not None:
+            metrics.shed_requests.inc(1, limiter.name, shed)
+            response = ORJSONResponse(
+                {"detail": "the server is busy, try again later."},
+                status_code=503,
+                headers={"Retry-After": str(self.retry_after)},
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
@@ -1,15 +1,43 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from enum import Enum
-from collections import Counter
+from typing import List, Optional, Union
 
 from fastapi.params import Query
 from src import database as db
+from src import (
+    batch,
+    cache,
+    etags,
+    formats,
+    graph,
+    pagination,
+    prepared,
+    snapshot,
+    vocabulary,
+)
+from src.datatypes import (
+    Character,
+    CharacterDetail,
+    CharacterNetwork,
+    CharacterPage,
+    CharacterPath,
+    CharacterVocabulary,
+    ConversationPartner,
+    DistinctiveTerm,
+    NetworkCharacter,
+    NetworkEdge,
+    PathStep,
+    TermCount,
+)
+from src.responses import ORJSONResponse
 import sqlalchemy
 
 router = APIRouter()
 
-@router.get("/characters/{id}", tags=["characters"])
-def get_character(id: int):
+
+@router.get("/characters/{id}", tags=["characters"], response_model=CharacterDetail)
+@db.asyncable
+def get_character(id: int, request: Request):
     """
     This endpoint returns a single character by its identifier. For each character
     it returns:
@@ -28,62 +56,302 @@ def get_character(id: int):
     * `gender`: The gender of the character.
     * `number_of_lines_together`: The number of lines the character has with the
       originally queried character.
+
+    The response has an `ETag` that changes whenever a conversation is added to
+    the character's movie. Send it back in `If-None-Match` to get an empty 304
+    response while the character is unchanged.
     """
+    return etags.conditional_get(
+        request,
+        ("character", id),
+        lambda: load_character(id),
+        lambda: character_version(id),
+    )
 
-    char_stmt = sqlalchemy.text("""
-                SELECT character_id, name, title, gender 
-                FROM characters
-                JOIN movies ON movies.movie_id = characters.movie_id
-                WHERE characters.character_id = (:id)
-              """)
-    conv_stmt = sqlalchemy.text("""
-                  SELECT character1_id, character2_id, COUNT(lines) AS num_lines, name, gender,  characters.character_id
-                  FROM conversations
-                  JOIN lines ON conversations.conversation_id = lines.conversation_id
-                  JOIN characters ON characters.character_id = character1_id OR characters.character_id = character2_id 
-                  WHERE (character1_id = :id AND characters.character_id = character2_id) OR
-                        (character2_id = :id AND characters.character_id = character1_id)
-
-                  GROUP BY conversations.character1_id, conversations.character2_id, characters.name, characters.gender, characters.character_id
-                  ORDER BY num_lines DESC, characters.character_id ASC
-                """)
-    with db.engine.connect() as conn:
-        char_result = conn.execute(char_stmt, [{"id": id}])
-        conv_result = conn.execute(conv_stmt, [{"id": id}])
-        json = {}
-        for row in char_result:
-            json["character_id"] = row.character_id
-            json["character"] = row.name
-            json["movie"] = row.title
-            json["gender"] = row.gender
-            json["top_conversations"] = []
-        for row in conv_result:
-            json["top_conversations"].append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "gender": row.gender,
-                    "number_of_lines_together": row.num_lines
-                }
-            ) 
-    if json != {}:      
-        return json
-    
+
+CHARACTER_VERSION = prepared.Statement(
+    "character_version",
+    """
+    SELECT COALESCE(movie_versions.version, 0)
+    FROM characters
+    LEFT JOIN movie_versions ON movie_versions.movie_id = characters.movie_id
+    WHERE characters.character_id = :id
+""",
+)
+
+
+def character_version(id):
+    with db.reader().connect() as conn:
+        return CHARACTER_VERSION.execute(conn, [{"id": id}]).scalar_one_or_none()
+
+
+def load_character(id):
+    loaded = load_characters([id])
+    if id in loaded:
+        return loaded[id]
     raise HTTPException(status_code=404, detail="character not found.")
 
 
+CHARACTERS = prepared.Statement(
+    "load_characters",
+    """
+    SELECT characters.character_id, characters.movie_id, characters.name, title,
+           characters.gender, COALESCE(movie_versions.version, 0) AS version,
+           partner.character_id AS partner_id, partner.name AS partner_name,
+           partner.gender AS partner_gender, partner.num_lines
+    FROM characters
+    JOIN movies ON movies.movie_id = characters.movie_id
+    LEFT JOIN movie_versions ON movie_versions.movie_id = characters.movie_id
+    LEFT JOIN LATERAL (
+        SELECT others.character_id, others.name, others.gender,
+               pairs.number_of_lines AS num_lines
+        FROM character_pair_line_counts AS pairs
+        JOIN characters AS others ON others.character_id =
+              CASE WHEN pairs.character1_id = characters.character_id
+                   THEN pairs.character2_id
+                   ELSE pairs.character1_id END
+        WHERE (pairs.character1_id = characters.character_id
+               OR pairs.character2_id = characters.character_id)
+          AND pairs.number_of_lines > 0
+    ) AS partner ON true
+    WHERE characters.character_id = ANY(CAST(:ids AS integer[]))
+    ORDER BY characters.character_id, partner.num_lines DESC, partner.character_id ASC
+""",
+)
+
+
+def load_characters(ids):
+    """
+    Loads several characters with one query, as {id: (Versioned json, cache
+    tags)}.
+    """
+    # one statement, so the version and the conversations come from the same snapshot
+    with db.reader().connect() as conn:
+        result = CHARACTERS.execute(conn, [{"ids": ids}])
+        json = {}
+        versions = {}
+        movie_ids = {}
+        for row in result:
+            if row.character_id not in json:
+                versions[row.character_id] = row.version
+                movie_ids[row.character_id] = row.movie_id
+                json[row.character_id] = CharacterDetail(
+                    row.character_id, row.name, row.title, row.gender, []
+                )
+            if row.partner_id is not None:
+                json[row.character_id].top_conversations.append(
+                    ConversationPartner(
+                        row.partner_id,
+                        row.partner_name,
+                        row.partner_gender,
+                        row.num_lines,
+                    )
+                )
+    # the version is the movie's, so any write to the movie makes it stale
+    return {
+        id: (
+            etags.Versioned(character, versions[id]),
+            [cache.character_tag(id), cache.movie_tag(movie_ids[id])],
+        )
+        for id, character in json.items()
+    }
+
+
+@router.get(
+    "/characters/{id}/network", tags=["characters"], response_model=CharacterNetwork
+)
+@db.asyncable
+def get_character_network(id: int, depth: int = Query(1, ge=1, le=5)):
+    """
+    This endpoint returns the characters within `depth` conversations of a
+    character: its conversation partners, their partners, and so on. It
+    returns:
+    * `character_id`: the id of the queried character.
+    * `depth`: the number of hops searched.
+    * `characters`: the characters reached, each with its `character_id`,
+      `character` name and `distance` in hops (0 for the queried character),
+      ordered by distance and id.
+    * `edges`: the pairs of these characters that talk to each other, each
+      with `character1_id`, `character2_id` and the `number_of_lines` of
+      their conversations together.
+
+    Answered from an in-memory graph; see `/characters/{a}/path/{b}`.
+    """
+    network = graph.current()
+    if id not in network.index:
+        raise HTTPException(status_code=404, detail="character not found.")
+
+    distances, edges = network.network(id, depth)
+    return ORJSONResponse(
+        CharacterNetwork(
+            id,
+            depth,
+            [
+                NetworkCharacter(network.ids[i], network.names[i], distance)
+                for i, distance in sorted(
+                    distances.items(), key=lambda item: (item[1], item[0])
+                )
+            ],
+            [
+                NetworkEdge(network.ids[i], network.ids[j], n)
+                for i, j, n in sorted(edges)
+            ],
+        )
+    )
+
+
+@router.get(
+    "/characters/{a}/path/{b}", tags=["characters"], response_model=CharacterPath
+)
+@db.asyncable
+def get_character_path(a: int, b: int):
+    """
+    This endpoint returns the shortest chain of conversations linking two
+    characters (the degrees of separation between them). It returns:
+    * `degrees`: the number of conversations in the chain, 0 if `a` and `b`
+      are the same character.
+    * `path`: the characters from `a` to `b`, each with its `character_id`,
+      `character` name and `lines_with_previous`, the number of lines it has
+      with the character before it (`null` for `a`).
+
+    Ties between equally short chains go to the lower character ids. The
+    endpoint answers from an in-memory graph of the line counts between
+    characters, which is rebuilt every few minutes and updated right away for
+    conversations added through this worker.
+    """
+    network = graph.current()
+    if a not in network.index or b not in network.index:
+        raise HTTPException(status_code=404, detail="character not found.")
+
+    path = network.path(a, b)
+    if path is None:
+        raise HTTPException(status_code=404, detail="characters are not connected.")
+
+    steps = [PathStep(network.ids[path[0]], network.names[path[0]], None)]
+    for previous, i in zip(path, path[1:]):
+        steps.append(
+            PathStep(network.ids[i], network.names[i], network.edges(previous)[i])
+        )
+    return ORJSONResponse(CharacterPath(len(path) - 1, steps))
+
+
+@router.get(
+    "/characters/{id}/vocabulary",
+    tags=["characters"],
+    response_model=CharacterVocabulary,
+)
+@db.asyncable
+def get_character_vocabulary(
+    id: int,
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    stop_words: bool = False,
+):
+    """
+    This endpoint returns the vocabulary of a character's lines, in the same
+    form as `/movies/{movie_id}/vocabulary`:
+    * `character_id`: the internal id of the character.
+    * `character`: The name of the character.
+    * `movie_id`: the id of the character's movie.
+    * `number_of_words`, `number_of_terms`, `type_token_ratio` and `top_terms`
+      for the character's lines.
+    * `distinctive_terms`: Up to `limit` words the character uses more often
+      than the rest of the characters in the movie, where
+      `number_of_uses_elsewhere` counts their uses by those other characters.
+
+    The response has an `ETag` that works like the one of `/characters/{id}`.
+    """
+    return etags.conditional_get(
+        request,
+        ("character_vocabulary", id, limit, stop_words),
+        lambda: load_character_vocabulary(id, limit, stop_words),
+        lambda: character_version(id),
+    )
+
+
+def load_character_vocabulary(id, limit, stop_words):
+    with db.reader().connect() as conn:
+        character = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT name, characters.movie_id,
+                   COALESCE(movie_versions.version, 0) AS version
+            FROM characters
+            LEFT JOIN movie_versions ON movie_versions.movie_id = characters.movie_id
+            WHERE characters.character_id = :id
+        """
+            ),
+            [{"id": id}],
+        ).first()
+        if character is None:
+            raise HTTPException(status_code=404, detail="character not found.")
+        terms = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT character_terms.term, character_terms.number_of_uses,
+                   movie_terms.number_of_uses - character_terms.number_of_uses
+                       AS number_of_uses_elsewhere
+            FROM character_term_counts AS character_terms
+            JOIN movie_term_counts AS movie_terms
+              ON movie_terms.movie_id = :movie_id
+             AND movie_terms.term = character_terms.term
+            WHERE character_terms.character_id = :id
+              AND character_terms.number_of_uses > 0
+        """
+            ),
+            [{"id": id, "movie_id": character.movie_id}],
+        ).all()
+        movie_words = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT COALESCE(SUM(number_of_words), 0)
+            FROM character_line_counts
+            WHERE movie_id = :movie_id
+        """
+            ),
+            [{"movie_id": character.movie_id}],
+        ).scalar_one()
+
+    words, number_of_terms, ratio, top, distinctive = vocabulary.summarize(
+        terms, movie_words - sum(row.number_of_uses for row in terms), limit, stop_words
+    )
+    result = CharacterVocabulary(
+        id,
+        character.name,
+        character.movie_id,
+        words,
+        number_of_terms,
+        ratio,
+        [TermCount(*row) for row in top],
+        [DistinctiveTerm(*row) for row in distinctive],
+    )
+    # the rest of the movie's lines matter too
+    return etags.Versioned(result, character.version), [
+        cache.character_tag(id),
+        cache.movie_tag(character.movie_id),
+    ]
+
+
 class character_sort_options(str, Enum):
     character = "character"
     movie = "movie"
     number_of_lines = "number_of_lines"
 
 
-@router.get("/characters/", tags=["characters"])
+@router.get(
+    "/characters/",
+    tags=["characters"],
+    response_model=Union[List[Character], CharacterPage, List[CharacterDetail]],
+)
+@db.asyncable
 def list_characters(
+    request: Request,
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: character_sort_options = character_sort_options.character,
+    cursor: Optional[str] = None,
+    ids: Optional[str] = None,
 ):
     """
     This endpoint returns a list of characters. For each character it returns:
@@ -105,72 +373,102 @@ def list_characters(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    For deep paging, pass `cursor` instead of `offset` (an empty `cursor` starts
+    at the first page). The response is then an object with the characters in
+    `results` and a `next_cursor` to pass for the following page, which is
+    `null` on the last page.
+
+    To fetch several characters at once, pass their ids as `ids`, separated by
+    commas (at most 250). The response is then a list of characters in the same
+    form as `/characters/{id}`, in the order given; ids that don't exist are
+    left out and the other parameters are ignored.
+
+    JSON is the default. Send `Accept: application/msgpack` for MessagePack or
+    `Accept: application/vnd.apache.arrow.stream` for an Arrow IPC stream
+    with a column per field (a page's `next_cursor` is in the schema
+    metadata).
     """
+    if ids is not None:
+        return formats.respond(
+            request,
+            batch.lookup(
+                batch.parse_ids(ids), lambda id: ("character", id), load_characters
+            ),
+        )
+
+    pagination.check_paging(cursor, offset)
+
+    columns = snapshot.current()
+    body = columns and columns.list_characters(name, sort.value, limit, offset, cursor)
+    if body is not None:
+        return formats.respond(request, body, Character)
 
-    # if sort is character_sort_options.character:
-    #     order_by = """characters.name"""
-    # elif sort is character_sort_options.movie:
-    #     order_by = """title"""
-    # elif sort is character_sort_options.number_of_lines:
-    #     order_by = """number_of_lines DESC"""
-    # else:
-    #     assert False
     if sort is character_sort_options.character:
-        stmt = sqlalchemy.text("""                            
-            SELECT title, characters.character_id, name, COUNT(lines) AS number_of_lines
-            FROM characters                             
-            JOIN movies ON movies.movie_id = characters.movie_id
-            JOIN lines ON characters.character_id = lines.character_id
-            WHERE name ILIKE :char_name
-            GROUP BY movies.title, characters.character_id 
-            ORDER BY characters.name ASC, characters.character_id ASC             
-            OFFSET :offset         
-            LIMIT :limit                     
-        """)
+        sort_column, id_column, descending, sort_key = (
+            "characters.name",
+            "characters.character_id",
+            False,
+            "character",
+        )
     elif sort is character_sort_options.movie:
-        stmt = sqlalchemy.text("""                            
-            SELECT title, characters.character_id, name, COUNT(lines) AS number_of_lines
-            FROM characters                             
-            JOIN movies ON movies.movie_id = characters.movie_id
-            JOIN lines ON characters.character_id = lines.character_id
-            WHERE name ILIKE :char_name
-            GROUP BY movies.title, characters.character_id 
-            ORDER BY title ASC, characters.character_id ASC             
-            OFFSET :offset         
-            LIMIT :limit                     
-        """)
+        sort_column, id_column, descending, sort_key = (
+            "title",
+            "characters.character_id",
+            False,
+            "movie",
+        )
     elif sort is character_sort_options.number_of_lines:
-        stmt = sqlalchemy.text("""                            
-            SELECT title, characters.character_id, name, COUNT(lines) AS number_of_lines
-            FROM characters                             
-            JOIN movies ON movies.movie_id = characters.movie_id
-            JOIN lines ON characters.character_id = lines.character_id
-            WHERE name ILIKE :char_name
-            GROUP BY movies.title, characters.character_id 
-            ORDER BY number_of_lines DESC, characters.character_id ASC             
-            OFFSET :offset         
-            LIMIT :limit                     
-        """)
+        sort_column, id_column, descending, sort_key = (
+            "counts.number_of_lines",
+            "counts.character_id",
+            True,
+            "number_of_lines",
+        )
     else:
         assert False
-    
-    #ORDER BY :order_by, characters.character_id ASC  
-
-    
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt, [{"char_name": f"%{name}%",
-                                      # "order_by": order_by, 
-                                      "offset": offset,
-                                      "limit": limit}])
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "movie": row.title,
-                    "number_of_lines": row.number_of_lines
-                }
-            )
-
-    return json
+
+    params = {"char_name": f"%{name}%", "offset": offset, "limit": limit}
+    after = ""
+    if cursor:
+        params["cursor_value"], params["cursor_id"] = pagination.decode_cursor(
+            cursor, sort.value
+        )
+        after = "AND " + pagination.keyset_condition(
+            sort_column, id_column, descending, params["cursor_value"]
+        )
+
+    stmt = sqlalchemy.text(
+        f"""
+            SELECT title, characters.character_id, name, counts.number_of_lines
+            FROM characters
+            JOIN movies ON movies.movie_id = characters.movie_id
+            JOIN character_line_counts AS counts
+                ON counts.character_id = characters.character_id
+            WHERE name ILIKE :char_name AND counts.number_of_lines > 0
+            {after}
+            ORDER BY {sort_column} {"DESC" if descending else "ASC"}, {id_column} ASC
+            OFFSET :offset
+            LIMIT :limit
+        """
+    )
+
+    with db.reader().connect() as conn:
+        result = conn.execute(stmt, [params])
+        json = [
+            Character(row.character_id, row.name, row.title, row.number_of_lines)
+            for row in result
+        ]
+
+    if cursor is not None:
+        return formats.respond(
+            request,
+            CharacterPage(
+                json,
+                pagination.next_cursor(
+                    json, limit, sort.value, sort_key, "character_id"
+                ),
+            ),
+            Character,
+        )
+    return formats.respond(request, json, Character)
@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.params import Query
 from src import database as db
-from pydantic import BaseModel
+from src import cache, graph, prepared, rollups, snapshot
+from pydantic import BaseModel, ValidationError
 from typing import List
-from datetime import datetime
 import sqlalchemy
 
 
@@ -19,68 +20,60 @@ class ConversationJson(BaseModel):
     lines: List[LinesJson]
 
 
+# One record of a bulk NDJSON upload: a conversation plus the movie it is in.
+class BulkConversationJson(ConversationJson):
+    movie_id: int
+
+
 router = APIRouter()
 
-def check_input(movie_id, ch_id1, ch_id2):
+
+def check_lines(conversation):
+    ch_id1 = conversation.character_1_id
+    ch_id2 = conversation.character_2_id
     if ch_id1 == ch_id2:
         raise HTTPException(status_code=404, detail="characters are the same.")
-    with db.engine.connect() as conn:  
-        # check if movie exists
-        mov_result = conn.execute(sqlalchemy.text("""
-            SELECT movies.movie_id
-            FROM movies
-            WHERE movies.movie_id = :id
-        """), [{"id": movie_id}])
-        m = 0
-        for row in mov_result:
-            m +=1
-        if m==0:
-            raise HTTPException(status_code=404, detail="movie not found.")
-        
-        # check if characters exist and match movie
-        char_result = conn.execute(sqlalchemy.text("""
-            SELECT movies.movie_id, character_id
-            FROM movies
-            JOIN characters ON characters.movie_id = movies.movie_id
-            WHERE (character_id = :ch_id1 OR
-                character_id = :ch_id2)
-        """), [{"ch_id1": ch_id1, "ch_id2": ch_id2}])
-        for idx, row in enumerate(char_result):
-            if row.movie_id != movie_id:
-                raise HTTPException(status_code=404, detail="character and movie do not match") 
-        if idx + 1 != 2:
-            raise HTTPException(status_code=404, detail="character not found.")
 
+    # check that every line is spoken by one of the two characters
+    for line in conversation.lines:
+        if line.character_id != ch_id1 and line.character_id != ch_id2:
+            raise HTTPException(
+                status_code=404, detail="character does not match line."
+            )
 
 
-def get_newIDs():
-    # get the id of the last line 
-    line_id_stmt = sqlalchemy.text("""
-            SELECT line_id
-            FROM lines
-            ORDER BY line_id DESC
-            LIMIT 1
-        """)
-    # get the id of the last conversation 
-    conv_id_stmt = sqlalchemy.text("""
-            SELECT conversation_id AS conv_id
-            FROM conversations
-            ORDER BY conversation_id DESC
-            LIMIT 1
-        """)
-    with db.engine.connect() as conn:        
-        line_id_result = conn.execute(line_id_stmt)
-        conv_id_result = conn.execute(conv_id_stmt)
-        ids = []
-        # get the highest ids and add 1 for the new ids
-        for row in conv_id_result:
-            ids.append(row.conv_id + 1)
-        for row in line_id_result:
-            ids.append(row.line_id + 1)
-        return ids
-    
+# whether the movie exists and both characters exist and belong to it
+CHECK_INPUT = prepared.Statement(
+    "check_input",
+    """
+    SELECT
+        (SELECT COUNT(*) FROM movies WHERE movies.movie_id = :m_id) AS num_movies,
+        COUNT(*) AS num_characters,
+        COUNT(*) FILTER (WHERE characters.movie_id <> :m_id) AS num_other_movie
+    FROM characters
+    WHERE character_id IN (:ch_id1, :ch_id2)
+""",
+)
+
+
+def check_input(conn, movie_id, conversation):
+    ch_id1 = conversation.character_1_id
+    ch_id2 = conversation.character_2_id
+    check_lines(conversation)
+
+    result = CHECK_INPUT.execute(
+        conn, [{"m_id": movie_id, "ch_id1": ch_id1, "ch_id2": ch_id2}]
+    ).one()
+    if result.num_movies == 0:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    if result.num_other_movie > 0:
+        raise HTTPException(status_code=404, detail="character and movie do not match")
+    if result.num_characters != 2:
+        raise HTTPException(status_code=404, detail="character not found.")
+
 
 @router.post("/movies/{movie_id}/conversations/", tags=["movies"])
+@db.asyncable
 def add_conversation(movie_id: int, conversation: ConversationJson):
     """
     This endpoint adds a conversation to a movie. The conversation is represented
@@ -95,50 +88,290 @@ def add_conversation(movie_id: int, conversation: ConversationJson):
     request body.
 
     The endpoint returns the id of the resulting conversation that was created.
-    """ 
-    check_input(movie_id, conversation.character_1_id, conversation.character_2_id)
-    
-    conv_id, line_id = get_newIDs()
-
+    """
     with db.engine.begin() as conn:
-        # Insert new conversation
-        conn.execute(
-            sqlalchemy.text("""
-                INSERT INTO conversations (conversation_id, character1_id, character2_id, movie_id) 
-                VALUES (:w, :x, :y, :z)
-            """),
-                [{
-                    "w": conv_id, 
-                    "x": conversation.character_1_id, 
-                    "y": conversation.character_2_id, 
-                    "z": movie_id
-                }]
+        check_input(conn, movie_id, conversation)
+
+        # Insert the conversation and all of its lines in one statement. Ids come
+        # from the table sequences (see migrations/004_id_sequences.sql).
+        conv_id = conn.execute(
+            sqlalchemy.text(
+                """
+                WITH conv AS (
+                    INSERT INTO conversations (character1_id, character2_id, movie_id)
+                    VALUES (:ch_id1, :ch_id2, :m_id)
+                    RETURNING conversation_id
+                ), new_lines AS (
+                    INSERT INTO lines
+                        (character_id, movie_id, conversation_id, line_sort, line_text)
+                    SELECT line.character_id, CAST(:m_id AS integer),
+                           conv.conversation_id, line.line_sort, line.line_text
+                    FROM conv,
+                         unnest(CAST(:ch_ids AS integer[]), CAST(:texts AS text[]))
+                            WITH ORDINALITY AS line (character_id, line_text, line_sort)
+                )
+                SELECT conversation_id FROM conv
+            """
+            ),
+            [
+                {
+                    "ch_id1": conversation.character_1_id,
+                    "ch_id2": conversation.character_2_id,
+                    "m_id": movie_id,
+                    "ch_ids": [line.character_id for line in conversation.lines],
+                    "texts": [line.line_text for line in conversation.lines],
+                }
+            ],
+        ).scalar_one()
+
+        # keep the line-count rollups in step with the inserted lines
+        rollups.add_lines(
+            conn,
+            movie_id,
+            conversation.character_1_id,
+            conversation.character_2_id,
+            [(line.character_id, line.line_text) for line in conversation.lines],
         )
 
-        # Insert each line in the conversation
-        for idx, line in enumerate(conversation.lines):
-            # check if lines character matches conversations character
-            if (line.character_id != conversation.character_1_id
-                and line.character_id != conversation.character_2_id):
-                raise HTTPException(status_code=404, detail="character does not match line.")
-            
+    # only after commit, so a concurrent read can't re-cache the old data
+    db.wrote()
+    cache.entities.invalidate(
+        [
+            cache.movie_tag(movie_id),
+            cache.character_tag(conversation.character_1_id),
+            cache.character_tag(conversation.character_2_id),
+            cache.pair_tag(conversation.character_1_id, conversation.character_2_id),
+        ]
+    )
+    graph.add_pairs(
+        {
+            (conversation.character_1_id, conversation.character_2_id): len(
+                conversation.lines
+            )
+        }
+    )
+    snapshot.invalidate()
+    return conv_id
+
+
+def check_known(conversation, movie_ids, character_movies):
+    """Bulk version of the database half of check_input, using prefetched ids."""
+    if conversation.movie_id not in movie_ids:
+        raise HTTPException(status_code=404, detail="movie not found.")
+    for ch_id in (conversation.character_1_id, conversation.character_2_id):
+        if ch_id not in character_movies:
+            raise HTTPException(status_code=404, detail="character not found.")
+        if character_movies[ch_id] != conversation.movie_id:
+            raise HTTPException(
+                status_code=404, detail="character and movie do not match"
+            )
+
+
+def insert_chunk(chunk, result):
+    """
+    Validates and writes one chunk of (record number, BulkConversationJson)
+    pairs in a single transaction, adding counts and per-record errors to
+    `result`.
+    """
+    checked = []
+    for record, conversation in chunk:
+        try:
+            check_lines(conversation)
+            checked.append((record, conversation))
+        except HTTPException as e:
+            result["errors"].append({"record": record, "detail": e.detail})
+    if not checked:
+        return
+
+    counts = rollups.LineCounts()
+    valid = []
+    try:
+        with db.engine.begin() as conn:
+            # look up every movie and character in the chunk at once
+            known = conn.execute(
+                sqlalchemy.text(
+                    """
+                SELECT 'movie' AS kind, movie_id AS id, movie_id
+                FROM movies
+                WHERE movie_id = ANY(CAST(:movie_ids AS integer[]))
+                UNION ALL
+                SELECT 'character' AS kind, character_id AS id, movie_id
+                FROM characters
+                WHERE character_id = ANY(CAST(:ch_ids AS integer[]))
+            """
+                ),
+                [
+                    {
+                        "movie_ids": list({conv.movie_id for _, conv in checked}),
+                        "ch_ids": list(
+                            {
+                                ch_id
+                                for _, conv in checked
+                                for ch_id in (conv.character_1_id, conv.character_2_id)
+                            }
+                        ),
+                    }
+                ],
+            )
+            movie_ids = set()
+            character_movies = {}
+            for row in known:
+                if row.kind == "movie":
+                    movie_ids.add(row.id)
+                else:
+                    character_movies[row.id] = row.movie_id
+
+            for record, conversation in checked:
+                try:
+                    check_known(conversation, movie_ids, character_movies)
+                    valid.append((record, conversation))
+                except HTTPException as e:
+                    result["errors"].append({"record": record, "detail": e.detail})
+            if not valid:
+                return
+
+            conv_ids = (
+                conn.execute(
+                    sqlalchemy.text(
+                        """
+                SELECT nextval('conversations_conversation_id_seq') AS conv_id
+                FROM generate_series(1, :n)
+            """
+                    ),
+                    [{"n": len(valid)}],
+                )
+                .scalars()
+                .all()
+            )
+
+            conv_rows = {"conv_ids": [], "ch_ids1": [], "ch_ids2": [], "movie_ids": []}
+            line_rows = {
+                "conv_ids": [],
+                "ch_ids": [],
+                "movie_ids": [],
+                "sorts": [],
+                "texts": [],
+            }
+            for conv_id, (_, conversation) in zip(conv_ids, valid):
+                conv_rows["conv_ids"].append(conv_id)
+                conv_rows["ch_ids1"].append(conversation.character_1_id)
+                conv_rows["ch_ids2"].append(conversation.character_2_id)
+                conv_rows["movie_ids"].append(conversation.movie_id)
+                for idx, line in enumerate(conversation.lines):
+                    line_rows["conv_ids"].append(conv_id)
+                    line_rows["ch_ids"].append(line.character_id)
+                    line_rows["movie_ids"].append(conversation.movie_id)
+                    line_rows["sorts"].append(idx + 1)
+                    line_rows["texts"].append(line.line_text)
+                counts.add_conversation(
+                    conversation.movie_id,
+                    conversation.character_1_id,
+                    conversation.character_2_id,
+                    [
+                        (line.character_id, line.line_text)
+                        for line in conversation.lines
+                    ],
+                )
+
+            conn.execute(
+                sqlalchemy.text(
+                    """
+                INSERT INTO conversations
+                    (conversation_id, character1_id, character2_id, movie_id)
+                SELECT * FROM unnest(
+                    CAST(:conv_ids AS integer[]),
+                    CAST(:ch_ids1 AS integer[]),
+                    CAST(:ch_ids2 AS integer[]),
+                    CAST(:movie_ids AS integer[])
+                )
+            """
+                ),
+                [conv_rows],
+            )
             conn.execute(
-                sqlalchemy.text("""
-                    INSERT INTO lines (line_id, character_id, movie_id, conversation_id, line_sort, line_text) 
-                    VALUES (:l_id, :ch_id, :m_id, :conv_id, :sort, :text)
-                """),
-                    [{
-                        "l_id": line_id, 
-                        "ch_id": line.character_id, 
-                        "m_id": movie_id, 
-                        "conv_id": conv_id,
-                        "sort": idx + 1,
-                        "text": line.line_text
-                    }]
+                sqlalchemy.text(
+                    """
+                INSERT INTO lines
+                    (conversation_id, character_id, movie_id, line_sort, line_text)
+                SELECT * FROM unnest(
+                    CAST(:conv_ids AS integer[]),
+                    CAST(:ch_ids AS integer[]),
+                    CAST(:movie_ids AS integer[]),
+                    CAST(:sorts AS integer[]),
+                    CAST(:texts AS text[])
+                )
+            """
+                ),
+                [line_rows],
+            )
+            counts.apply(conn)
+    except sqlalchemy.exc.DBAPIError:
+        # the whole chunk was rolled back; report it and keep going
+        for record, _ in valid or checked:
+            result["errors"].append(
+                {"record": record, "detail": "chunk could not be written."}
             )
-            line_id += 1
-        return conv_id
+        return
+
+    result["conversations_added"] += len(valid)
+    result["lines_added"] += len(line_rows["texts"])
+    db.wrote()
+    cache.entities.invalidate(
+        [cache.movie_tag(m_id) for m_id in counts.movies]
+        + [cache.character_tag(ch_id) for pair in counts.pairs for ch_id in pair]
+        + [cache.pair_tag(*pair) for pair in counts.pairs]
+    )
+    graph.add_pairs(counts.pairs)
+    snapshot.invalidate()
+
+
+async def ndjson_records(stream):
+    """Yields (line number, text) for each non-blank line of a byte stream."""
+    buffer = b""
+    number = 0
+    async for chunk in stream:
+        buffer += chunk
+        *complete, buffer = buffer.split(b"\n")
+        for line in complete:
+            number += 1
+            if line.strip():
+                yield number, line
+    if buffer.strip():
+        yield number + 1, buffer
 
-    
 
-        
+@router.post("/conversations/bulk", tags=["movies"])
+async def add_conversations_bulk(
+    request: Request,
+    chunk_size: int = Query(1000, ge=1, le=10000),
+):
+    """
+    This endpoint adds many conversations at once, possibly across movies. The
+    request body is newline-delimited JSON: one conversation per line, shaped
+    like the body of `/movies/{movie_id}/conversations/` plus a `movie_id`.
+
+    Records are checked the same way as the single conversation endpoint and
+    written in transactions of `chunk_size` conversations. A bad record does not
+    stop the upload; it is reported instead.
+
+    The endpoint returns:
+    * `conversations_added`: the number of conversations written.
+    * `lines_added`: the number of lines written.
+    * `errors`: a list of records that were not written, each with the
+      `record` (line number in the body) and the `detail` of what was wrong.
+    """
+    result = {"conversations_added": 0, "lines_added": 0, "errors": []}
+    chunk = []
+    async for record, text in ndjson_records(request.stream()):
+        try:
+            chunk.append((record, BulkConversationJson.parse_raw(text)))
+        except ValidationError as e:
+            result["errors"].append({"record": record, "detail": e.errors()})
+        if len(chunk) >= chunk_size:
+            await db.run_sync(insert_chunk, chunk, result)
+            chunk = []
+    if chunk:
+        await db.run_sync(insert_chunk, chunk, result)
+
+    result["errors"].sort(key=lambda error: error["record"])
+    return result
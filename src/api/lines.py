@@ -1,15 +1,30 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.params import Query
 from enum import Enum
+from pydantic import BaseModel
+from typing import List, Optional, Union
 from src import database as db
+from src import batch, cache, etags, formats, pagination, prepared, similarity, snapshot
+from src.datatypes import (
+    Conversation,
+    ConversationLine,
+    Line,
+    LineDetail,
+    LinePage,
+    SimilarLine,
+)
+from src.responses import ORJSONResponse
 import sqlalchemy
 
 router = APIRouter()
 
 
-@router.get("/lines/conv/{conv_id}", tags=["lines"])
-def get_char_conversations(conv_id: int):
+@router.get("/lines/conv/{conv_id}", tags=["lines"], response_model=Conversation)
+@db.asyncable
+def get_char_conversations(conv_id: int, request: Request):
     """
-    This endpoint returns a conversation by its identifier. For the conversation it returns:
+    This endpoint returns a conversation by its identifier. For the conversation
+    it returns:
     * `movie_title`: The title of the movie the conversation is in.
     * `ch1`: the name of one character in the conversation.
     * `ch2`: the name of the other character in the conversation.
@@ -19,46 +34,115 @@ def get_char_conversations(conv_id: int):
     * `character`: the name of the character saying the line.
     * `line`: the text of the line.
 
+    The response has an `ETag` for use with `If-None-Match`, as for
+    `/movies/{movie_id}`.
     """
-    stmt = sqlalchemy.text("""
-                    SELECT title, name, line_text, 
-                            (conversations.character1_id = characters.character_id) AS is_ch1
-                    FROM conversations
-                    JOIN movies ON movies.movie_id = conversations.movie_id
-                    JOIN lines ON lines.conversation_id = conversations.conversation_id
-                    JOIN characters ON lines.character_id = characters.character_id
-                    WHERE conversations.conversation_id = :id
-                    ORDER BY lines.line_sort
-                """)
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt, [{"id": conv_id}])
-        json = {}
-        for idx, row in enumerate(result):
-            if idx == 0:
-                json = {
-                    "movie_title": row.title,  
-                    "ch1": None,
-                    "ch2": None,
-                    "lines":[]
-                }
-            if json["ch1"] == None and row.is_ch1:
-                json["ch1"] = row.name
-            elif json["ch2"] == None and not row.is_ch1:
-                json["ch2"] = row.name
-            json["lines"].append(
-                {
-                    "character": row.name,
-                    "line": row.line_text
-                }
-            ) 
-    if json != {}:      
-        return json
-    
+    return etags.conditional_get(
+        request,
+        ("conversation", conv_id),
+        lambda: load_conversation(conv_id),
+        lambda: conversation_version(conv_id),
+    )
+
+
+CONVERSATION_VERSION = prepared.Statement(
+    "conversation_version",
+    """
+    SELECT COALESCE(movie_versions.version, 0)
+    FROM conversations
+    LEFT JOIN movie_versions ON movie_versions.movie_id = conversations.movie_id
+    WHERE conversations.conversation_id = :id
+""",
+)
+
+
+def conversation_version(conv_id):
+    with db.reader().connect() as conn:
+        return CONVERSATION_VERSION.execute(
+            conn, [{"id": conv_id}]
+        ).scalar_one_or_none()
+
+
+def load_conversation(conv_id):
+    loaded = load_conversations([conv_id])
+    if conv_id in loaded:
+        return loaded[conv_id]
     raise HTTPException(status_code=404, detail="conversation not found.")
 
 
-@router.get("/lines/{line_id}", tags=["lines"])
-def get_line(line_id: int):
+CONVERSATIONS = prepared.Statement(
+    "load_conversations",
+    """
+    SELECT conversations.conversation_id, conversations.movie_id, title, name,
+            line_text,
+            (conversations.character1_id = characters.character_id) AS is_ch1,
+            COALESCE(movie_versions.version, 0) AS version
+    FROM conversations
+    JOIN movies ON movies.movie_id = conversations.movie_id
+    LEFT JOIN movie_versions ON movie_versions.movie_id = conversations.movie_id
+    JOIN lines ON lines.conversation_id = conversations.conversation_id
+    JOIN characters ON lines.character_id = characters.character_id
+    WHERE conversations.conversation_id = ANY(CAST(:ids AS integer[]))
+    ORDER BY conversations.conversation_id, lines.line_sort
+""",
+)
+
+
+def load_conversations(conv_ids):
+    """
+    Loads several conversations with one query, as {conv_id: (Versioned json,
+    cache tags)}.
+    """
+    with db.reader().connect() as conn:
+        result = CONVERSATIONS.execute(conn, [{"ids": conv_ids}])
+        conversations = {}
+        versions = {}
+        movie_ids = {}
+        for row in result:
+            json = conversations.get(row.conversation_id)
+            if json is None:
+                versions[row.conversation_id] = row.version
+                movie_ids[row.conversation_id] = row.movie_id
+                json = conversations[row.conversation_id] = Conversation(
+                    row.title, None, None, []
+                )
+            if json.ch1 is None and row.is_ch1:
+                json.ch1 = row.name
+            elif json.ch2 is None and not row.is_ch1:
+                json.ch2 = row.name
+            json.lines.append(ConversationLine(row.name, row.line_text))
+    # conversations never change once written, but their version is the
+    # movie's, which every write to the movie bumps
+    return {
+        conv_id: (
+            etags.Versioned(json, versions[conv_id]),
+            [cache.movie_tag(movie_ids[conv_id])],
+        )
+        for conv_id, json in conversations.items()
+    }
+
+
+@router.get("/lines/conv/", tags=["lines"], response_model=List[Conversation])
+@db.asyncable
+def get_conversations(ids: str):
+    """
+    This endpoint returns several conversations at once. Pass their ids as
+    `ids`, separated by commas (at most 250). Each conversation has the same
+    form as in `/lines/conv/{conv_id}`, in the order given; ids that don't
+    exist are left out.
+    """
+    return ORJSONResponse(
+        batch.lookup(
+            batch.parse_ids(ids), lambda id: ("conversation", id), load_conversations
+        )
+    )
+
+
+@router.get("/lines/{line_id}", tags=["lines"], response_model=LineDetail)
+@db.asyncable
+def get_line(
+    line_id: int, request: Request, context: Optional[int] = Query(None, ge=0)
+):
     """
     This endpoint returns a single line by its identifier. For each line it returns:
     * `line_id`: the internal id of the line.
@@ -67,71 +151,238 @@ def get_line(line_id: int):
     * `text`: the text of the line
     * `conv_id`: the id of the conversation the line is in
     * `other_character_name`: the name of the other character in the conversation
-    * `num_conv_btw_chars`: the number of conversations between these characters in the movie
-    * `conversation`: list of the rest of the lines in the conversation
+    * `num_conv_btw_chars`: the number of conversations between these characters
+      in the movie
+    * `conversation`: list of the lines in the conversation, in order
+
+    Pass `context` to only get the `context` lines before and after this line
+    in `conversation`, instead of the whole conversation.
 
+    The response has an `ETag` for use with `If-None-Match`, as for
+    `/movies/{movie_id}`.
     """
-    # get line information, as well as the characters in the conversation and who is speaking
-    stmt = sqlalchemy.text("""                            
-            SELECT line_id, name, title, line_text,
-                    lines.conversation_id AS conv_id, 
-                    characters.character_id AS speaker_id,
-                    conversations.character1_id AS ch_id1,
-                    conversations.character2_id AS ch_id2
-            FROM lines
-            JOIN characters ON characters.character_id = lines.character_id
-            JOIN movies ON movies.movie_id = lines.movie_id
-            JOIN conversations ON lines.conversation_id = conversations.conversation_id
-            WHERE lines.line_id = :id                           
-        """)    
-
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt, [{"id": line_id}])
-        json = {}
-        
-        for idx, row in enumerate(result):
-            if idx==0:                
-                json = {
-                    "line_id": line_id,
-                    "character_name": row.name,
-                    "movie_title": row.title,
-                    "text": row.line_text,
-                    "conv_id": row.conv_id,
-                    "other_character_name": None,
-                    "num_conv_btw_chars" : None,
-                    "conversation": []
-                }
-                conv_id = row.conv_id
-                ch_id1= row.ch_id1
-                ch_id2= row.ch_id2
-                speaker_id = row.speaker_id
-        if json == {}:
-            raise HTTPException(status_code=404, detail="line not found.")
-        
-        # find number of conversations between characters
-        result = conn.execute(sqlalchemy.text("""                            
-                SELECT COUNT(conversations) AS num_conv
-                FROM conversations
-                WHERE (conversations.character1_id = :ch_id1 and conversations.character2_id = :ch_id2) OR 
-                    (conversations.character2_id = :ch_id1 and conversations.character2_id = :ch_id2)                       
-            """), [{"ch_id1": ch_id1, "ch_id2": ch_id2}])
-        for row in result:
-            json["num_conv_btw_chars"] = row.num_conv
-
-        # find all the lines in the conversation and the other character's name
-        result = conn.execute(sqlalchemy.text("""                            
-                SELECT line_text, lines.character_id, name
-                FROM lines
-                JOIN characters ON characters.character_id = lines.character_id
-                WHERE lines.conversation_id =  :conv_id                     
-            """), [{"conv_id": conv_id}])
+    return etags.conditional_get(
+        request,
+        ("line", line_id, context),
+        lambda: load_line(line_id, context),
+        lambda: line_version(line_id),
+    )
+
+
+LINE_VERSION = prepared.Statement(
+    "line_version",
+    """
+    SELECT COALESCE(movie_versions.version, 0)
+    FROM lines
+    LEFT JOIN movie_versions ON movie_versions.movie_id = lines.movie_id
+    WHERE lines.line_id = :id
+""",
+)
+
+
+def line_version(line_id):
+    with db.reader().connect() as conn:
+        return LINE_VERSION.execute(conn, [{"id": line_id}]).scalar_one_or_none()
+
+
+def load_line(line_id, context=None):
+    loaded = load_lines([line_id], context)
+    if line_id in loaded:
+        return loaded[line_id]
+    raise HTTPException(status_code=404, detail="line not found.")
+
+
+LINES = prepared.Statement(
+    "load_lines",
+    """
+    WITH target AS (
+        SELECT line_id, name, title, line_text, lines.movie_id,
+                COALESCE(movie_versions.version, 0) AS version,
+                lines.conversation_id AS conv_id,
+                characters.character_id AS speaker_id,
+                conversations.character1_id AS ch_id1,
+                conversations.character2_id AS ch_id2
+        FROM lines
+        JOIN characters ON characters.character_id = lines.character_id
+        JOIN movies ON movies.movie_id = lines.movie_id
+        JOIN conversations ON lines.conversation_id = conversations.conversation_id
+        LEFT JOIN movie_versions ON movie_versions.movie_id = lines.movie_id
+        WHERE lines.line_id = ANY(CAST(:ids AS integer[]))
+    ), conv AS (
+        SELECT lines.conversation_id, lines.line_id, lines.character_id,
+                lines.line_text,
+                row_number() OVER (
+                    PARTITION BY lines.conversation_id
+                    ORDER BY lines.line_sort, lines.line_id
+                ) AS position
+        FROM lines
+        WHERE lines.conversation_id IN (SELECT conv_id FROM target)
+    ), pair AS (
+        SELECT target.line_id, COUNT(*) AS num_conv
+        FROM target
+        JOIN conversations ON
+               (conversations.character1_id = target.ch_id1
+                AND conversations.character2_id = target.ch_id2)
+            OR (conversations.character1_id = target.ch_id2
+                AND conversations.character2_id = target.ch_id1)
+        GROUP BY target.line_id
+    ), other AS (
+        SELECT DISTINCT ON (target.line_id) target.line_id,
+               characters.name AS other_name
+        FROM target
+        JOIN conv ON conv.conversation_id = target.conv_id
+            AND conv.character_id <> target.speaker_id
+        JOIN characters ON characters.character_id = conv.character_id
+        ORDER BY target.line_id, conv.position
+    )
+    SELECT target.*, pair.num_conv, other.other_name, conv.line_text AS conv_text
+    FROM target
+    JOIN pair ON pair.line_id = target.line_id
+    LEFT JOIN other ON other.line_id = target.line_id
+    JOIN conv AS target_position ON target_position.line_id = target.line_id
+    JOIN conv ON conv.conversation_id = target.conv_id
+        AND (CAST(:context AS integer) IS NULL
+             OR abs(conv.position - target_position.position)
+                <= CAST(:context AS integer))
+    ORDER BY target.line_id, conv.position
+""",
+)
+
+
+def load_lines(line_ids, context=None):
+    """
+    Loads several lines with one query, as {line_id: (Versioned json, cache tags)}: each
+    line, its pair's conversation count, the other speaker and the
+    conversation's lines (optionally only a window around the line).
+    """
+    with db.reader().connect() as conn:
+        result = LINES.execute(conn, [{"ids": line_ids, "context": context}])
+        lines = {}
         for row in result:
-            if (json["other_character_name"] == None and
-                row.character_id != speaker_id):
-                json["other_character_name"] = row.name
-            json["conversation"].append(row.line_text)
-                
-        return json
+            if row.line_id not in lines:
+                lines[row.line_id] = (
+                    LineDetail(
+                        row.line_id,
+                        row.name,
+                        row.title,
+                        row.line_text,
+                        row.conv_id,
+                        row.other_name,
+                        row.num_conv,
+                        [],
+                    ),
+                    row.version,
+                    [
+                        cache.pair_tag(row.ch_id1, row.ch_id2),
+                        cache.movie_tag(row.movie_id),
+                    ],
+                )
+            lines[row.line_id][0].conversation.append(row.conv_text)
+
+    # num_conv_btw_chars changes whenever these two characters talk again, and
+    # the version whenever anything is added to the movie
+    return {
+        line_id: (etags.Versioned(json, version), tags)
+        for line_id, (json, version, tags) in lines.items()
+    }
+
+
+@router.get(
+    "/lines/{line_id}/similar", tags=["lines"], response_model=List[SimilarLine]
+)
+@db.asyncable
+def get_similar_lines(line_id: int, k: int = Query(10, ge=1, le=similarity.MAX_K)):
+    """
+    This endpoint returns the `k` lines most like a line, by the words they
+    share. Rarer words count for more, as in a TF-IDF search. For each line it
+    returns:
+    * `line_id`: the internal id of the line.
+    * `movie_title`: The title of the movie the line is from.
+    * `character_name`: the name of the character saying the line.
+    * `line_text`: the text of the line.
+    * `score`: the cosine similarity of the two lines' words, from 0 to 1.
+
+    Lines are listed most similar first. The line itself is left out, and so
+    are lines with no words in common with it.
+
+    The results come from an index built with `python -m src.similarity`, so
+    lines added since it was last built are not among them.
+    """
+    index = current_index()
+    vector = index.line_vector(line_id)
+    if vector is None:
+        # added since the index was built
+        with db.reader().connect() as conn:
+            text = conn.execute(
+                sqlalchemy.text("SELECT line_text FROM lines WHERE line_id = :id"),
+                [{"id": line_id}],
+            ).one_or_none()
+        if text is None:
+            raise HTTPException(status_code=404, detail="line not found.")
+        vector = index.vectorize(text.line_text)
+    return ORJSONResponse(load_similar(index.top_k(vector, k, exclude=line_id)))
+
+
+class SimilarText(BaseModel):
+    text: str
+
+
+@router.post("/lines/similar", tags=["lines"], response_model=List[SimilarLine])
+@db.asyncable
+def find_similar_lines(
+    body: SimilarText, k: int = Query(10, ge=1, le=similarity.MAX_K)
+):
+    """
+    This endpoint returns the `k` lines most like the `text` in the request
+    body, in the same form as `/lines/{line_id}/similar`.
+    """
+    index = current_index()
+    return ORJSONResponse(load_similar(index.top_k(index.vectorize(body.text), k)))
+
+
+def current_index():
+    index = similarity.current()
+    if index is None:
+        raise HTTPException(
+            status_code=503, detail="the similarity index has not been built."
+        )
+    return index
+
+
+SIMILAR_LINES = prepared.Statement(
+    "load_similar_lines",
+    """
+    SELECT line_id, title, name, line_text
+    FROM lines
+    JOIN characters ON characters.character_id = lines.character_id
+    JOIN movies ON movies.movie_id = lines.movie_id
+    WHERE lines.line_id = ANY(CAST(:ids AS integer[]))
+""",
+)
+
+
+def load_similar(scored):
+    """SimilarLines for the (line_id, score) pairs in `scored`, in that order."""
+    if not scored:
+        return []
+    with db.reader().connect() as conn:
+        rows = {
+            row.line_id: row
+            for row in SIMILAR_LINES.execute(
+                conn, [{"ids": [line_id for line_id, _ in scored]}]
+            )
+        }
+    return [
+        SimilarLine(
+            line_id,
+            rows[line_id].title,
+            rows[line_id].name,
+            rows[line_id].line_text,
+            score,
+        )
+        for line_id, score in scored
+        if line_id in rows
+    ]
 
 
 class lines_sort_options(str, Enum):
@@ -139,13 +390,34 @@ class lines_sort_options(str, Enum):
     character_name = "character_name"
 
 
+class lines_match_options(str, Enum):
+    substring = "substring"
+    words = "words"
+    phrase = "phrase"
+
+
+# must match the expression indexed in migrations/003_line_text_search.sql
+LINE_TSVECTOR = "to_tsvector('english', coalesce(line_text, ''))"
+
+
 # Add get parameters
-@router.get("/lines/", tags=["lines"])
+@router.get(
+    "/lines/",
+    tags=["lines"],
+    response_model=Union[List[Line], LinePage, List[LineDetail]],
+)
+@db.asyncable
 def list_movies(
+    request: Request,
     name: str = "",
     limit: int = 50,
     offset: int = 0,
     sort: lines_sort_options = lines_sort_options.movie_title,
+    cursor: Optional[str] = None,
+    match: lines_match_options = lines_match_options.substring,
+    rank: bool = False,
+    ids: Optional[str] = None,
+    context: Optional[int] = Query(None, ge=0),
 ):
     """
     This endpoint returns a list of lines. For each line it returns:
@@ -157,51 +429,121 @@ def list_movies(
     * `line_text`: The line itself.
 
     You can filter for lines whose text contains a string by using the
-    `name` query parameter.
+    `name` query parameter. The `match` query parameter controls how `name`
+    is matched:
+    * `substring` - The text contains `name` anywhere (case insensitive).
+    * `words` - The text contains all the words in `name`, in any form
+      ("running" matches "run").
+    * `phrase` - The text contains the words in `name` next to each other,
+      in order.
 
     You can also sort the results by using the `sort` query parameter:
     * `movie_title` - Sort by movie title alphabetically.
     * `character_name` - Sort by character name alphabetically.
+
+    Set `rank` to `true` to list the best matches for `name` first, using
+    `sort` only to break ties. Ranked results are paged with `offset`.
+
+    For deep paging, pass `cursor` instead of `offset` (an empty `cursor` starts
+    at the first page). The response is then an object with the lines in
+    `results` and a `next_cursor` to pass for the following page, which is
+    `null` on the last page.
+
+    To fetch several lines at once, pass their ids as `ids`, separated by
+    commas (at most 250). The response is then a list of lines in the same form
+    as `/lines/{line_id}` (which also takes `context`), in the order given; ids
+    that don't exist are left out and the other parameters are ignored.
+
+    JSON is the default. Send `Accept: application/msgpack` for MessagePack or
+    `Accept: application/vnd.apache.arrow.stream` for an Arrow IPC stream
+    with a column per field (a page's `next_cursor` is in the schema
+    metadata).
     """
+    if ids is not None:
+        return formats.respond(
+            request,
+            batch.lookup(
+                batch.parse_ids(ids),
+                lambda id: ("line", id, context),
+                lambda ids: load_lines(ids, context),
+            ),
+        )
+
+    pagination.check_paging(cursor, offset)
+    rank = rank and name != ""
+    if rank and cursor is not None:
+        raise HTTPException(
+            status_code=400, detail="cursor paging is not supported with rank."
+        )
+
+    if not rank and (name == "" or match is lines_match_options.substring):
+        columns = snapshot.current()
+        body = columns and columns.list_lines(name, sort.value, limit, offset, cursor)
+        if body is not None:
+            return formats.respond(request, body, Line)
+
     if sort is lines_sort_options.movie_title:
-        stmt = sqlalchemy.text("""                            
-            SELECT line_id, line_sort, line_text, movies.title, characters.name
-            FROM lines                             
-            JOIN characters ON characters.character_id = lines.character_id 
-            JOIN movies ON movies.movie_id = lines.movie_id
-            WHERE line_text ILIKE :text    
-            ORDER BY movies.title ASC, lines.line_id ASC     
-            LIMIT :limit 
-            OFFSET :offset                     
-        """)
+        sort_column, sort_key = "movies.title", "movie_title"
     elif sort is lines_sort_options.character_name:
-        stmt = sqlalchemy.text("""                            
+        sort_column, sort_key = "characters.name", "character_name"
+    else:
+        assert False
+
+    params = {"text": f"%{name}%", "query": name, "offset": offset, "limit": limit}
+    if name == "" or match is lines_match_options.substring:
+        search, rank_column = "line_text ILIKE :text", "similarity(line_text, :query)"
+    elif match is lines_match_options.words:
+        search = f"{LINE_TSVECTOR} @@ plainto_tsquery('english', :query)"
+        rank_column = f"ts_rank_cd({LINE_TSVECTOR}, plainto_tsquery('english', :query))"
+    elif match is lines_match_options.phrase:
+        search = f"{LINE_TSVECTOR} @@ phraseto_tsquery('english', :query)"
+        rank_column = (
+            f"ts_rank_cd({LINE_TSVECTOR}, phraseto_tsquery('english', :query))"
+        )
+    else:
+        assert False
+
+    order_by = f"{sort_column} ASC, lines.line_id ASC"
+    if rank:
+        order_by = f"{rank_column} DESC, {order_by}"
+
+    after = ""
+    if cursor:
+        params["cursor_value"], params["cursor_id"] = pagination.decode_cursor(
+            cursor, sort.value
+        )
+        after = "AND " + pagination.keyset_condition(
+            sort_column, "lines.line_id", False, params["cursor_value"]
+        )
+
+    stmt = sqlalchemy.text(
+        f"""
             SELECT line_id, line_sort, line_text, movies.title, characters.name
-            FROM lines                             
-            JOIN characters ON characters.character_id = lines.character_id 
+            FROM lines
+            JOIN characters ON characters.character_id = lines.character_id
             JOIN movies ON movies.movie_id = lines.movie_id
-            WHERE line_text ILIKE :text
-            ORDER BY characters.name ASC, lines.line_id ASC
+            WHERE {search}
+            {after}
+            ORDER BY {order_by}
             LIMIT :limit
-            OFFSET :offset                     
-        """)
-    else:
-        assert False
-    
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt, [{"text": f"%{name}%",
-                                      "offset": offset,
-                                      "limit": limit}])
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "line_id": row.line_id,
-                    "movie_title": row.title,
-                    "character_name": row.name,
-                    "line_sort": row.line_sort,
-                    "line_text": row.line_text
-                }
-            )
+            OFFSET :offset
+        """
+    )
+
+    with db.reader().connect() as conn:
+        result = conn.execute(stmt, [params])
+        json = [
+            Line(row.line_id, row.title, row.name, row.line_sort, row.line_text)
+            for row in result
+        ]
 
-    return json
+    if cursor is not None:
+        return formats.respond(
+            request,
+            LinePage(
+                json,
+                pagination.next_cursor(json, limit, sort.value, sort_key, "line_id"),
+            ),
+            Line,
+        )
+    return formats.respond(request, json, Line)
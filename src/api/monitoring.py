@@ -0,0 +1,14 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from src import metrics
+
+router = APIRouter()
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    """
+    This endpoint returns request, query and connection pool metrics in the
+    Prometheus text format.
+    """
+    return PlainTextResponse(metrics.expose(), media_type="text/plain; version=0.0.4")
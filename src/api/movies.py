@@ -1,14 +1,44 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from enum import Enum
+from typing import List, Optional, Union
+import csv
+import io
+import json
 from src import database as db
+from src import (
+    batch,
+    cache,
+    etags,
+    formats,
+    pagination,
+    prepared,
+    rollups,
+    snapshot,
+    vocabulary,
+)
+from src.datatypes import (
+    CharacterStats,
+    ConversationLengthCount,
+    DistinctiveTerm,
+    GenderShare,
+    Movie,
+    MovieDetail,
+    MoviePage,
+    MovieStats,
+    MovieVocabulary,
+    TermCount,
+    TopCharacter,
+)
 from fastapi.params import Query
 import sqlalchemy
 
 router = APIRouter()
 
 
-@router.get("/movies/{movie_id}", tags=["movies"])
-def get_movie(movie_id: int):
+@router.get("/movies/{movie_id}", tags=["movies"], response_model=MovieDetail)
+@db.asyncable
+def get_movie(movie_id: int, request: Request):
     """
     This endpoint returns a single movie by its identifier. For each movie it returns:
     * `movie_id`: the internal id of the movie.
@@ -22,37 +52,307 @@ def get_movie(movie_id: int):
     * `character`: The name of the character.
     * `num_lines`: The number of lines the character has in the movie.
 
+    The response has an `ETag` that changes whenever a conversation is added to
+    the movie. Send it back in `If-None-Match` to get an empty 304 response
+    while the movie is unchanged.
     """
+    return etags.conditional_get(
+        request,
+        ("movie", movie_id),
+        lambda: load_movie(movie_id),
+        lambda: movie_version(movie_id),
+    )
 
-    stmt = sqlalchemy.text("""                            
-            SELECT movies.movie_id, title, name, characters.character_id, COUNT(lines) as num_lines
-            FROM movies                             
-            JOIN characters ON characters.movie_id = movies.movie_id  
-            JOIN lines ON characters.character_id = lines.character_id
-            WHERE movies.movie_id = (:id)
-            GROUP BY movies.movie_id, characters.character_id
-            ORDER BY movies.movie_id ASC, num_lines DESC
-            LIMIT 5                            
-        """)
-
-    with db.engine.connect() as conn:
-        result = conn.execute(stmt, [{"id": movie_id}])
-        json = {"movie_id": movie_id, "title": "", "top_characters": []}
-        for idx, row in enumerate(result):
-            if idx==0:                
-                json["title"] = row.title
-            json["top_characters"].append(
-                {
-                    "character_id": row.character_id,
-                    "character": row.name,
-                    "num_lines": row.num_lines
-                }
-            )
-    if json["title"] != "":
-        return json
+
+MOVIE_VERSION = prepared.Statement(
+    "movie_version",
+    """
+    SELECT COALESCE(movie_versions.version, 0)
+    FROM movies
+    LEFT JOIN movie_versions ON movie_versions.movie_id = movies.movie_id
+    WHERE movies.movie_id = :id
+""",
+)
+
+
+def movie_version(movie_id):
+    with db.reader().connect() as conn:
+        return MOVIE_VERSION.execute(conn, [{"id": movie_id}]).scalar_one_or_none()
+
+
+def load_movie(movie_id):
+    loaded = load_movies([movie_id])
+    if movie_id in loaded:
+        return loaded[movie_id]
     raise HTTPException(status_code=404, detail="movie not found.")
 
 
+MOVIES = prepared.Statement(
+    "load_movies",
+    """
+    SELECT movies.movie_id, title, COALESCE(movie_versions.version, 0) AS version,
+           top.name, top.character_id, top.num_lines
+    FROM movies
+    LEFT JOIN movie_versions ON movie_versions.movie_id = movies.movie_id
+    CROSS JOIN LATERAL (
+        SELECT name, characters.character_id, counts.number_of_lines AS num_lines
+        FROM character_line_counts AS counts
+        JOIN characters ON characters.character_id = counts.character_id
+        WHERE counts.movie_id = movies.movie_id AND counts.number_of_lines > 0
+        ORDER BY counts.number_of_lines DESC, counts.character_id ASC
+        LIMIT 5
+    ) AS top
+    WHERE movies.movie_id = ANY(CAST(:ids AS integer[]))
+    ORDER BY movies.movie_id, top.num_lines DESC, top.character_id ASC
+""",
+)
+
+
+def load_movies(movie_ids):
+    """
+    Loads several movies with one query, as {movie_id: (Versioned json, cache
+    tags)}.
+    """
+    with db.reader().connect() as conn:
+        result = MOVIES.execute(conn, [{"ids": movie_ids}])
+        json = {}
+        versions = {}
+        for row in result:
+            if row.movie_id not in json:
+                json[row.movie_id] = MovieDetail(row.movie_id, row.title, [])
+                versions[row.movie_id] = row.version
+            json[row.movie_id].top_characters.append(
+                TopCharacter(row.character_id, row.name, row.num_lines)
+            )
+    return {
+        movie_id: (
+            etags.Versioned(movie, versions[movie_id]),
+            [cache.movie_tag(movie_id)],
+        )
+        for movie_id, movie in json.items()
+        if movie.title != ""
+    }
+
+
+@router.get("/movies/{movie_id}/stats", tags=["movies"], response_model=MovieStats)
+@db.asyncable
+def get_movie_stats(movie_id: int, request: Request):
+    """
+    This endpoint returns dialog statistics for a single movie:
+    * `movie_id`: the internal id of the movie.
+    * `title`: The title of the movie.
+    * `number_of_lines`: The number of lines in the movie.
+    * `number_of_words`: The number of words in those lines.
+    * `number_of_conversations`: The number of conversations in the movie.
+    * `median_line_length`: The median length of a line, in characters, or
+      null if the movie has no lines.
+    * `characters`: Every character with lines in the movie, ordered by their
+      number of lines, each with `character_id`, `character`, `gender`,
+      `number_of_lines` and `number_of_words`.
+    * `lines_by_gender`: For each character gender, the `number_of_lines`
+      spoken by characters of that gender and their `share` of all the lines.
+    * `conversation_lengths`: How many conversations (`number_of_conversations`)
+      have each `number_of_lines`, ordered by `number_of_lines`.
+
+    Words are counted as in `/movies/{movie_id}/vocabulary`. The statistics
+    come from rollups kept up to date as conversations are added, and the
+    response has an `ETag` that works like the one of `/movies/{movie_id}`.
+    """
+    return etags.conditional_get(
+        request,
+        ("movie_stats", movie_id),
+        lambda: load_movie_stats(movie_id),
+        lambda: movie_version(movie_id),
+    )
+
+
+def load_movie_stats(movie_id):
+    with db.reader().connect() as conn:
+        # read the version first: a conversation added meanwhile then bumps it
+        # past the one cached with these counts
+        movie = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT title, COALESCE(movie_versions.version, 0) AS version
+            FROM movies
+            LEFT JOIN movie_versions ON movie_versions.movie_id = movies.movie_id
+            WHERE movies.movie_id = :id
+        """
+            ),
+            [{"id": movie_id}],
+        ).first()
+        if movie is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        characters = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT characters.character_id, characters.name, characters.gender,
+                   counts.number_of_lines, counts.number_of_words
+            FROM character_line_counts AS counts
+            JOIN characters ON characters.character_id = counts.character_id
+            WHERE counts.movie_id = :id AND counts.number_of_lines > 0
+            ORDER BY counts.number_of_lines DESC, counts.character_id ASC
+        """
+            ),
+            [{"id": movie_id}],
+        ).all()
+        conversation_lengths = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT number_of_lines, number_of_conversations
+            FROM movie_conversation_lengths
+            WHERE movie_id = :id AND number_of_conversations > 0
+            ORDER BY number_of_lines
+        """
+            ),
+            [{"id": movie_id}],
+        ).all()
+        line_lengths = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT line_length, number_of_lines
+            FROM movie_line_lengths
+            WHERE movie_id = :id AND number_of_lines > 0
+            ORDER BY line_length
+        """
+            ),
+            [{"id": movie_id}],
+        ).all()
+
+    number_of_lines = sum(row.number_of_lines for row in characters)
+    by_gender = {}
+    for row in characters:
+        by_gender[row.gender] = by_gender.get(row.gender, 0) + row.number_of_lines
+    stats = MovieStats(
+        movie_id,
+        movie.title,
+        number_of_lines,
+        sum(row.number_of_words for row in characters),
+        sum(row.number_of_conversations for row in conversation_lengths),
+        rollups.histogram_median(line_lengths),
+        [
+            CharacterStats(
+                row.character_id,
+                row.name,
+                row.gender,
+                row.number_of_lines,
+                row.number_of_words,
+            )
+            for row in characters
+        ],
+        [
+            GenderShare(gender, n, round(n / number_of_lines, 4))
+            for gender, n in sorted(
+                by_gender.items(), key=lambda item: (-item[1], item[0] or "")
+            )
+        ],
+        [
+            ConversationLengthCount(row.number_of_lines, row.number_of_conversations)
+            for row in conversation_lengths
+        ],
+    )
+    return etags.Versioned(stats, movie.version), [cache.movie_tag(movie_id)]
+
+
+@router.get(
+    "/movies/{movie_id}/vocabulary", tags=["movies"], response_model=MovieVocabulary
+)
+@db.asyncable
+def get_movie_vocabulary(
+    movie_id: int,
+    request: Request,
+    limit: int = Query(20, ge=1, le=100),
+    stop_words: bool = False,
+):
+    """
+    This endpoint returns the vocabulary of a movie's lines:
+    * `movie_id`: the internal id of the movie.
+    * `title`: The title of the movie.
+    * `number_of_words`: The number of words in the movie's lines.
+    * `number_of_terms`: The number of different words.
+    * `type_token_ratio`: `number_of_terms` divided by `number_of_words`, or
+      null if the movie has no words.
+    * `top_terms`: The `limit` most used words, each with its `term` and
+      `number_of_uses`.
+    * `distinctive_terms`: Up to `limit` words used more often in this movie
+      than in the other movies, most distinctive first. Each has its `term`,
+      `number_of_uses`, `number_of_uses_elsewhere` in the other movies and a
+      `score`: the log of how many times more often the movie uses it, per
+      word, than the other movies.
+
+    Words are lowercased runs of letters and digits, which may contain
+    apostrophes ("don't"). Common words such as "the" and "you" are left out
+    of `top_terms` and `distinctive_terms` unless `stop_words` is true.
+
+    The response has an `ETag` that works like the one of `/movies/{movie_id}`.
+    """
+    return etags.conditional_get(
+        request,
+        ("movie_vocabulary", movie_id, limit, stop_words),
+        lambda: load_movie_vocabulary(movie_id, limit, stop_words),
+        lambda: movie_version(movie_id),
+    )
+
+
+def load_movie_vocabulary(movie_id, limit, stop_words):
+    with db.reader().connect() as conn:
+        movie = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT title, COALESCE(movie_versions.version, 0) AS version
+            FROM movies
+            LEFT JOIN movie_versions ON movie_versions.movie_id = movies.movie_id
+            WHERE movies.movie_id = :id
+        """
+            ),
+            [{"id": movie_id}],
+        ).first()
+        if movie is None:
+            raise HTTPException(status_code=404, detail="movie not found.")
+        # each term's uses in every movie, from the term index
+        terms = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT movie_terms.term, movie_terms.number_of_uses,
+                   corpus.number_of_uses - movie_terms.number_of_uses
+                       AS number_of_uses_elsewhere
+            FROM movie_term_counts AS movie_terms
+            CROSS JOIN LATERAL (
+                SELECT SUM(number_of_uses) AS number_of_uses
+                FROM movie_term_counts AS all_terms
+                WHERE all_terms.term = movie_terms.term
+            ) AS corpus
+            WHERE movie_terms.movie_id = :id AND movie_terms.number_of_uses > 0
+        """
+            ),
+            [{"id": movie_id}],
+        ).all()
+        corpus_words = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT COALESCE(SUM(number_of_words), 0) FROM character_line_counts
+        """
+            )
+        ).scalar_one()
+
+    words, number_of_terms, ratio, top, distinctive = vocabulary.summarize(
+        terms,
+        corpus_words - sum(row.number_of_uses for row in terms),
+        limit,
+        stop_words,
+    )
+    result = MovieVocabulary(
+        movie_id,
+        movie.title,
+        words,
+        number_of_terms,
+        ratio,
+        [TermCount(*row) for row in top],
+        [DistinctiveTerm(*row) for row in distinctive],
+    )
+    return etags.Versioned(result, movie.version), [cache.movie_tag(movie_id)]
+
+
 class movie_sort_options(str, Enum):
     movie_title = "movie_title"
     year = "year"
@@ -60,12 +360,20 @@ class movie_sort_options(str, Enum):
 
 
 # Add get parameters
-@router.get("/movies/", tags=["movies"])
+@router.get(
+    "/movies/",
+    tags=["movies"],
+    response_model=Union[List[Movie], MoviePage, List[MovieDetail]],
+)
+@db.asyncable
 def list_movies(
+    request: Request,
     name: str = "",
     limit: int = Query(50, ge=1, le=250),
     offset: int = Query(0, ge=0),
     sort: movie_sort_options = movie_sort_options.movie_title,
+    cursor: Optional[str] = None,
+    ids: Optional[str] = None,
 ):
     """
     This endpoint returns a list of movies. For each movie it returns:
@@ -88,13 +396,44 @@ def list_movies(
     parameters are used for pagination. The `limit` query parameter specifies the
     maximum number of results to return. The `offset` query parameter specifies the
     number of results to skip before returning results.
+
+    For deep paging, pass `cursor` instead of `offset` (an empty `cursor` starts
+    at the first page). The response is then an object with the movies in
+    `results` and a `next_cursor` to pass for the following page, which is
+    `null` on the last page.
+
+    To fetch several movies at once, pass their ids as `ids`, separated by
+    commas (at most 250). The response is then a list of movies in the same
+    form as `/movies/{movie_id}`, in the order given; ids that don't exist are
+    left out and the other parameters are ignored.
+
+    JSON is the default. Send `Accept: application/msgpack` for MessagePack or
+    `Accept: application/vnd.apache.arrow.stream` for an Arrow IPC stream
+    with a column per field (a page's `next_cursor` is in the schema
+    metadata).
     """
+    if ids is not None:
+        return formats.respond(
+            request,
+            batch.lookup(batch.parse_ids(ids), lambda id: ("movie", id), load_movies),
+        )
+
+    pagination.check_paging(cursor, offset)
+
+    columns = snapshot.current()
+    body = columns and columns.list_movies(name, sort.value, limit, offset, cursor)
+    if body is not None:
+        return formats.respond(request, body, Movie)
+
     if sort is movie_sort_options.movie_title:
         order_by = db.movies.c.title
+        sort_column, descending, sort_key = "movies.title", False, "movie_title"
     elif sort is movie_sort_options.year:
         order_by = db.movies.c.year
+        sort_column, descending, sort_key = "movies.year", False, "year"
     elif sort is movie_sort_options.rating:
         order_by = sqlalchemy.desc(db.movies.c.imdb_rating)
+        sort_column, descending, sort_key = "movies.imdb_rating", True, "imdb_rating"
     else:
         assert False
 
@@ -115,18 +454,157 @@ def list_movies(
     if name != "":
         stmt = stmt.where(db.movies.c.title.ilike(f"%{name}%"))
 
-    with db.engine.connect() as conn:
+    # start after the last row of the previous page
+    if cursor:
+        value, last_id = pagination.decode_cursor(cursor, sort.value)
+        binds = {"cursor_id": last_id}
+        if value is not None:
+            binds["cursor_value"] = value
+        stmt = stmt.where(
+            sqlalchemy.text(
+                pagination.keyset_condition(
+                    sort_column, "movies.movie_id", descending, value
+                )
+            ).bindparams(**binds)
+        )
+
+    with db.reader().connect() as conn:
         result = conn.execute(stmt)
-        json = []
-        for row in result:
-            json.append(
-                {
-                    "movie_id": row.movie_id,
-                    "movie_title": row.title,
-                    "year": row.year,
-                    "imdb_rating": row.imdb_rating,
-                    "imdb_votes": row.imdb_votes,
-                }
-            )
+        json = [
+            Movie(row.movie_id, row.title, row.year, row.imdb_rating, row.imdb_votes)
+            for row in result
+        ]
+
+    if cursor is not None:
+        return formats.respond(
+            request,
+            MoviePage(
+                json,
+                pagination.next_cursor(json, limit, sort.value, sort_key, "movie_id"),
+            ),
+            Movie,
+        )
+    return formats.respond(request, json, Movie)
+
+
+class export_format_options(str, Enum):
+    ndjson = "ndjson"
+    csv = "csv"
+
+
+EXPORT_COLUMNS = [
+    "line_id",
+    "conversation_id",
+    "line_sort",
+    "character_id",
+    "character",
+    "line_text",
+]
 
-    return json
+export_stmt = sqlalchemy.text(
+    """
+    SELECT line_id, lines.conversation_id, line_sort, lines.character_id,
+           characters.name AS character, line_text
+    FROM lines
+    JOIN characters ON characters.character_id = lines.character_id
+    WHERE lines.movie_id = :id
+    ORDER BY lines.conversation_id ASC, lines.line_sort ASC
+"""
+)
+
+# rows fetched from the server-side cursor per round trip
+EXPORT_BATCH_SIZE = 1000
+
+
+def format_rows(rows, format):
+    if format is export_format_options.csv:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        return buffer.getvalue().encode("utf-8")
+    return "".join(
+        json.dumps(dict(zip(EXPORT_COLUMNS, row))) + "\n" for row in rows
+    ).encode("utf-8")
+
+
+def export_rows(engine, movie_id, format):
+    if format is export_format_options.csv:
+        yield format_rows([EXPORT_COLUMNS], format)
+    # stream_results uses a server-side cursor, so only one batch is in memory
+    with engine.connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=EXPORT_BATCH_SIZE
+        ).execute(export_stmt, [{"id": movie_id}])
+        for rows in result.partitions():
+            yield format_rows(rows, format)
+
+
+async def export_rows_async(async_engine, movie_id, format):
+    if format is export_format_options.csv:
+        yield format_rows([EXPORT_COLUMNS], format)
+    async with async_engine.connect() as conn:
+        result = await conn.stream(
+            export_stmt.execution_options(yield_per=EXPORT_BATCH_SIZE),
+            [{"id": movie_id}],
+        )
+        async for rows in result.partitions():
+            yield format_rows(rows, format)
+
+
+@router.get("/movies/{movie_id}/lines/export", tags=["movies"])
+@db.asyncable
+def export_movie_lines(
+    movie_id: int,
+    format: export_format_options = export_format_options.ndjson,
+):
+    """
+    This endpoint streams every line of a movie, ordered by conversation and
+    then by the line's place in the conversation. Each line has:
+    * `line_id`: the internal id of the line.
+    * `conversation_id`: the id of the conversation the line is in.
+    * `line_sort`: the order the line is said in the conversation.
+    * `character_id`: the id of the character saying the line.
+    * `character`: the name of the character saying the line.
+    * `line_text`: the text of the line.
+
+    Use the `format` query parameter to choose the output:
+    * `ndjson` - One JSON object per line (the default).
+    * `csv` - A header row followed by one row per line.
+
+    The response starts as soon as the first lines are read, however large
+    the movie is.
+    """
+    # the stream reads the same server as the check, chosen up front
+    replica = db.choose_replica()
+    engine = db.engine if replica is None else replica.engine
+    with engine.connect() as conn:
+        found = conn.execute(
+            sqlalchemy.text(
+                """
+            SELECT 1 FROM movies WHERE movie_id = :id
+        """
+            ),
+            [{"id": movie_id}],
+        ).first()
+    if found is None:
+        raise HTTPException(status_code=404, detail="movie not found.")
+
+    if db.USE_ASYNC:
+        body = export_rows_async(
+            db.async_engine if replica is None else replica.async_engine,
+            movie_id,
+            format,
+        )
+    else:
+        body = export_rows(engine, movie_id, format)
+
+    if format is export_format_options.csv:
+        return StreamingResponse(
+            body,
+            media_type="text/csv",
+            headers={
+                "Content-Disposition": (
+                    f'attachment; filename="movie-{movie_id}-lines.csv"'
+                )
+            },
+        )
+    return StreamingResponse(body, media_type="application/x-ndjson")
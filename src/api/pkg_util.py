@@ -2,6 +2,8 @@ from fastapi import APIRouter
 import os
 import pkg_resources
 import sys
+from src import cache, similarity, singleflight
+from src import database as db
 
 router = APIRouter()
 
@@ -22,6 +24,21 @@ def version():
     return sys.version_info
 
 
+@router.get("/cache/")
+def cache_stats():
+    return {**cache.entities.stats(), "singleflight": singleflight.entities.stats()}
+
+
+@router.get("/replicas/")
+def replica_stats():
+    return db.replica_stats()
+
+
+@router.get("/similarity/")
+def similarity_stats():
+    return similarity.stats()
+
+
 @router.get("/pkgsize/")
 def get_pkgsize():
     dists = [d for d in pkg_resources.working_set]
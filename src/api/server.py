@@ -1,5 +1,8 @@
 from fastapi import FastAPI
-from src.api import characters, movies, conversations, pkg_util, lines
+from src import database as db
+from src import admission, compression, metrics
+from src.responses import ORJSONResponse
+from src.api import characters, movies, conversations, pkg_util, lines, monitoring
 
 description = """
 Movie API returns dialog statistics on top hollywood movies from decades past.
@@ -40,12 +43,31 @@ app = FastAPI(
         "email": "cbarbe03@calpoly.edu",
     },
     openapi_tags=tags_metadata,
+    default_response_class=ORJSONResponse,
 )
 app.include_router(characters.router)
 app.include_router(movies.router)
 app.include_router(pkg_util.router)
 app.include_router(lines.router)
 app.include_router(conversations.router)
+app.include_router(monitoring.router)
+# the metrics middleware goes outermost so request timings include compression
+# and admission queueing, and shed requests are counted
+app.add_middleware(db.ReadYourWritesMiddleware)
+app.add_middleware(compression.CompressionMiddleware)
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+@app.on_event("startup")
+async def check_schema():
+    # opt-in, since it costs a database round trip on every cold start
+    if db.check_schema_on_startup():
+        problems = await db.run_sync(db.schema_problems)
+        if problems:
+            raise RuntimeError(
+                "database schema does not match src/database.py: " + ", ".join(problems)
+            )
 
 
 @app.get("/")
@@ -0,0 +1,41 @@
+from fastapi import HTTPException
+from src import cache
+
+# Batch lookups (`?ids=1,2,3`) for the entity endpoints, so a client showing a
+# list doesn't need one request per row. Each entity module loads all the ids
+# that are not cached with a fixed number of set-based queries.
+
+MAX_IDS = 250
+
+
+def parse_ids(ids):
+    """
+    Returns the distinct ids in a comma-separated `ids` parameter, in the
+    order given. Raises a 400 if it isn't a list of at most MAX_IDS integers.
+    """
+    try:
+        parsed = [int(id) for id in ids.split(",") if id.strip() != ""]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="invalid ids.")
+    parsed = list(dict.fromkeys(parsed))
+    if len(parsed) > MAX_IDS:
+        raise HTTPException(
+            status_code=400, detail=f"at most {MAX_IDS} ids are allowed."
+        )
+    return parsed
+
+
+def lookup(ids, key, load_many):
+    """
+    The entities for `ids`, in the same order, leaving out ids that don't
+    exist. `key(id)` is the entity's cache key; `load_many(ids)` loads the ids
+    that are not cached and returns {id: (etags.Versioned, cache tags)}.
+    """
+    keys = {key(id): id for id in ids}
+
+    def load_missing(missing):
+        loaded = load_many([keys[k] for k in missing])
+        return {key(id): value for id, value in loaded.items()}
+
+    found = cache.entities.get_many(list(keys), load_missing)
+    return [found[k].json for k in keys if k in found]
@@ -0,0 +1,203 @@
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+import dotenv
+from src import database as db
+
+# In-process read-through cache for the entity endpoints. Entries are tagged
+# with the movies/characters they were built from, and add_conversation
+# invalidates those tags once its transaction commits. Each worker process has
+# its own cache, so other workers only pick up a write once the TTL expires.
+# With read replicas, a load may read one that hasn't replayed a write yet, so
+# for READ_YOUR_WRITES seconds after a tag is invalidated, loads of it are
+# returned but not stored.
+
+dotenv.load_dotenv()
+
+
+def cache_settings():
+    dotenv.load_dotenv()
+    size = int(os.environ.get("ENTITY_CACHE_SIZE", "2048"))
+    ttl = float(os.environ.get("ENTITY_CACHE_TTL", "300"))
+    return size, ttl
+
+
+class EntityCache:
+    def __init__(self, maxsize, ttl, clock=time.monotonic, replica_lag=0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.replica_lag = replica_lag
+        self._clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # bumped by every invalidate(); a load that started before a tag was
+        # invalidated is returned but not stored, so it can't resurrect old data
+        self._generation = 0
+        self._invalidated_at = {}
+        self._cleared_at = 0
+        # generation -> loads started then and still running, so invalidate()
+        # can forget what no running load needs to know about
+        self._loading = {}
+        # (time, generation) of the invalidations of the last replica_lag
+        # seconds, which a load starting now may not see yet
+        self._recent = deque()
+
+    def get_or_load(self, key, load):
+        """
+        Returns the cached value for `key`, or calls `load()` and caches what it
+        returns. `load` returns a (value, tags) pair. Exceptions from `load`
+        (such as a 404) are not cached.
+        """
+        now = self._clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            started_at = self._start_load(now)
+
+        try:
+            value, tags = load()
+            self._store({key: (value, tags)}, started_at)
+        finally:
+            self._end_load(started_at)
+        return value
+
+    def get_many(self, keys, load_many):
+        """
+        Batch version of get_or_load(). Returns {key: value} for the keys that
+        exist. The keys that are not cached are passed to a single
+        `load_many(missing_keys)` call, which returns {key: (value, tags)} and
+        leaves out keys that don't exist.
+        """
+        now = self._clock()
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and entry[0] > now:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+            if not missing:
+                return found
+            started_at = self._start_load(now)
+
+        try:
+            loaded = load_many(missing)
+            self._store(loaded, started_at)
+        finally:
+            self._end_load(started_at)
+        for key, (value, tags) in loaded.items():
+            found[key] = value
+        return found
+
+    def _load_generation(self, now):
+        # called with the lock held; a load starting now counts as started
+        # before the invalidations it may not see yet
+        while self._recent and self._recent[0][0] <= now - self.replica_lag:
+            self._recent.popleft()
+        return self._recent[0][1] - 1 if self._recent else self._generation
+
+    def _start_load(self, now):
+        # called with the lock held
+        started_at = self._load_generation(now)
+        self._loading[started_at] = self._loading.get(started_at, 0) + 1
+        return started_at
+
+    def _end_load(self, started_at):
+        with self._lock:
+            self._loading[started_at] -= 1
+            if not self._loading[started_at]:
+                del self._loading[started_at]
+
+    def _store(self, loaded, started_at):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        expires_at = self._clock() + self.ttl
+        with self._lock:
+            if started_at < self._cleared_at:
+                return
+            for key, (value, tags) in loaded.items():
+                # invalidated before this load started (or never) is fine
+                if all(self._invalidated_at.get(tag, -1) <= started_at for tag in tags):
+                    self._entries[key] = (expires_at, value, tuple(tags))
+                    self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, tags):
+        tags = set(tags)
+        now = self._clock()
+        with self._lock:
+            self._generation += 1
+            for tag in tags:
+                self._invalidated_at[tag] = self._generation
+            if self.replica_lag > 0:
+                self._recent.append((now, self._generation))
+            # only loads that started before an invalidation check it, so keep
+            # just the ones newer than the oldest running or starting load
+            oldest = min([self._load_generation(now), *self._loading])
+            self._invalidated_at = {
+                tag: generation
+                for tag, generation in self._invalidated_at.items()
+                if generation > oldest
+            }
+            stale = [
+                key
+                for key, entry in self._entries.items()
+                if tags.intersection(entry[2])
+            ]
+            for key in stale:
+                del self._entries[key]
+
+    def generation(self):
+        """Bumped by every invalidate() and clear()."""
+        with self._lock:
+            return self._generation
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._cleared_at = self._generation
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": len(self._invalidated_at),
+            }
+
+
+def movie_tag(movie_id):
+    return ("movie", movie_id)
+
+
+def character_tag(character_id):
+    return ("character", character_id)
+
+
+def pair_tag(ch_id1, ch_id2):
+    return ("pair", min(ch_id1, ch_id2), max(ch_id1, ch_id2))
+
+
+entities = EntityCache(
+    *cache_settings(), replica_lag=db.READ_YOUR_WRITES if db.REPLICA_SERVERS else 0
+)
@@ -0,0 +1,126 @@
+import functools
+import importlib
+import importlib.util
+import os
+import zlib
+import dotenv
+from starlette.datastructures import Headers, MutableHeaders
+from src.formats import parse_accept
+
+# Response compression. Bodies of at least COMPRESSION_MIN_SIZE bytes are sent
+# with brotli when the client accepts it and the brotli package is installed,
+# else gzip, and uncompressed to clients that accept neither. Streamed bodies
+# (the line export) are compressed chunk by chunk, each flushed so the client
+# gets it without waiting for the compressor's buffer to fill. ETags are left
+# alone, so a 304 carries the same validator as the 200 it stands for whether
+# or not that would have been compressed; instead every response whose body
+# may be encoded, and every 304, has `Vary: Accept-Encoding`, so caches keep
+# the encoded and plain bodies apart.
+
+dotenv.load_dotenv()
+
+
+def compression_settings():
+    dotenv.load_dotenv()
+    return int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+
+
+MIN_SIZE = compression_settings()
+BROTLI = importlib.util.find_spec("brotli") is not None
+
+# content types worth compressing; Arrow and MessagePack still shrink well
+COMPRESSIBLE = (
+    "application/json",
+    "application/x-ndjson",
+    "application/msgpack",
+    "application/vnd.apache.arrow.stream",
+    "text/",
+)
+
+
+def choose_encoding(accept_encoding):
+    weights = parse_accept(accept_encoding or "")
+    candidates = (["br"] if BROTLI else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in candidates:
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compressor(encoding):
+    """(compress, flush, finish) functions of a streaming compressor."""
+    if encoding == "br":
+        compressor = importlib.import_module("brotli").Compressor(quality=4)
+        return compressor.process, compressor.flush, compressor.finish
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    flush = functools.partial(compressor.flush, zlib.Z_SYNC_FLUSH)
+    return compressor.compress, flush, compressor.flush
+
+
+class CompressionMiddleware:
+    """ASGI middleware compressing responses the client accepts compressed."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding"))
+        start = None
+        compress = flush = finish = None
+
+        async def send_compressed(message):
+            nonlocal start, compress, flush, finish
+            if message["type"] == "http.response.start":
+                # held back until the first body chunk shows whether to compress
+                start = message
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+            if start is not None:
+                headers = MutableHeaders(scope=start)
+                compressible = headers.get("content-type", "").startswith(COMPRESSIBLE)
+                if compressible or start["status"] == 304:
+                    headers.add_vary_header("Accept-Encoding")
+                if (
+                    encoding is None
+                    or "content-encoding" in headers
+                    or not compressible
+                    or (not more_body and len(body) < MIN_SIZE)
+                ):
+                    await send(start)
+                    start = None
+                    await send(message)
+                    return
+                compress, flush, finish = compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if more_body:
+                    del headers["content-length"]
+                else:
+                    body = compress(body) + finish()
+                    headers["Content-Length"] = str(len(body))
+                    await send(start)
+                    start = None
+                    await send({"type": "http.response.body", "body": body})
+                    return
+                await send(start)
+                start = None
+
+            if compress is None:
+                await send(message)
+                return
+            chunk = compress(body) + (flush() if more_body else finish())
+            await send(
+                {"type": "http.response.body", "body": chunk, "more_body": more_body}
+            )
+
+        await self.app(scope, receive, send_compressed)
@@ -1,30 +1,430 @@
-import csv
 # from src.datatypes import Character, Movie, Conversation, Line
 import os
-import io
+import functools
+import itertools
+import threading
+import time
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
 import dotenv
-from sqlalchemy import create_engine
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 import sqlalchemy
+from src import metrics
 
 # DO NOT CHANGE THIS TO BE HARDCODED. ONLY PULL FROM ENVIRONMENT VARIABLES.
 dotenv.load_dotenv()
 
-def database_connection_url():
+
+def database_connection_url(driver="postgresql", server=None):
+    """
+    The URL of the primary, or with `server` ("host:port") of a read replica
+    with the same user, password and database name.
+    """
     dotenv.load_dotenv()
     DB_USER: str = os.environ.get("POSTGRES_USER")
     DB_PASSWD = os.environ.get("POSTGRES_PASSWORD")
     DB_SERVER: str = os.environ.get("POSTGRES_SERVER")
     DB_PORT: str = os.environ.get("POSTGRES_PORT")
     DB_NAME: str = os.environ.get("POSTGRES_DB")
-    return f"postgresql://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}"
+    if server is not None:
+        DB_SERVER, _, DB_PORT = server.partition(":")
+        DB_PORT = DB_PORT or "5432"
+    return f"{driver}://{DB_USER}:{DB_PASSWD}@{DB_SERVER}:{DB_PORT}/{DB_NAME}"
+
+
+def use_async():
+    dotenv.load_dotenv()
+    return os.environ.get("POSTGRES_ASYNC", "").lower() in ("1", "true", "yes")
+
+
+def pool_settings():
+    """
+    Connection pool options from the environment. POSTGRES_POOL_SIZE=0 turns
+    pooling off, which suits serverless deployments where each instance only
+    lives for a few requests.
+    """
+    dotenv.load_dotenv()
+    size = int(os.environ.get("POSTGRES_POOL_SIZE", "5"))
+    pre_ping = os.environ.get("POSTGRES_POOL_PRE_PING", "")
+    if size == 0:
+        return {"poolclass": sqlalchemy.pool.NullPool}
+    return {
+        "pool_size": size,
+        "max_overflow": int(os.environ.get("POSTGRES_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.environ.get("POSTGRES_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.environ.get("POSTGRES_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": pre_ping.lower() in ("1", "true", "yes"),
+    }
+
+
+def replica_settings():
+    """
+    Read replicas from POSTGRES_REPLICAS, a comma-separated list of host:port.
+    Returns (servers, the replication lag in seconds past which a replica is
+    skipped, seconds between health checks, seconds a write keeps the writing
+    client's reads on the primary).
+    """
+    dotenv.load_dotenv()
+    servers = [
+        server.strip()
+        for server in os.environ.get("POSTGRES_REPLICAS", "").split(",")
+        if server.strip()
+    ]
+    return (
+        servers,
+        float(os.environ.get("POSTGRES_REPLICA_MAX_LAG", "5")),
+        float(os.environ.get("POSTGRES_REPLICA_CHECK_INTERVAL", "5")),
+        float(os.environ.get("POSTGRES_READ_YOUR_WRITES", "5")),
+    )
+
+
+USE_ASYNC = use_async()
+(
+    REPLICA_SERVERS,
+    REPLICA_MAX_LAG,
+    REPLICA_CHECK_INTERVAL,
+    READ_YOUR_WRITES,
+) = replica_settings()
+
+# The engine is created on first use (`db.engine`), not at import, so the app
+# starts without touching the database. With POSTGRES_ASYNC set, queries go
+# through asyncpg instead: `engine` is the sync facade of the async engine, so
+# the same handler code works in both modes as long as it runs under
+# asyncable()/run_sync() below.
+#
+# `engine` is the primary, which every write goes through. Reads that can
+# tolerate a little replication lag use reader() instead, which picks a
+# healthy replica round-robin, or the primary when there are none. Reads run
+# in autocommit mode: each statement sees committed data either way (the
+# default isolation is READ COMMITTED), and it saves the round trips of the
+# BEGIN before the first query and the ROLLBACK when the connection goes back
+# to the pool. The line export keeps a transaction for its server-side cursor.
+_engine = None
+_async_engine = None
+_primary_reads = None
+_replicas = []
+_engine_lock = threading.Lock()
+
+
+def make_engine(server=None):
+    """A (sync engine, async engine or None) pair for the primary or a replica."""
+    settings = pool_settings()
+    if USE_ASYNC:
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        settings.setdefault(
+            "poolclass", metrics.timed_pool(sqlalchemy.pool.AsyncAdaptedQueuePool)
+        )
+        async_engine = create_async_engine(
+            database_connection_url("postgresql+asyncpg", server), **settings
+        )
+        sync_engine = async_engine.sync_engine
+    else:
+        settings.setdefault("poolclass", metrics.timed_pool(sqlalchemy.pool.QueuePool))
+        async_engine = None
+        sync_engine = sqlalchemy.create_engine(
+            database_connection_url(server=server), **settings
+        )
+    metrics.instrument(sync_engine)
+    return sync_engine, async_engine
+
+
+def autocommit(engine):
+    """`engine`, with its connections in autocommit mode; they share its pool."""
+    return engine.execution_options(isolation_level="AUTOCOMMIT")
+
+
+def create_engines():
+    global _engine, _async_engine, _primary_reads, _replicas
+    with _engine_lock:
+        if _engine is None:
+            _replicas = [
+                Replica(server, *make_engine(server)) for server in REPLICA_SERVERS
+            ]
+            _engine, _async_engine = make_engine()
+            _primary_reads = autocommit(_engine)
+    return _engine
+
+
+def __getattr__(name):
+    if name == "engine":
+        return _engine or create_engines()
+    if name == "async_engine":
+        create_engines()
+        return _async_engine
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Seconds behind the primary. A replica that has replayed everything it
+# received counts as current, since pg_last_xact_replay_timestamp() stands
+# still while the primary is idle; on a server that isn't replicating both
+# sides are NULL and the lag is 0.
+REPLICA_LAG_SQL = sqlalchemy.text(
+    """
+    SELECT CASE
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+)
+
+
+class Replica:
+    def __init__(self, server, engine, async_engine=None):
+        self.server = server
+        self.engine = engine
+        self.reads = autocommit(engine)
+        self.async_engine = async_engine
+        self.healthy = True
+        self.lag = None
+        self.checked_at = float("-inf")
+        self._check_lock = threading.Lock()
+        sqlalchemy.event.listen(engine, "handle_error", self.on_error)
+
+    def on_error(self, context):
+        # a failed connect or a dropped connection takes the replica out of
+        # rotation until its next health check
+        if context.connection is None or context.is_disconnect:
+            self.healthy = False
+            self.checked_at = time.monotonic()
+
+    def replication_lag(self):
+        with self.reads.connect() as conn:
+            return float(conn.execute(REPLICA_LAG_SQL).scalar_one())
+
+    def refresh(self):
+        """Runs the health check if it is due and no other request is running it."""
+        if time.monotonic() - self.checked_at < REPLICA_CHECK_INTERVAL:
+            return
+        # never wait for another request's check; use the last result meanwhile
+        if not self._check_lock.acquire(blocking=False):
+            return
+        try:
+            try:
+                self.lag = self.replication_lag()
+                self.healthy = self.lag <= REPLICA_MAX_LAG
+            except sqlalchemy.exc.DBAPIError:
+                self.lag = None
+                self.healthy = False
+            self.checked_at = time.monotonic()
+        finally:
+            self._check_lock.release()
+
+
+# per request: [whether it may read a replica, whether it wrote]; set by
+# ReadYourWritesMiddleware
+_request_reads = ContextVar("request_reads", default=None)
+_next_replica = itertools.count()
 
-# Create a new DB engine based on our connection string
-engine = sqlalchemy.create_engine(database_connection_url())
+PRIMARY_UNTIL_COOKIE = "primary_until"
 
-# Use reflection to derive table schema. You can also code this in manually.
+
+def reads_primary():
+    """Whether this request wrote, or its client wrote recently."""
+    state = _request_reads.get()
+    return state is not None and not state[0]
+
+
+def choose_replica():
+    """A healthy replica to read from, or None to read the primary."""
+    create_engines()
+    if not _replicas or reads_primary():
+        return None
+    start = next(_next_replica)
+    for i in range(len(_replicas)):
+        replica = _replicas[(start + i) % len(_replicas)]
+        replica.refresh()
+        if replica.healthy:
+            return replica
+    return None
+
+
+def reader(primary=False):
+    """
+    The engine for a read: a healthy replica, or the primary. Pass `primary`
+    for a read that must see every committed write.
+    """
+    replica = None if primary else choose_replica()
+    if replica is None:
+        create_engines()
+        return _primary_reads
+    return replica.reads
+
+
+def wrote():
+    """
+    Called after a write commits. The rest of the request reads the primary,
+    and the response sets a cookie that sends the client's requests to any
+    worker there for the next READ_YOUR_WRITES seconds. Other clients keep
+    reading the replicas; the entity cache (src/cache.py) doesn't keep what
+    they read of the written entities until a replica must have the write.
+    """
+    state = _request_reads.get()
+    if state is not None:
+        state[0] = False
+        state[1] = True
+
+
+def replica_stats():
+    return [
+        {"server": replica.server, "healthy": replica.healthy, "lag": replica.lag}
+        for replica in _replicas
+    ]
+
+
+class ReadYourWritesMiddleware:
+    """
+    ASGI middleware giving each request its read routing state: requests
+    carrying a primary_until cookie from the future read the primary, and
+    responses to requests that wrote set that cookie. Does nothing without
+    replicas.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not REPLICA_SERVERS:
+            await self.app(scope, receive, send)
+            return
+        cookie = SimpleCookie(Headers(scope=scope).get("cookie", ""))
+        try:
+            primary_until = float(cookie[PRIMARY_UNTIL_COOKIE].value)
+        except (KeyError, ValueError):
+            primary_until = 0.0
+        state = [primary_until <= time.time(), False]
+        token = _request_reads.set(state)
+
+        async def send_with_cookie(message):
+            if message["type"] == "http.response.start" and state[1]:
+                until = int(time.time() + READ_YOUR_WRITES) + 1
+                max_age = int(READ_YOUR_WRITES) + 1
+                MutableHeaders(scope=message).append(
+                    "Set-Cookie",
+                    f"{PRIMARY_UNTIL_COOKIE}={until}; Max-Age={max_age}; Path=/;"
+                    " HttpOnly; SameSite=Lax",
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_cookie)
+        finally:
+            _request_reads.reset(token)
+
+
+def asyncable(handler):
+    """
+    Route decorator (place it below @router.get/post). On the sync path the
+    handler is returned unchanged and FastAPI runs it in its threadpool. On the
+    async path it becomes an `async def` that runs the handler in a greenlet on
+    the event loop, so waiting on Postgres no longer holds a threadpool slot.
+    """
+    if not USE_ASYNC:
+        return handler
+
+    @functools.wraps(handler)
+    async def async_handler(*args, **kwargs):
+        return await sqlalchemy.util.greenlet_spawn(handler, *args, **kwargs)
+
+    return async_handler
+
+
+async def run_sync(fn, *args):
+    """Runs blocking database code from an `async def` endpoint."""
+    if USE_ASYNC:
+        return await sqlalchemy.util.greenlet_spawn(fn, *args)
+    return await run_in_threadpool(fn, *args)
+
+
+# Table schema, declared here instead of reflected so importing this module
+# needs no database. verify_schema() checks it against the live database.
 metadata_obj = sqlalchemy.MetaData()
 
-movies = sqlalchemy.Table("movies", metadata_obj, autoload_with=engine)
-characters = sqlalchemy.Table("characters", metadata_obj, autoload_with=engine)
-lines = sqlalchemy.Table("lines", metadata_obj, autoload_with=engine)
-conversations = sqlalchemy.Table("conversations", metadata_obj, autoload_with=engine)
+movies = sqlalchemy.Table(
+    "movies",
+    metadata_obj,
+    sqlalchemy.Column("movie_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("title", sqlalchemy.Text),
+    sqlalchemy.Column("year", sqlalchemy.Text),
+    sqlalchemy.Column("imdb_rating", sqlalchemy.Float),
+    sqlalchemy.Column("imdb_votes", sqlalchemy.Integer),
+    sqlalchemy.Column("raw_script_url", sqlalchemy.Text),
+)
+characters = sqlalchemy.Table(
+    "characters",
+    metadata_obj,
+    sqlalchemy.Column("character_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column("name", sqlalchemy.Text),
+    sqlalchemy.Column(
+        "movie_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("movies.movie_id")
+    ),
+    sqlalchemy.Column("gender", sqlalchemy.Text),
+    sqlalchemy.Column("age", sqlalchemy.Integer),
+)
+conversations = sqlalchemy.Table(
+    "conversations",
+    metadata_obj,
+    sqlalchemy.Column("conversation_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column(
+        "character1_id",
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("characters.character_id"),
+    ),
+    sqlalchemy.Column(
+        "character2_id",
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("characters.character_id"),
+    ),
+    sqlalchemy.Column(
+        "movie_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("movies.movie_id")
+    ),
+)
+lines = sqlalchemy.Table(
+    "lines",
+    metadata_obj,
+    sqlalchemy.Column("line_id", sqlalchemy.Integer, primary_key=True),
+    sqlalchemy.Column(
+        "character_id",
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("characters.character_id"),
+    ),
+    sqlalchemy.Column(
+        "movie_id", sqlalchemy.Integer, sqlalchemy.ForeignKey("movies.movie_id")
+    ),
+    sqlalchemy.Column(
+        "conversation_id",
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("conversations.conversation_id"),
+    ),
+    sqlalchemy.Column("line_sort", sqlalchemy.Integer),
+    sqlalchemy.Column("line_text", sqlalchemy.Text),
+)
+
+
+def verify_schema(conn):
+    """
+    Returns a list of problems where the declared tables above don't match the
+    database (missing tables or columns). Empty means they match.
+    """
+    inspector = sqlalchemy.inspect(conn)
+    problems = []
+    for table in metadata_obj.sorted_tables:
+        if not inspector.has_table(table.name):
+            problems.append(f"missing table {table.name}")
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing:
+                problems.append(f"missing column {table.name}.{column.name}")
+    return problems
+
+
+def schema_problems():
+    with create_engines().connect() as conn:
+        return verify_schema(conn)
+
+
+def check_schema_on_startup():
+    dotenv.load_dotenv()
+    return os.environ.get("POSTGRES_CHECK_SCHEMA", "").lower() in ("1", "true", "yes")
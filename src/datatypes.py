@@ -1,40 +1,260 @@
+import dataclasses
 from dataclasses import dataclass
+from typing import List, Optional
 
+# Response types of the movie, character and line routes. They are declared as
+# each route's response_model for the OpenAPI schema, and the routes build them
+# directly from the result rows and return them in an ORJSONResponse (see
+# src/responses.py), which serializes dataclasses natively.
 
-@dataclass
-class Character:
-    id: int
-    name: str
+
+def row(cls):
+    """
+    `@dataclass(slots=True)` for Python 3.9: instances have no per-instance
+    __dict__, which keeps the cost of building one per result row down.
+    """
+    cls = dataclass(cls)
+    names = tuple(field.name for field in dataclasses.fields(cls))
+    namespace = {
+        key: value
+        for key, value in cls.__dict__.items()
+        if key not in names and key not in ("__dict__", "__weakref__")
+    }
+    namespace["__slots__"] = names
+    return type(cls)(cls.__name__, cls.__bases__, namespace)
+
+
+# rows of the list routes
+
+
+@row
+class Movie:
     movie_id: int
-    gender: str
-    age: int
+    movie_title: Optional[str]
+    year: Optional[str]
+    imdb_rating: Optional[float]
+    imdb_votes: Optional[int]
+
+
+@row
+class Character:
+    character_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    number_of_lines: int
+
+
+@row
+class Line:
+    line_id: int
+    movie_title: Optional[str]
+    character_name: Optional[str]
+    line_sort: Optional[int]
+    line_text: Optional[str]
+
+
+# results of the similar-line routes, most similar first
+@row
+class SimilarLine:
+    line_id: int
+    movie_title: Optional[str]
+    character_name: Optional[str]
+    line_text: Optional[str]
+    score: float
+
+
+# pages of the list routes when paging with `cursor`
+
+
+@row
+class MoviePage:
+    results: List[Movie]
+    next_cursor: Optional[str]
+
+
+@row
+class CharacterPage:
+    results: List[Character]
+    next_cursor: Optional[str]
+
+
+@row
+class LinePage:
+    results: List[Line]
+    next_cursor: Optional[str]
+
+
+# single entities
+
+
+@row
+class TopCharacter:
+    character_id: int
+    character: Optional[str]
     num_lines: int
 
 
-@dataclass
-class Movie:
-    id: int
-    title: str
-    year: int
-    imdb_rating: float
-    imdb_votes: int
-    raw_script_url: str
+@row
+class MovieDetail:
+    movie_id: int
+    title: Optional[str]
+    top_characters: List[TopCharacter]
+
+
+@row
+class ConversationPartner:
+    character_id: int
+    character: Optional[str]
+    gender: Optional[str]
+    number_of_lines_together: int
+
+
+@row
+class CharacterDetail:
+    character_id: int
+    character: Optional[str]
+    movie: Optional[str]
+    gender: Optional[str]
+    top_conversations: List[ConversationPartner]
+
+
+@row
+class LineDetail:
+    line_id: int
+    character_name: Optional[str]
+    movie_title: Optional[str]
+    text: Optional[str]
+    conv_id: int
+    other_character_name: Optional[str]
+    num_conv_btw_chars: int
+    conversation: List[Optional[str]]
 
 
-@dataclass
+@row
+class ConversationLine:
+    character: Optional[str]
+    line: Optional[str]
+
+
+@row
 class Conversation:
-    id: int
-    c1_id: int
-    c2_id: int
+    movie_title: Optional[str]
+    ch1: Optional[str]
+    ch2: Optional[str]
+    lines: List[ConversationLine]
+
+
+# character interaction graph
+
+
+@row
+class NetworkCharacter:
+    character_id: int
+    character: Optional[str]
+    distance: int
+
+
+@row
+class NetworkEdge:
+    character1_id: int
+    character2_id: int
+    number_of_lines: int
+
+
+@row
+class CharacterNetwork:
+    character_id: int
+    depth: int
+    characters: List[NetworkCharacter]
+    edges: List[NetworkEdge]
+
+
+@row
+class PathStep:
+    character_id: int
+    character: Optional[str]
+    lines_with_previous: Optional[int]
+
+
+@row
+class CharacterPath:
+    degrees: int
+    path: List[PathStep]
+
+
+# per-movie dialog statistics
+
+
+@row
+class CharacterStats:
+    character_id: int
+    character: Optional[str]
+    gender: Optional[str]
+    number_of_lines: int
+    number_of_words: int
+
+
+@row
+class GenderShare:
+    gender: Optional[str]
+    number_of_lines: int
+    share: float
+
+
+@row
+class ConversationLengthCount:
+    number_of_lines: int
+    number_of_conversations: int
+
+
+@row
+class MovieStats:
     movie_id: int
-    num_lines: int
+    title: Optional[str]
+    number_of_lines: int
+    number_of_words: int
+    number_of_conversations: int
+    median_line_length: Optional[float]
+    characters: List[CharacterStats]
+    lines_by_gender: List[GenderShare]
+    conversation_lengths: List[ConversationLengthCount]
 
 
-@dataclass
-class Line:
-    id: int
-    c_id: int
+# vocabulary
+
+
+@row
+class TermCount:
+    term: str
+    number_of_uses: int
+
+
+@row
+class DistinctiveTerm:
+    term: str
+    number_of_uses: int
+    number_of_uses_elsewhere: int
+    score: float
+
+
+@row
+class MovieVocabulary:
     movie_id: int
-    conv_id: int
-    line_sort: int
-    line_text: str
+    title: Optional[str]
+    number_of_words: int
+    number_of_terms: int
+    type_token_ratio: Optional[float]
+    top_terms: List[TermCount]
+    distinctive_terms: List[DistinctiveTerm]
+
+
+@row
+class CharacterVocabulary:
+    character_id: int
+    character: Optional[str]
+    movie_id: int
+    number_of_words: int
+    number_of_terms: int
+    type_token_ratio: Optional[float]
+    top_terms: List[TermCount]
+    distinctive_terms: List[DistinctiveTerm]
@@ -0,0 +1,90 @@
+import os
+from collections import namedtuple
+import dotenv
+from fastapi import HTTPException
+from src import cache, singleflight
+from src.responses import ORJSONResponse
+
+# Conditional GET for the entity endpoints. Every movie, character, line and
+# conversation response carries a strong ETag made from its cache key and the
+# data version of the movie it belongs to (the movie_versions table, bumped in
+# the same transaction as each conversation insert). A client or CDN that sends
+# the ETag back in If-None-Match gets a 304 without the entity being rebuilt.
+
+dotenv.load_dotenv()
+
+
+def cache_control():
+    dotenv.load_dotenv()
+    # by default clients may store responses but must revalidate them
+    return os.environ.get("HTTP_CACHE_CONTROL", "no-cache")
+
+
+CACHE_CONTROL = cache_control()
+
+# What the entity caches hold: the response (a src/datatypes object) and the
+# movie version it was read at in the same query, so an ETag never claims a
+# newer version than the data it is sent with. Since every write to a movie
+# bumps its version, entries must also be tagged with their movie.
+Versioned = namedtuple("Versioned", ["json", "version"])
+
+
+def make_etag(key, version):
+    parts = "-".join(str(part) for part in key if part is not None)
+    return f'"{parts}-v{version}"'
+
+
+def matches(if_none_match, etag):
+    """If-None-Match comparison, which treats weak and strong tags alike."""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+
+def check_not_modified(if_none_match, key, version):
+    if if_none_match is None or version is None:
+        return
+    etag = make_etag(key, version)
+    if matches(if_none_match, etag):
+        raise HTTPException(
+            status_code=304, headers={"ETag": etag, "Cache-Control": CACHE_CONTROL}
+        )
+
+
+def conditional_get(request, key, load, load_version):
+    """
+    Returns a response with the JSON for `key` from the entity cache (or
+    `load()`, which returns a (Versioned, tags) pair) and ETag and
+    Cache-Control headers, or raises a 304 if the request's If-None-Match has
+    the current version. On a cache miss the version is checked first with
+    `load_version()`, a primary key lookup returning None if the entity doesn't
+    exist, so a 304 never runs `load`'s joins.
+
+    Concurrent misses for the same key share one `load()` (and one
+    `load_version()`) through src/singleflight.py. A request only joins a load
+    that started after the last cache invalidation, so it never gets data from
+    before a write it could already see.
+    """
+    if_none_match = request.headers.get("if-none-match")
+
+    def load_if_modified():
+        generation = cache.entities.generation()
+        if if_none_match is not None:
+            version = singleflight.entities.do(
+                ("version", key, generation), load_version
+            )
+            check_not_modified(if_none_match, key, version)
+        return singleflight.entities.do((key, generation), load)
+
+    entity = cache.entities.get_or_load(key, load_if_modified)
+    check_not_modified(if_none_match, key, entity.version)
+    return ORJSONResponse(
+        entity.json,
+        headers={
+            "ETag": make_etag(key, entity.version),
+            "Cache-Control": CACHE_CONTROL,
+        },
+    )
@@ -0,0 +1,148 @@
+import dataclasses
+import importlib
+import importlib.util
+import typing
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import Response
+from src.responses import ORJSONResponse, RenderedJSONResponse, default
+
+# Content negotiation for the list routes. Besides JSON (the default), a client
+# can ask for MessagePack or an Arrow IPC stream in its Accept header, and gets
+# the same data: a list of rows, or with `cursor` a page. MessagePack mirrors
+# the JSON document. An Arrow stream holds one record batch with a column per
+# row field, and a page's `next_cursor` is in the schema metadata. msgpack and
+# pyarrow are optional; asking for a format whose package isn't installed
+# gets a 406 unless the client also accepts JSON.
+
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+
+# media type -> (format, package it needs)
+MEDIA_TYPES = {
+    "application/json": ("json", None),
+    MSGPACK: ("msgpack", "msgpack"),
+    "application/x-msgpack": ("msgpack", "msgpack"),
+    "application/vnd.msgpack": ("msgpack", "msgpack"),
+    ARROW_STREAM: ("arrow", "pyarrow"),
+}
+
+
+def parse_accept(header):
+    """{value: q} for a header such as Accept or Accept-Encoding."""
+    weights = {}
+    for item in header.split(","):
+        value, *params = item.split(";")
+        value = value.strip().lower()
+        if not value:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, number = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(number)
+                except ValueError:
+                    q = 0.0
+        weights[value] = max(q, weights.get(value, 0.0))
+    return weights
+
+
+def installed(package):
+    return package is None or importlib.util.find_spec(package) is not None
+
+
+def negotiate(accept):
+    """
+    The format to answer with for an Accept header: the one the client weighs
+    highest, JSON on ties, and JSON when it accepts none of them. Raises a 406
+    if the formats it accepts all need a package that isn't installed.
+    """
+    if not accept:
+        return "json"
+    weights = parse_accept(accept)
+    best, best_q, missing = "json", 0.0, None
+    for media_type, (format, package) in MEDIA_TYPES.items():
+        family = media_type.split("/")[0] + "/*"
+        q = weights.get(media_type, weights.get(family, weights.get("*/*", 0.0)))
+        if q <= best_q:
+            continue
+        if not installed(package):
+            missing = missing or package
+            continue
+        best, best_q = format, q
+    if best_q == 0.0 and missing is not None:
+        raise HTTPException(
+            status_code=406,
+            detail=f"this format needs the {missing} package on the server.",
+        )
+    return best
+
+
+def plain(content):
+    """`content` as the lists and dicts of its JSON document."""
+    if isinstance(content, bytes):
+        return orjson.loads(content)
+    return orjson.loads(orjson.dumps(content, default=default))
+
+
+def arrow_type(pa, annotation):
+    """The Arrow type of a src/datatypes field, or None to infer it."""
+    if typing.get_origin(annotation) is typing.Union:
+        args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        annotation = args[0] if len(args) == 1 else None
+    return {
+        int: pa.int64(),
+        float: pa.float64(),
+        str: pa.string(),
+        bool: pa.bool_(),
+    }.get(annotation)
+
+
+def arrow_schema(pa, row_type):
+    if row_type is None:
+        return None
+    hints = typing.get_type_hints(row_type)
+    fields = [
+        pa.field(field.name, arrow_type(pa, hints[field.name]))
+        for field in dataclasses.fields(row_type)
+    ]
+    if any(field.type is None for field in fields):
+        return None
+    return pa.schema(fields)
+
+
+def render_arrow(data, row_type):
+    pa = importlib.import_module("pyarrow")
+    ipc = importlib.import_module("pyarrow.ipc")
+    rows = data["results"] if isinstance(data, dict) else data
+    schema = arrow_schema(pa, row_type)
+    table = pa.Table.from_pylist(rows, schema=schema)
+    if isinstance(data, dict) and data["next_cursor"] is not None:
+        table = table.replace_schema_metadata({"next_cursor": data["next_cursor"]})
+    sink = pa.BufferOutputStream()
+    with ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def respond(request, content, row_type=None):
+    """
+    The response of a list route in the format the request asks for.
+    `content` is the rows or page to return, or JSON rendered ahead of time
+    (see src/snapshot.py); `row_type` is the src/datatypes class of the rows.
+    """
+    format = negotiate(request.headers.get("accept"))
+    headers = {"Vary": "Accept"}
+    if format == "json":
+        if isinstance(content, bytes):
+            return RenderedJSONResponse(content, headers=headers)
+        return ORJSONResponse(content, headers=headers)
+    if format == "msgpack":
+        msgpack = importlib.import_module("msgpack")
+        return Response(
+            msgpack.packb(plain(content)), media_type=MSGPACK, headers=headers
+        )
+    return Response(
+        render_arrow(plain(content), row_type), media_type=ARROW_STREAM, headers=headers
+    )
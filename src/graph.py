@@ -0,0 +1,198 @@
+import os
+import threading
+import time
+from array import array
+from collections import deque
+import dotenv
+import sqlalchemy
+from src import database as db
+
+# In-memory character interaction graph for the network and path endpoints.
+# Characters are nodes and two characters share an edge weighted by the lines
+# of their conversations, in either order, from character_pair_line_counts.
+# The edges are stored CSR-style in flat arrays (each node's neighbors sorted
+# by id), with new lines from add_conversation layered on top until they are
+# folded in. Each worker builds its own graph on first use and rebuilds it once
+# it is older than GRAPH_TTL, so writes made through other workers show up
+# after that long.
+
+dotenv.load_dotenv()
+
+
+def graph_settings():
+    dotenv.load_dotenv()
+    return float(os.environ.get("GRAPH_TTL", "300"))
+
+
+# edge updates kept on top of the arrays before they are folded in
+MAX_PENDING = 1000
+
+
+class CharacterGraph:
+    def __init__(self, characters, pairs):
+        """
+        `characters` is (character_id, name, movie_id) rows; `pairs` is
+        (character1_id, character2_id, number_of_lines) rows.
+        """
+        characters = sorted(characters)
+        self.ids = array("q", (row[0] for row in characters))
+        self.names = [row[1] for row in characters]
+        self.movie_ids = array("q", (row[2] for row in characters))
+        self.index = {ch_id: i for i, ch_id in enumerate(self.ids)}
+
+        adjacency = [{} for _ in characters]
+        for ch_id1, ch_id2, n in pairs:
+            i, j = self.index.get(ch_id1), self.index.get(ch_id2)
+            if i is None or j is None or i == j or n <= 0:
+                continue
+            adjacency[i][j] = adjacency[i].get(j, 0) + n
+            adjacency[j][i] = adjacency[j].get(i, 0) + n
+        self.load(adjacency)
+
+    def load(self, adjacency):
+        offsets = array("q", [0])
+        neighbors = array("q")
+        weights = array("q")
+        for edges in adjacency:
+            for j in sorted(edges):
+                neighbors.append(j)
+                weights.append(edges[j])
+            offsets.append(len(neighbors))
+        # one attribute, replaced whole, so readers never see a half-updated graph
+        self.state = (offsets, neighbors, weights, {})
+        self.num_pending = 0
+
+    def edges(self, i):
+        """{neighbor index: lines together} for node `i`."""
+        offsets, neighbors, weights, pending = self.state
+        start, end = offsets[i], offsets[i + 1]
+        edges = dict(zip(neighbors[start:end], weights[start:end]))
+        for j, n in pending.get(i, {}).items():
+            edges[j] = edges.get(j, 0) + n
+        return edges
+
+    def add_lines(self, ch_id1, ch_id2, n):
+        """Adds `n` lines between two characters. Callers serialize these calls."""
+        i, j = self.index.get(ch_id1), self.index.get(ch_id2)
+        if i is None or j is None or i == j or n <= 0:
+            # a character created after the graph was built; the next rebuild has it
+            return
+        offsets, neighbors, weights, pending = self.state
+        pending = dict(pending)
+        for a, b in ((i, j), (j, i)):
+            edges = dict(pending.get(a, {}))
+            edges[b] = edges.get(b, 0) + n
+            pending[a] = edges
+        self.state = (offsets, neighbors, weights, pending)
+        self.num_pending += 1
+        if self.num_pending > MAX_PENDING:
+            self.load([self.edges(i) for i in range(len(self.ids))])
+
+    def network(self, ch_id, depth):
+        """
+        Breadth-first search from `ch_id` up to `depth` hops. Returns
+        ({index: distance}, [(i, j, lines together)]) with i < j for every
+        edge seen from a node closer than `depth`.
+        """
+        start = self.index[ch_id]
+        distances = {start: 0}
+        edges = []
+        queue = deque([start])
+        while queue:
+            i = queue.popleft()
+            if distances[i] >= depth:
+                continue
+            for j, n in sorted(self.edges(i).items()):
+                if j not in distances:
+                    distances[j] = distances[i] + 1
+                    queue.append(j)
+                if i < j or distances[j] == depth:
+                    edges.append((min(i, j), max(i, j), n))
+        return distances, edges
+
+    def path(self, ch_id1, ch_id2):
+        """
+        The fewest-hops path from `ch_id1` to `ch_id2` as a list of node
+        indexes, or None if they are not connected. Ties go to lower ids.
+        """
+        start, goal = self.index[ch_id1], self.index[ch_id2]
+        parents = {start: None}
+        queue = deque([start])
+        while queue and goal not in parents:
+            i = queue.popleft()
+            for j in sorted(self.edges(i)):
+                if j not in parents:
+                    parents[j] = i
+                    queue.append(j)
+        if goal not in parents:
+            return None
+        path = [goal]
+        while parents[path[-1]] is not None:
+            path.append(parents[path[-1]])
+        return path[::-1]
+
+
+CHARACTERS = sqlalchemy.text(
+    """
+    SELECT character_id, name, movie_id FROM characters
+"""
+)
+
+PAIRS = sqlalchemy.text(
+    """
+    SELECT character1_id, character2_id, number_of_lines
+    FROM character_pair_line_counts
+    WHERE number_of_lines > 0
+"""
+)
+
+
+def load_graph():
+    with db.reader().connect() as conn:
+        characters = conn.execute(CHARACTERS).all()
+        pairs = conn.execute(PAIRS).all()
+    return CharacterGraph(characters, pairs)
+
+
+_graph = None
+_built_at = 0.0
+_build_lock = threading.Lock()
+_update_lock = threading.Lock()
+GRAPH_TTL = graph_settings()
+
+
+def current():
+    """
+    The graph, built on first use. Once it is older than GRAPH_TTL the next
+    caller rebuilds it while concurrent callers keep using the old one.
+    """
+    global _graph, _built_at
+    if _graph is not None and time.monotonic() - _built_at < GRAPH_TTL:
+        return _graph
+    # never block on the lock: on the async path every request shares one thread
+    if _build_lock.acquire(blocking=False):
+        try:
+            if _graph is None or time.monotonic() - _built_at >= GRAPH_TTL:
+                _graph = load_graph()
+                _built_at = time.monotonic()
+        finally:
+            _build_lock.release()
+    elif _graph is None:
+        # another request is building the first graph
+        return load_graph()
+    return _graph
+
+
+def add_pairs(pairs):
+    """
+    Adds new lines, as {(character1_id, character2_id): lines}, to this
+    worker's graph if it has been built. Call after the write commits. This
+    doesn't wait for a rebuild in progress, so a write racing one can be
+    missing from (or counted twice in) the rebuilt graph until the next.
+    """
+    graph = _graph
+    if graph is None:
+        return
+    with _update_lock:
+        for (ch_id1, ch_id2), n in pairs.items():
+            graph.add_lines(ch_id1, ch_id2, n)
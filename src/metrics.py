@@ -0,0 +1,312 @@
+import bisect
+import os
+import threading
+import time
+from contextvars import ContextVar
+import dotenv
+import sqlalchemy
+from starlette.datastructures import MutableHeaders
+
+# Request and query instrumentation. Engine event hooks count and time every
+# query; MetricsMiddleware attributes them to the current request, adds a
+# Server-Timing header and records per-route histograms, which /metrics
+# serves in the Prometheus text format. Everything here is a few dict lookups
+# and additions per request/query, so it is on by default.
+
+dotenv.load_dotenv()
+
+
+def metrics_enabled():
+    dotenv.load_dotenv()
+    return os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+
+ENABLED = metrics_enabled()
+
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = [[0] * (len(self.buckets) + 1), 0.0, 0]
+                self._series[label_values] = series
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {
+                key: (list(counts), total, n)
+                for key, (counts, total, n) in self._series.items()
+            }
+        for label_values, (counts, total, n) in sorted(series.items()):
+            labels = format_labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                bucket_labels = join_labels(labels, format_labels(("le",), (bound,)))
+                lines.append(f"{self.name}_bucket{{{bucket_labels}}} {cumulative}")
+            bucket_labels = join_labels(labels, format_labels(("le",), ("+Inf",)))
+            lines.append(f"{self.name}_bucket{{{bucket_labels}}} {n}")
+            lines.append(f"{self.name}_sum{braces(labels)} {total}")
+            lines.append(f"{self.name}_count{braces(labels)} {n}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            labels = format_labels(self.labels, label_values)
+            lines.append(f"{self.name}{braces(labels)} {value}")
+        return lines
+
+
+def escape(value):
+    value = str(value).replace("\\", "\\\\")
+    return value.replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names, values):
+    return ",".join(f'{name}="{escape(value)}"' for name, value in zip(names, values))
+
+
+def join_labels(*parts):
+    return ",".join(part for part in parts if part)
+
+
+def braces(labels):
+    return f"{{{labels}}}" if labels else ""
+
+
+request_duration = Histogram(
+    "movie_api_request_duration_seconds",
+    "Time to handle a request.",
+    ("method", "route"),
+)
+requests_total = Counter(
+    "movie_api_requests_total", "Requests handled.", ("method", "route", "status")
+)
+request_queries = Histogram(
+    "movie_api_request_queries",
+    "Database queries run per request.",
+    ("method", "route"),
+    COUNT_BUCKETS,
+)
+queries_total = Counter("movie_api_db_queries_total", "Database queries run.")
+query_duration = Histogram(
+    "movie_api_db_query_duration_seconds", "Time spent in a database query."
+)
+pool_wait = Histogram(
+    "movie_api_db_pool_wait_seconds",
+    "Time spent waiting to check a connection out of the pool.",
+)
+coalesced_requests = Counter(
+    "movie_api_coalesced_requests_total",
+    "Requests that waited for an identical load already in flight"
+    " instead of running it.",
+    ("group",),
+)
+admission_wait = Histogram(
+    "movie_api_admission_wait_seconds",
+    "Time a request waited in its route class's admission queue.",
+    ("route_class",),
+)
+shed_requests = Counter(
+    "movie_api_shed_requests_total",
+    "Requests turned away with a 503 by admission control.",
+    ("route_class", "reason"),
+)
+
+REGISTRY = [
+    request_duration,
+    requests_total,
+    request_queries,
+    queries_total,
+    query_duration,
+    pool_wait,
+    coalesced_requests,
+    admission_wait,
+    shed_requests,
+]
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    def server_timing(self, total_seconds):
+        return (
+            f'db;desc="{self.queries} queries";dur={self.db_seconds * 1000:.2f}, '
+            f"pool;dur={self.pool_wait_seconds * 1000:.2f}, "
+            f"total;dur={total_seconds * 1000:.2f}"
+        )
+
+
+_current = ContextVar("request_stats", default=None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    query_duration.observe(elapsed)
+    queries_total.inc()
+    stats = _current.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def handle_error(exception_context):
+    # keep the start-time stack balanced when a query fails
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+# engines passed to instrument(), for the pool gauge in expose()
+engines = []
+
+
+def instrument(engine):
+    """Attaches the query hooks to a (sync) engine."""
+    if not ENABLED:
+        return
+    engines.append(engine)
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    sqlalchemy.event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    sqlalchemy.event.listen(engine, "handle_error", handle_error)
+
+
+def timed_pool(pool_class):
+    """Subclass of `pool_class` that records how long checkouts wait."""
+    if not ENABLED:
+        return pool_class
+
+    class TimedPool(pool_class):
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                elapsed = time.perf_counter() - start
+                pool_wait.observe(elapsed)
+                stats = _current.get()
+                if stats is not None:
+                    stats.pool_wait_seconds += elapsed
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording per-request metrics and Server-Timing."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_path(self, scope):
+        # the router stores the matched endpoint in the scope; map it back to
+        # the route's path template so labels don't explode with ids
+        if self._routes is None:
+            self._routes = {
+                getattr(route, "endpoint", None): route.path
+                for route in scope["app"].routes
+                if hasattr(route, "path")
+            }
+        return self._routes.get(scope.get("endpoint"), "unmatched")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+                MutableHeaders(scope=message).append(
+                    "Server-Timing", stats.server_timing(time.perf_counter() - start)
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            elapsed = time.perf_counter() - start
+            route = self.route_path(scope)
+            method = scope["method"]
+            request_duration.observe(elapsed, method, route)
+            request_queries.observe(stats.queries, method, route)
+            requests_total.inc(1, method, route, status[0])
+            _current.reset(token)
+
+
+def expose():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    pools = [engine.pool for engine in engines if hasattr(engine.pool, "checkedout")]
+    if pools:
+        checked_out = sum(pool.checkedout() for pool in pools)
+        lines.append(
+            "# HELP movie_api_db_pool_checked_out"
+            " Connections currently checked out of the pool."
+        )
+        lines.append("# TYPE movie_api_db_pool_checked_out gauge")
+        lines.append(f"movie_api_db_pool_checked_out {checked_out}")
+    return "\n".join(lines) + "\n"
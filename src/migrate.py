@@ -0,0 +1,66 @@
+import os
+import sqlalchemy
+from src import database as db
+
+# Applies the numbered .sql files in /migrations that have not been run yet.
+# Usage: python -m src.migrate
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "migrations")
+
+
+def pending_migrations(conn):
+    conn.execute(
+        sqlalchemy.text(
+            """
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name text PRIMARY KEY,
+            applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """
+        )
+    )
+    applied = {
+        row.name
+        for row in conn.execute(
+            sqlalchemy.text(
+                """
+        SELECT name FROM schema_migrations
+    """
+            )
+        )
+    }
+    return [
+        name
+        for name in sorted(os.listdir(MIGRATIONS_DIR))
+        if name.endswith(".sql") and name not in applied
+    ]
+
+
+def apply_migrations(conn):
+    applied = []
+    for name in pending_migrations(conn):
+        with open(os.path.join(MIGRATIONS_DIR, name), encoding="utf-8") as f:
+            # no_parameters, so psycopg2 leaves any % in the SQL alone
+            conn.exec_driver_sql(f.read(), execution_options={"no_parameters": True})
+        conn.execute(
+            sqlalchemy.text(
+                """
+            INSERT INTO schema_migrations (name) VALUES (:name)
+        """
+            ),
+            [{"name": name}],
+        )
+        applied.append(name)
+    return applied
+
+
+def migrate():
+    # a plain sync engine, so this also works when the app runs on asyncpg
+    engine = sqlalchemy.create_engine(db.database_connection_url())
+    with engine.begin() as conn:
+        return apply_migrations(conn)
+
+
+if __name__ == "__main__":
+    for name in migrate():
+        print(f"applied {name}")
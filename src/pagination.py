@@ -0,0 +1,86 @@
+import base64
+import binascii
+import json
+from fastapi import HTTPException
+
+# Keyset (cursor) pagination shared by the list endpoints. A cursor is an opaque
+# token holding the sort option plus the sort value and id of the last row
+# returned, so the next page starts with an index seek instead of an OFFSET.
+
+
+# sort options whose cursor value is a number; the others sort by text
+NUMERIC_SORTS = frozenset({"rating", "number_of_lines"})
+
+
+def valid_value(sort, value):
+    """Whether a cursor's `value` has the type of the `sort` column (or is null)."""
+    if value is None:
+        return True
+    if sort in NUMERIC_SORTS:
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+    return isinstance(value, str)
+
+
+def encode_cursor(sort, value, id):
+    payload = json.dumps(
+        {"sort": sort, "value": value, "id": id}, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor, sort):
+    """
+    Returns the (value, id) stored in the cursor. Raises a 400 if the cursor is
+    malformed, was issued for a different sort order or holds a value of the
+    wrong type for it.
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if payload["sort"] != sort or not valid_value(sort, payload["value"]):
+            raise ValueError
+        if not isinstance(payload["id"], int) or isinstance(payload["id"], bool):
+            raise ValueError
+        return payload["value"], payload["id"]
+    except (ValueError, KeyError, TypeError, binascii.Error):
+        raise HTTPException(status_code=400, detail="invalid cursor.")
+
+
+def keyset_condition(sort_column, id_column, descending, value):
+    """
+    SQL condition selecting the rows that come after (:cursor_value, :cursor_id)
+    in `ORDER BY sort_column [DESC], id_column ASC`, using Postgres' default null
+    placement (last for ASC, first for DESC). The leading range predicate is
+    what lets the planner start the index scan at the cursor.
+    """
+    if value is None:
+        if descending:
+            return (
+                f"(({sort_column} IS NULL AND {id_column} > :cursor_id)"
+                f" OR {sort_column} IS NOT NULL)"
+            )
+        return f"({sort_column} IS NULL AND {id_column} > :cursor_id)"
+    if descending:
+        return f"""({sort_column} <= :cursor_value
+                AND ({sort_column} < :cursor_value OR {id_column} > :cursor_id))"""
+    return f"""(({sort_column} >= :cursor_value
+                AND ({sort_column} > :cursor_value OR {id_column} > :cursor_id))
+                OR {sort_column} IS NULL)"""
+
+
+def check_paging(cursor, offset):
+    if cursor is not None and offset != 0:
+        raise HTTPException(
+            status_code=400, detail="use either cursor or offset, not both."
+        )
+
+
+def next_cursor(json, limit, sort, value_key, id_key):
+    """
+    Cursor for the page after `json`, or None if this was the last page.
+    `value_key` and `id_key` name the sort value and id attributes of each
+    result row (see src/datatypes.py).
+    """
+    if len(json) < limit:
+        return None
+    return encode_cursor(sort, getattr(json[-1], value_key), getattr(json[-1], id_key))
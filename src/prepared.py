@@ -0,0 +1,65 @@
+import os
+import re
+import dotenv
+import sqlalchemy
+
+# Named server-side prepared statements for the hot entity queries. On
+# psycopg2 every text() query is sent as a string that Postgres parses and
+# plans again each time; a Statement is PREPAREd once per connection instead,
+# and then run with EXECUTE, which skips both. asyncpg already prepares each
+# statement and caches it per connection, so there a Statement runs like any
+# text() query. Turn this off (PREPARED_STATEMENTS=0) behind a pooler that
+# shares server connections between clients, such as PgBouncer in
+# transaction mode, where a statement prepared on one connection is missing
+# on the next.
+
+dotenv.load_dotenv()
+
+
+def prepared_statements_enabled():
+    dotenv.load_dotenv()
+    return os.environ.get("PREPARED_STATEMENTS", "true").lower() in ("1", "true", "yes")
+
+
+ENABLED = prepared_statements_enabled()
+
+# the bind parameter syntax of sqlalchemy.text(), skipping :: casts
+BIND_PARAM = re.compile(r"(?<![:\w\\]):(\w+)(?!:)")
+
+_names = set()
+
+
+class Statement:
+    def __init__(self, name, sql):
+        if name in _names:
+            raise ValueError(f"prepared statement {name} is defined twice")
+        _names.add(name)
+        self.name = name
+        self.text = sqlalchemy.text(sql)
+
+        # PREPARE takes $1, $2, ... in place of the named parameters
+        self.params = []
+
+        def positional(match):
+            if match.group(1) not in self.params:
+                self.params.append(match.group(1))
+            return f"${self.params.index(match.group(1)) + 1}"
+
+        self.prepare_sql = f"PREPARE {name} AS " + BIND_PARAM.sub(positional, sql)
+        self.execute_text = sqlalchemy.text(
+            f"EXECUTE {name}(" + ", ".join(f":{param}" for param in self.params) + ")"
+        )
+
+    def execute(self, conn, parameters=None):
+        """Runs the statement on `conn` like conn.execute(text, parameters)."""
+        if not ENABLED or conn.dialect.driver != "psycopg2":
+            return conn.execute(self.text, parameters)
+        # lives as long as the DBAPI connection, across pool checkouts
+        prepared = conn.connection.info.setdefault("prepared_statements", set())
+        if self.name not in prepared:
+            # no_parameters, so psycopg2 leaves any % in the SQL alone
+            conn.exec_driver_sql(
+                self.prepare_sql, execution_options={"no_parameters": True}
+            )
+            prepared.add(self.name)
+        return conn.execute(self.execute_text, parameters)
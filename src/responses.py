@@ -0,0 +1,26 @@
+import decimal
+import orjson
+from fastapi.responses import JSONResponse, Response
+
+# JSON responses rendered by orjson. The movie, character and line routes return
+# their src/datatypes results wrapped in ORJSONResponse, which skips FastAPI's
+# validation and jsonable_encoder pass over every row; orjson serializes the
+# dataclasses directly.
+
+
+def default(value):
+    # numeric columns come back as Decimal, which orjson doesn't know
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError
+
+
+class ORJSONResponse(JSONResponse):
+    def render(self, content):
+        return orjson.dumps(content, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+
+class RenderedJSONResponse(Response):
+    """A response whose JSON body was rendered ahead of time (see src/snapshot.py)."""
+
+    media_type = "application/json"
@@ -0,0 +1,344 @@
+from collections import Counter
+import sqlalchemy
+from src import database as db
+from src import vocabulary
+
+# Rollup tables (see migrations/001_line_count_rollups.sql,
+# 008_movie_stats_rollups.sql and 009_term_counts.sql) keep the line and word
+# counts that the read endpoints sort and filter on, the per-movie
+# distributions behind /movies/{movie_id}/stats and the term counts behind the
+# vocabulary endpoints, so they never aggregate `lines`. add_conversation
+# calls add_lines() in its own transaction; rebuild() recomputes everything
+# from scratch. Usage: python -m src.rollups
+
+# A line's terms (see src/vocabulary.py), one row each, and how many it has.
+LINE_TERMS_SQL = (
+    "regexp_matches(lower(coalesce(line_text, '')), "
+    f"{vocabulary.TERM_PATTERN_SQL}, 'g')"
+)
+WORD_COUNT_SQL = f"(SELECT COUNT(*) FROM {LINE_TERMS_SQL})"
+
+
+def histogram_median(histogram):
+    """
+    The median of a distribution given as sorted (value, count) pairs, or None
+    if it is empty.
+    """
+    total = sum(count for _, count in histogram)
+    if total == 0:
+        return None
+    # the values at 0-based positions (total - 1) // 2 and total // 2
+    low, high = (total - 1) // 2, total // 2
+    low_value = None
+    seen = 0
+    for value, count in histogram:
+        seen += count
+        if low_value is None and seen > low:
+            low_value = value
+        if seen > high:
+            return (low_value + value) / 2
+
+
+class LineCounts:
+    """
+    Line-count deltas for a batch of new conversations, applied to the rollups
+    with a single statement.
+    """
+
+    def __init__(self):
+        self.characters = Counter()
+        self.character_words = Counter()
+        # (character_id, term) -> uses, and (movie_id, term) -> uses
+        self.character_terms = Counter()
+        self.movie_terms = Counter()
+        self.character_movies = {}
+        self.movies = Counter()
+        self.pairs = Counter()
+        # (movie_id, lines in the conversation) -> conversations
+        self.conversation_lengths = Counter()
+        # (movie_id, characters in the line) -> lines
+        self.line_lengths = Counter()
+
+    def add_conversation(self, movie_id, ch_id1, ch_id2, lines):
+        """`lines` is the conversation's (character_id, line_text) pairs."""
+        for ch_id, text in lines:
+            self.characters[ch_id] += 1
+            line_terms = vocabulary.terms(text)
+            self.character_words[ch_id] += len(line_terms)
+            for term in line_terms:
+                self.character_terms[(ch_id, term)] += 1
+                self.movie_terms[(movie_id, term)] += 1
+            self.character_movies[ch_id] = movie_id
+            self.line_lengths[(movie_id, len(text))] += 1
+        self.conversation_lengths[(movie_id, len(lines))] += 1
+        if lines:
+            self.movies[movie_id] += len(lines)
+            self.pairs[(ch_id1, ch_id2)] += len(lines)
+
+    def apply(self, conn):
+        """
+        Adds the counts to the rollups and bumps the data version of each
+        movie (see src/etags.py). Must be called on the connection that
+        inserted the lines so both commit together.
+        """
+        if not self.conversation_lengths:
+            return
+        # sorted, so concurrent writers lock rollup rows in the same order
+        ch_ids = sorted(self.characters)
+        movie_ids = sorted(self.movies)
+        pairs = sorted(self.pairs)
+        conversation_lengths = sorted(self.conversation_lengths)
+        line_lengths = sorted(self.line_lengths)
+        character_terms = sorted(self.character_terms)
+        movie_terms = sorted(self.movie_terms)
+        conn.execute(
+            sqlalchemy.text(
+                """
+                WITH per_character AS (
+                    INSERT INTO character_line_counts
+                        (character_id, movie_id, number_of_lines, number_of_words)
+                    SELECT ch_id, m_id, n, words
+                    FROM unnest(
+                        CAST(:ch_ids AS integer[]),
+                        CAST(:ch_movie_ids AS integer[]),
+                        CAST(:ch_counts AS integer[]),
+                        CAST(:ch_words AS integer[])
+                    ) AS c (ch_id, m_id, n, words)
+                    ON CONFLICT (character_id) DO UPDATE
+                    SET number_of_lines = character_line_counts.number_of_lines
+                            + EXCLUDED.number_of_lines,
+                        number_of_words = character_line_counts.number_of_words
+                            + EXCLUDED.number_of_words
+                ), per_movie AS (
+                    INSERT INTO movie_line_counts (movie_id, number_of_lines)
+                    SELECT m_id, n
+                    FROM unnest(
+                        CAST(:movie_ids AS integer[]), CAST(:movie_counts AS integer[])
+                    ) AS m (m_id, n)
+                    ON CONFLICT (movie_id) DO UPDATE
+                    SET number_of_lines =
+                        movie_line_counts.number_of_lines + EXCLUDED.number_of_lines
+                ), per_conversation_length AS (
+                    INSERT INTO movie_conversation_lengths
+                        (movie_id, number_of_lines, number_of_conversations)
+                    SELECT m_id, len, n
+                    FROM unnest(
+                        CAST(:conv_movie_ids AS integer[]),
+                        CAST(:conv_lengths AS integer[]),
+                        CAST(:conv_counts AS integer[])
+                    ) AS l (m_id, len, n)
+                    ON CONFLICT (movie_id, number_of_lines) DO UPDATE
+                    SET number_of_conversations =
+                        movie_conversation_lengths.number_of_conversations
+                        + EXCLUDED.number_of_conversations
+                ), per_line_length AS (
+                    INSERT INTO movie_line_lengths
+                        (movie_id, line_length, number_of_lines)
+                    SELECT m_id, len, n
+                    FROM unnest(
+                        CAST(:line_movie_ids AS integer[]),
+                        CAST(:line_lengths AS integer[]),
+                        CAST(:line_counts AS integer[])
+                    ) AS l (m_id, len, n)
+                    ON CONFLICT (movie_id, line_length) DO UPDATE
+                    SET number_of_lines =
+                        movie_line_lengths.number_of_lines + EXCLUDED.number_of_lines
+                ), per_character_term AS (
+                    INSERT INTO character_term_counts
+                        (character_id, term, number_of_uses)
+                    SELECT ch_id, term, n
+                    FROM unnest(
+                        CAST(:term_ch_ids AS integer[]),
+                        CAST(:ch_terms AS text[]),
+                        CAST(:ch_term_counts AS integer[])
+                    ) AS t (ch_id, term, n)
+                    ON CONFLICT (character_id, term) DO UPDATE
+                    SET number_of_uses =
+                        character_term_counts.number_of_uses + EXCLUDED.number_of_uses
+                ), per_movie_term AS (
+                    INSERT INTO movie_term_counts (movie_id, term, number_of_uses)
+                    SELECT m_id, term, n
+                    FROM unnest(
+                        CAST(:term_movie_ids AS integer[]),
+                        CAST(:movie_terms AS text[]),
+                        CAST(:movie_term_counts AS integer[])
+                    ) AS t (m_id, term, n)
+                    ON CONFLICT (movie_id, term) DO UPDATE
+                    SET number_of_uses =
+                        movie_term_counts.number_of_uses + EXCLUDED.number_of_uses
+                ), movie_version AS (
+                    INSERT INTO movie_versions (movie_id, version)
+                    SELECT DISTINCT m_id, 1
+                    FROM unnest(CAST(:conv_movie_ids AS integer[])) AS m (m_id)
+                    ON CONFLICT (movie_id) DO UPDATE
+                    SET version = movie_versions.version + 1
+                )
+                INSERT INTO character_pair_line_counts
+                    (character1_id, character2_id, number_of_lines)
+                SELECT ch_id1, ch_id2, n
+                FROM unnest(
+                    CAST(:pair_ch_ids1 AS integer[]),
+                    CAST(:pair_ch_ids2 AS integer[]),
+                    CAST(:pair_counts AS integer[])
+                ) AS p (ch_id1, ch_id2, n)
+                ON CONFLICT (character1_id, character2_id) DO UPDATE
+                SET number_of_lines = character_pair_line_counts.number_of_lines
+                    + EXCLUDED.number_of_lines
+            """
+            ),
+            [
+                {
+                    "ch_ids": ch_ids,
+                    "ch_movie_ids": [self.character_movies[ch_id] for ch_id in ch_ids],
+                    "ch_counts": [self.characters[ch_id] for ch_id in ch_ids],
+                    "ch_words": [self.character_words[ch_id] for ch_id in ch_ids],
+                    "movie_ids": movie_ids,
+                    "movie_counts": [self.movies[m_id] for m_id in movie_ids],
+                    "conv_movie_ids": [key[0] for key in conversation_lengths],
+                    "conv_lengths": [key[1] for key in conversation_lengths],
+                    "conv_counts": [
+                        self.conversation_lengths[key] for key in conversation_lengths
+                    ],
+                    "line_movie_ids": [key[0] for key in line_lengths],
+                    "line_lengths": [key[1] for key in line_lengths],
+                    "line_counts": [self.line_lengths[key] for key in line_lengths],
+                    "term_ch_ids": [key[0] for key in character_terms],
+                    "ch_terms": [key[1] for key in character_terms],
+                    "ch_term_counts": [
+                        self.character_terms[key] for key in character_terms
+                    ],
+                    "term_movie_ids": [key[0] for key in movie_terms],
+                    "movie_terms": [key[1] for key in movie_terms],
+                    "movie_term_counts": [self.movie_terms[key] for key in movie_terms],
+                    "pair_ch_ids1": [pair[0] for pair in pairs],
+                    "pair_ch_ids2": [pair[1] for pair in pairs],
+                    "pair_counts": [self.pairs[pair] for pair in pairs],
+                }
+            ],
+        )
+
+
+def add_lines(conn, movie_id, ch_id1, ch_id2, lines):
+    """
+    Adds a newly inserted conversation's (character_id, line_text) lines to the
+    rollups. Must be called on the connection that inserted the lines so both
+    commit together.
+    """
+    counts = LineCounts()
+    counts.add_conversation(movie_id, ch_id1, ch_id2, lines)
+    counts.apply(conn)
+
+
+def rebuild(conn):
+    """Recomputes every rollup table from `lines` and `conversations`."""
+    conn.execute(
+        sqlalchemy.text(
+            """
+        TRUNCATE character_line_counts, movie_line_counts, character_pair_line_counts,
+                 movie_conversation_lengths, movie_line_lengths,
+                 character_term_counts, movie_term_counts
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            f"""
+        INSERT INTO character_line_counts
+            (character_id, movie_id, number_of_lines, number_of_words)
+        SELECT characters.character_id, characters.movie_id,
+               COUNT(*), SUM({WORD_COUNT_SQL})
+        FROM characters
+        JOIN lines ON lines.character_id = characters.character_id
+        GROUP BY characters.character_id
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO movie_line_counts (movie_id, number_of_lines)
+        SELECT movie_id, COUNT(*)
+        FROM lines
+        GROUP BY movie_id
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO character_pair_line_counts
+            (character1_id, character2_id, number_of_lines)
+        SELECT character1_id, character2_id, COUNT(*)
+        FROM conversations
+        JOIN lines ON lines.conversation_id = conversations.conversation_id
+        GROUP BY character1_id, character2_id
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO movie_conversation_lengths
+            (movie_id, number_of_lines, number_of_conversations)
+        SELECT movie_id, number_of_lines, COUNT(*)
+        FROM (
+            SELECT conversations.movie_id, COUNT(lines.line_id) AS number_of_lines
+            FROM conversations
+            LEFT JOIN lines ON lines.conversation_id = conversations.conversation_id
+            GROUP BY conversations.conversation_id
+        ) AS conversation_lengths
+        GROUP BY movie_id, number_of_lines
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO movie_line_lengths (movie_id, line_length, number_of_lines)
+        SELECT movie_id, char_length(coalesce(line_text, '')), COUNT(*)
+        FROM lines
+        GROUP BY movie_id, char_length(coalesce(line_text, ''))
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            f"""
+        INSERT INTO character_term_counts (character_id, term, number_of_uses)
+        SELECT character_id, term_match[1], COUNT(*)
+        FROM lines, {LINE_TERMS_SQL} AS term_match
+        GROUP BY character_id, term_match[1]
+    """
+        )
+    )
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO movie_term_counts (movie_id, term, number_of_uses)
+        SELECT characters.movie_id, term, SUM(number_of_uses)
+        FROM character_term_counts
+        JOIN characters ON characters.character_id = character_term_counts.character_id
+        GROUP BY characters.movie_id, term
+    """
+        )
+    )
+    # counts may have changed, so ETags issued before the rebuild must not match
+    conn.execute(
+        sqlalchemy.text(
+            """
+        INSERT INTO movie_versions (movie_id, version)
+        SELECT movie_id, 1
+        FROM movies
+        ON CONFLICT (movie_id) DO UPDATE
+        SET version = movie_versions.version + 1
+    """
+        )
+    )
+
+
+if __name__ == "__main__":
+    # a plain sync engine, so this also works when the app runs on asyncpg
+    engine = sqlalchemy.create_engine(db.database_connection_url())
+    with engine.begin() as conn:
+        rebuild(conn)
+    print("rollups rebuilt")
@@ -0,0 +1,294 @@
+import datetime
+import importlib
+import json
+import os
+import shutil
+import threading
+from array import array
+import dotenv
+import sqlalchemy
+from src import database as db
+from src import vocabulary
+
+# The index behind the similar-line routes: a TF-IDF vector of each line over
+# its terms (see src/vocabulary.py), stored both by line (to look up a line's
+# own vector) and by term (the postings, to score only the lines that share a
+# term with the query). `python -m src.similarity` builds it from the `lines`
+# table into SIMILARITY_INDEX_PATH as .npy files; each worker memory-maps them
+# on first use, so workers share one copy through the page cache and a query
+# never touches the database. The index is a snapshot: lines added since the
+# last build are found by their own text but are not in anyone's results
+# until it is rebuilt.
+#
+# A term's weight in a line is (1 + log tf) * idf with idf = log((1 + N) /
+# (1 + df)) + 1, and each line's vector has unit length, so a dot product is
+# the cosine similarity.
+
+dotenv.load_dotenv()
+
+
+def similarity_settings():
+    dotenv.load_dotenv()
+    return os.environ.get("SIMILARITY_INDEX_PATH", "similarity_index")
+
+
+INDEX_PATH = similarity_settings()
+
+# by line: line_indptr[i]:line_indptr[i + 1] of line_terms and line_weights are
+# the vector of line_ids[i]; by term: term_indptr[t]:term_indptr[t + 1] of
+# term_lines and term_weights are the postings of term t
+ARRAYS = (
+    "line_ids",
+    "line_indptr",
+    "line_terms",
+    "line_weights",
+    "term_indptr",
+    "term_lines",
+    "term_weights",
+    "idf",
+)
+
+MAX_K = 100
+
+
+def _numpy():
+    # imported on first use, so starting a worker doesn't pay for it
+    return importlib.import_module("numpy")
+
+
+class Index:
+    def __init__(self, arrays, terms):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+        # {term: column}
+        self.terms = terms
+
+    @property
+    def size(self):
+        return len(self.line_ids)
+
+    def vectorize(self, text):
+        """
+        A text's (terms, weights) vector, leaving out terms the index doesn't
+        have.
+        """
+        np = _numpy()
+        counts = {}
+        for term in vocabulary.terms(text):
+            column = self.terms.get(term)
+            if column is not None:
+                counts[column] = counts.get(column, 0) + 1
+        columns = np.fromiter(sorted(counts), dtype=np.int32, count=len(counts))
+        tf = np.array([counts[column] for column in columns.tolist()], dtype=np.float32)
+        weights = (1 + np.log(tf)) * self.idf[columns]
+        norm = np.sqrt(np.dot(weights, weights))
+        return columns, weights / norm if norm else weights
+
+    def position(self, line_id):
+        """The row of `line_id` in the index, or None."""
+        np = _numpy()
+        i = int(np.searchsorted(self.line_ids, line_id))
+        if i < self.size and self.line_ids[i] == line_id:
+            return i
+        return None
+
+    def line_vector(self, line_id):
+        """The (terms, weights) vector of an indexed line, or None."""
+        i = self.position(line_id)
+        if i is None:
+            return None
+        start, end = self.line_indptr[i], self.line_indptr[i + 1]
+        return self.line_terms[start:end], self.line_weights[start:end]
+
+    def top_k(self, vector, k, exclude=None):
+        """
+        The `k` lines most similar to `vector`, as [(line_id, score)], best
+        first and equal scores by line_id, leaving out line `exclude` and
+        lines that share no term with it.
+        """
+        np = _numpy()
+        columns, weights = vector
+        if len(columns) == 0:
+            return []
+        # every posting of the query's terms at once, summed per line
+        starts = self.term_indptr[columns]
+        ends = self.term_indptr[columns + 1]
+        lines = np.concatenate([self.term_lines[s:e] for s, e in zip(starts, ends)])
+        contributions = np.concatenate(
+            [self.term_weights[s:e] * w for s, e, w in zip(starts, ends, weights)]
+        )
+        scores = np.bincount(lines, weights=contributions, minlength=self.size)
+        if exclude is not None:
+            i = self.position(exclude)
+            if i is not None:
+                scores[i] = 0
+        # most of the lines share a common word with a typical query, so pick
+        # the top k of all of them rather than first finding the nonzero ones
+        if k < self.size:
+            best = np.argpartition(-scores, k - 1)[:k]
+        else:
+            best = np.arange(self.size)
+        best = best[scores[best] > 0]
+        # line_ids ascend with the row, so row order breaks ties by line_id
+        best = best[np.lexsort((best, -scores[best]))]
+        return [
+            (int(self.line_ids[i]), round(float(scores[i]), 4)) for i in best.tolist()
+        ]
+
+
+def build(rows):
+    """An Index of `rows`, (line_id, line_text) pairs in line_id order."""
+    np = _numpy()
+    terms = {}
+    line_ids = array("i")
+    line_indptr = array("q", [0])
+    line_terms = array("i")
+    tfs = array("f")
+    for line_id, line_text in rows:
+        counts = {}
+        for term in vocabulary.terms(line_text):
+            column = terms.setdefault(term, len(terms))
+            counts[column] = counts.get(column, 0) + 1
+        line_ids.append(line_id)
+        for column in sorted(counts):
+            line_terms.append(column)
+            tfs.append(counts[column])
+        line_indptr.append(len(line_terms))
+
+    line_ids = np.frombuffer(line_ids, dtype=np.int32)
+    line_indptr = np.frombuffer(line_indptr, dtype=np.int64)
+    line_terms = np.frombuffer(line_terms, dtype=np.int32)
+    tfs = np.frombuffer(tfs, dtype=np.float32)
+    if np.any(np.diff(line_ids) <= 0):
+        raise ValueError("rows must be in increasing line_id order")
+
+    # the line of each stored weight
+    rows_of = np.repeat(np.arange(len(line_ids), dtype=np.int32), np.diff(line_indptr))
+    df = np.bincount(line_terms, minlength=len(terms))
+    idf = (np.log((1 + len(line_ids)) / (1 + df)) + 1).astype(np.float32)
+    weights = (1 + np.log(tfs)) * idf[line_terms]
+    norms = np.sqrt(
+        np.bincount(rows_of, weights=weights * weights, minlength=len(line_ids))
+    )
+    line_weights = (weights / norms[rows_of]).astype(np.float32)
+
+    # the same weights again, grouped by term
+    order = np.argsort(line_terms, kind="stable")
+    term_indptr = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+    arrays = {
+        "line_ids": line_ids,
+        "line_indptr": line_indptr,
+        "line_terms": line_terms,
+        "line_weights": line_weights,
+        "term_indptr": term_indptr,
+        "term_lines": rows_of[order],
+        "term_weights": line_weights[order],
+        "idf": idf,
+    }
+    return Index(arrays, terms)
+
+
+def save(index, path):
+    """Writes `index` to the directory `path`, replacing what is there all at once."""
+    np = _numpy()
+    path = os.path.abspath(path)
+    staging = path + ".new"
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    for name in ARRAYS:
+        np.save(
+            os.path.join(staging, name + ".npy"),
+            np.ascontiguousarray(getattr(index, name)),
+        )
+    terms = sorted(index.terms, key=index.terms.get)
+    with open(os.path.join(staging, "terms.json"), "w", encoding="utf-8") as f:
+        json.dump(terms, f)
+    # written last: workers reload when it changes
+    with open(os.path.join(staging, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "lines": index.size,
+                "terms": len(terms),
+                "built_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            },
+            f,
+        )
+    # workers keep their mapping of the old files, which stay readable until
+    # they let go of them
+    previous = path + ".old"
+    shutil.rmtree(previous, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, previous)
+    os.rename(staging, path)
+    shutil.rmtree(previous, ignore_errors=True)
+
+
+def load(path):
+    """The Index saved in `path`, memory-mapped rather than read."""
+    np = _numpy()
+    arrays = {
+        name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+        for name in ARRAYS
+    }
+    with open(os.path.join(path, "terms.json"), encoding="utf-8") as f:
+        terms = {term: column for column, term in enumerate(json.load(f))}
+    return Index(arrays, terms)
+
+
+_index = None
+_loaded_from = None
+_lock = threading.Lock()
+
+
+def current():
+    """
+    This worker's Index, mapped on first use and again whenever a rebuild has
+    replaced the files, or None if it has never been built.
+    """
+    global _index, _loaded_from
+    try:
+        stat = os.stat(os.path.join(INDEX_PATH, "meta.json"))
+    except FileNotFoundError:
+        # never built, or a rebuild is swapping the directory in right now
+        return _index
+    # an inode that changes on each rebuild, as the directory is swapped in
+    built = (stat.st_ino, stat.st_mtime_ns)
+    if built != _loaded_from:
+        # no I/O wait inside, so this never blocks the event loop for long
+        with _lock:
+            if built != _loaded_from:
+                _index = load(INDEX_PATH)
+                _loaded_from = built
+    return _index
+
+
+def stats():
+    index = _index
+    if index is None:
+        return {"loaded": False, "path": INDEX_PATH}
+    return {
+        "loaded": True,
+        "path": INDEX_PATH,
+        "lines": index.size,
+        "terms": len(index.terms),
+        "postings": len(index.term_lines),
+    }
+
+
+def rebuild(conn):
+    result = conn.execution_options(stream_results=True, yield_per=10000).execute(
+        sqlalchemy.text("SELECT line_id, line_text FROM lines ORDER BY line_id")
+    )
+    return build((row.line_id, row.line_text) for row in result)
+
+
+if __name__ == "__main__":
+    # a plain sync engine, so this also works when the app runs on asyncpg
+    engine = sqlalchemy.create_engine(db.database_connection_url())
+    with engine.connect() as conn:
+        index = rebuild(conn)
+    save(index, INDEX_PATH)
+    print(
+        f"similarity index of {index.size} lines and {len(index.terms)} terms"
+        f" written to {INDEX_PATH}"
+    )
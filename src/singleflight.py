@@ -0,0 +1,111 @@
+import asyncio
+import threading
+from sqlalchemy.util import await_only
+from src import metrics
+
+# Request coalescing ("single flight") for the entity endpoints. When several
+# requests miss the cache for the same key at once, such as a popular movie
+# being linked, the first one runs the load and the others wait for its result
+# (or exception) instead of running the same joins again. On the sync path the
+# waiters are threadpool threads blocked on an Event. On the async path they
+# are greenlets on the event loop (see db.asyncable), which await a future so
+# the loop keeps serving other requests while they wait.
+
+
+class Flight:
+    __slots__ = ("done", "outcome", "futures", "lock")
+
+    def __init__(self):
+        self.done = threading.Event()
+        # ("result", value) or ("error", exception); None if the load was cut
+        # short (a cancelled task), in which case the waiters load themselves
+        self.outcome = None
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def wait(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.done.wait()
+            return self.outcome
+        with self.lock:
+            if self.done.is_set():
+                return self.outcome
+            future = loop.create_future()
+            self.futures.append((loop, future))
+        await_only(future)
+        return self.outcome
+
+    def finish(self, outcome):
+        with self.lock:
+            self.outcome = outcome
+            self.done.set()
+            futures, self.futures = self.futures, []
+        for loop, future in futures:
+            loop.call_soon_threadsafe(resolve, future)
+
+
+def resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class SingleFlight:
+    def __init__(self, name):
+        self.name = name
+        self.loads = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, load):
+        """
+        Returns `load()`, or the result of the call already running for `key`
+        if there is one. An exception raised by that call (such as a 404) is
+        raised in every request that waited for it.
+        """
+        while True:
+            with self._lock:
+                flight = self._flights.get(key)
+                leader = flight is None
+                if leader:
+                    flight = self._flights[key] = Flight()
+                    self.loads += 1
+                else:
+                    self.coalesced += 1
+            if leader:
+                return self._lead(key, flight, load)
+            metrics.coalesced_requests.inc(1, self.name)
+            outcome = flight.wait()
+            if outcome is None:
+                continue
+            kind, value = outcome
+            if kind == "error":
+                raise value
+            return value
+
+    def _lead(self, key, flight, load):
+        outcome = None
+        try:
+            value = load()
+            outcome = ("result", value)
+            return value
+        except Exception as error:
+            outcome = ("error", error)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.finish(outcome)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "loads": self.loads,
+                "coalesced": self.coalesced,
+                "in_flight": len(self._flights),
+            }
+
+
+entities = SingleFlight("entity")
@@ -0,0 +1,376 @@
+import bisect
+import itertools
+import os
+import threading
+import time
+from array import array
+import dotenv
+import orjson
+import sqlalchemy
+from src import database as db
+from src import pagination, responses
+from src.datatypes import Character, Line, Movie
+
+# Optional in-memory serving mode for the movie, character and line list
+# routes. With SNAPSHOT_ENABLED set, each worker loads those tables into flat
+# columns on first use, along with every sort order the routes offer. The
+# orders are computed by Postgres with row_number(), so text sorts by the
+# database collation exactly as the SQL path does. Each row's JSON is rendered
+# once when the snapshot is built, so a list request is a walk along one order
+# joining prebuilt bytes. The `name` filter is a str.find over the lowercased
+# searched column, concatenated in each sort order.
+#
+# The snapshot is replaced whole, never modified. A conversation added through
+# this worker marks it stale: until the next request has rebuilt it, list
+# requests go back to Postgres, so a client always reads its own writes.
+# Writes made through other workers show up once it is older than
+# SNAPSHOT_TTL. Anything the snapshot can't answer exactly (ranked or full
+# text searches, LIKE wildcards in `name`, a cursor row that has since
+# changed) also goes to Postgres.
+
+dotenv.load_dotenv()
+
+
+def snapshot_settings():
+    dotenv.load_dotenv()
+    enabled = os.environ.get("SNAPSHOT_ENABLED", "").lower() in ("1", "true", "yes")
+    return enabled, float(os.environ.get("SNAPSHOT_TTL", "300"))
+
+
+# separates the rows of a search column; never part of a name filter
+SEPARATOR = "\x00"
+
+
+def plain_substring(name):
+    """False if `name` has characters ILIKE treats as wildcards or escapes."""
+    return not any(c in name for c in "%_\\" + SEPARATOR)
+
+
+class Table:
+    """
+    One table's rows: their ids, their JSON (concatenated, with `starts`
+    marking where each row's begins), and for each sort option the
+    row indexes in that order (`orders`), each row's place in it
+    (`positions`) and the search column in that order (`search`).
+    """
+
+    def __init__(self, ids, rendered, ranks, search):
+        """
+        `rendered` yields each row's JSON, `ranks` is {sort option: each row's
+        0-based place in that order} and `search` each row's lowercased text
+        for the `name` filter.
+        """
+        self.ids = array("q", ids)
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        # one buffer rather than a bytes object per row: orjson's output keeps
+        # its whole initial allocation
+        buffer = bytearray()
+        self.starts = array("q")
+        for body in rendered:
+            self.starts.append(len(buffer))
+            buffer += body
+        self.starts.append(len(buffer))
+        self.rendered = bytes(buffer)
+        self.positions = {sort: array("q", places) for sort, places in ranks.items()}
+        self.orders = {}
+        self.search = {}
+        for sort, positions in self.positions.items():
+            order = array("q", bytes(8 * len(positions)))
+            for i, place in enumerate(positions):
+                order[place] = i
+            self.orders[sort] = order
+            # (text, where each row's text starts in it)
+            starts = array("q")
+            length = 0
+            for i in order:
+                starts.append(length)
+                length += len(search[i]) + 1
+            starts.append(length)
+            self.search[sort] = (SEPARATOR.join(search[i] for i in order), starts)
+
+    def found(self, sort, start, needle):
+        """Places in `sort` order, from `start` on, of the rows containing `needle`."""
+        text, starts = self.search[sort]
+        at = starts[start]
+        while True:
+            at = text.find(needle, at)
+            if at < 0:
+                return
+            place = bisect.bisect_right(starts, at) - 1
+            yield place
+            at = starts[place + 1]
+
+    def page(self, sort, limit, offset, cursor, sort_value, needle):
+        """
+        Row indexes of one page in `sort` order, after the cursor's row if
+        `cursor` is set, keeping only rows containing `needle` if it isn't
+        empty. `sort_value(i)` is the value a cursor holds for row `i`.
+        Returns None if the cursor's row is gone or has changed since the
+        cursor was issued.
+        """
+        if limit < 0 or offset < 0:
+            return None
+        order = self.orders[sort]
+        start = 0
+        if cursor:
+            value, last_id = pagination.decode_cursor(cursor, sort)
+            i = self.index.get(last_id)
+            if i is None or sort_value(i) != value:
+                return None
+            start = self.positions[sort][i] + 1
+        if needle == "":
+            return order[start + offset : start + offset + limit]
+        return [
+            order[place]
+            for place in itertools.islice(
+                self.found(sort, start, needle), offset, offset + limit
+            )
+        ]
+
+    def render(self, rows, sort, limit, cursor, sort_value):
+        """
+        The JSON body of a page: a list of the rows, or with `cursor` a page
+        object as built by the SQL path.
+        """
+        rendered, starts = self.rendered, self.starts
+        body = (
+            b"[" + b",".join([rendered[starts[i] : starts[i + 1]] for i in rows]) + b"]"
+        )
+        if cursor is None:
+            return body
+        next_cursor = None
+        if rows and len(rows) >= limit:
+            next_cursor = pagination.encode_cursor(
+                sort, sort_value(rows[-1]), self.ids[rows[-1]]
+            )
+        return (
+            b'{"results":'
+            + body
+            + b',"next_cursor":'
+            + orjson.dumps(next_cursor)
+            + b"}"
+        )
+
+
+def render(row):
+    return orjson.dumps(row, default=responses.default)
+
+
+class Snapshot:
+    def __init__(self, movies, characters, lines):
+        """
+        `movies` is (movie_id, title, year, imdb_rating, imdb_votes) rows,
+        `characters` is (character_id, name, movie_id, number_of_lines) rows
+        and `lines` is (line_id, movie_id, character name, line_sort, line_text)
+        rows, each followed by its place in every sort order of its route.
+        Characters without lines or a name, and lines without text, are left
+        out, as the list routes never return them.
+        """
+        self.movies = Table(
+            [row[0] for row in movies],
+            (render(Movie(*row[:5])) for row in movies),
+            {
+                "movie_title": [row[5] for row in movies],
+                "year": [row[6] for row in movies],
+                "rating": [row[7] for row in movies],
+            },
+            [(row[1] or "").lower() for row in movies],
+        )
+        self.titles = [row[1] for row in movies]
+        self.years = [row[2] for row in movies]
+        self.ratings = [row[3] for row in movies]
+
+        movie_index = self.movies.index
+        self.characters = Table(
+            [row[0] for row in characters],
+            (
+                render(
+                    Character(row[0], row[1], self.titles[movie_index[row[2]]], row[3])
+                )
+                for row in characters
+            ),
+            {
+                "character": [row[4] for row in characters],
+                "movie": [row[5] for row in characters],
+                "number_of_lines": [row[6] for row in characters],
+            },
+            [row[1].lower() for row in characters],
+        )
+        self.names = [row[1] for row in characters]
+        self.character_movies = array("q", (movie_index[row[2]] for row in characters))
+        self.line_counts = array("q", (row[3] for row in characters))
+
+        self.lines = Table(
+            [row[0] for row in lines],
+            (
+                render(
+                    Line(
+                        row[0], self.titles[movie_index[row[1]]], row[2], row[3], row[4]
+                    )
+                )
+                for row in lines
+            ),
+            {
+                "movie_title": [row[5] for row in lines],
+                "character_name": [row[6] for row in lines],
+            },
+            [row[4].lower() for row in lines],
+        )
+        self.line_movies = array("q", (movie_index[row[1]] for row in lines))
+        # one string per character name rather than one per line
+        shared = {}
+        self.line_character_names = [shared.setdefault(row[2], row[2]) for row in lines]
+
+    def list_movies(self, name, sort, limit, offset, cursor):
+        """The JSON body of GET /movies/, or None to use the database."""
+        if not plain_substring(name):
+            return None
+        sort_value = {
+            "movie_title": self.titles,
+            "year": self.years,
+            "rating": self.ratings,
+        }[sort].__getitem__
+        rows = self.movies.page(sort, limit, offset, cursor, sort_value, name.lower())
+        if rows is None:
+            return None
+        return self.movies.render(rows, sort, limit, cursor, sort_value)
+
+    def character_movie_title(self, i):
+        return self.titles[self.character_movies[i]]
+
+    def line_movie_title(self, i):
+        return self.titles[self.line_movies[i]]
+
+    def list_characters(self, name, sort, limit, offset, cursor):
+        """The JSON body of GET /characters/, or None to use the database."""
+        if not plain_substring(name):
+            return None
+        if sort == "character":
+            sort_value = self.names.__getitem__
+        elif sort == "movie":
+            sort_value = self.character_movie_title
+        else:
+            sort_value = self.line_counts.__getitem__
+        rows = self.characters.page(
+            sort, limit, offset, cursor, sort_value, name.lower()
+        )
+        if rows is None:
+            return None
+        return self.characters.render(rows, sort, limit, cursor, sort_value)
+
+    def list_lines(self, name, sort, limit, offset, cursor):
+        """
+        The JSON body of GET /lines/ for a substring search, or None to use the
+        database.
+        """
+        if not plain_substring(name):
+            return None
+        if sort == "movie_title":
+            sort_value = self.line_movie_title
+        else:
+            sort_value = self.line_character_names.__getitem__
+        rows = self.lines.page(sort, limit, offset, cursor, sort_value, name.lower())
+        if rows is None:
+            return None
+        return self.lines.render(rows, sort, limit, cursor, sort_value)
+
+
+MOVIES = sqlalchemy.text(
+    """
+    SELECT movie_id, title, year, imdb_rating, imdb_votes,
+           row_number() OVER (ORDER BY title, movie_id) - 1,
+           row_number() OVER (ORDER BY year, movie_id) - 1,
+           row_number() OVER (ORDER BY imdb_rating DESC, movie_id) - 1
+    FROM movies
+    ORDER BY movie_id
+"""
+)
+
+CHARACTERS = sqlalchemy.text(
+    """
+    SELECT characters.character_id, name, characters.movie_id,
+           counts.number_of_lines,
+           row_number() OVER (ORDER BY name, characters.character_id) - 1,
+           row_number() OVER (ORDER BY title, characters.character_id) - 1,
+           row_number() OVER (
+               ORDER BY counts.number_of_lines DESC, characters.character_id
+           ) - 1
+    FROM characters
+    JOIN movies ON movies.movie_id = characters.movie_id
+    JOIN character_line_counts AS counts
+        ON counts.character_id = characters.character_id
+    WHERE name IS NOT NULL AND counts.number_of_lines > 0
+    ORDER BY characters.character_id
+"""
+)
+
+LINES = sqlalchemy.text(
+    """
+    SELECT line_id, lines.movie_id, characters.name, line_sort, line_text,
+           row_number() OVER (ORDER BY movies.title, line_id) - 1,
+           row_number() OVER (ORDER BY characters.name, line_id) - 1
+    FROM lines
+    JOIN characters ON characters.character_id = lines.character_id
+    JOIN movies ON movies.movie_id = lines.movie_id
+    WHERE line_text IS NOT NULL
+    ORDER BY line_id
+"""
+)
+
+
+def load_snapshot(primary=False):
+    with db.reader(primary).connect() as conn:
+        movies = conn.execute(MOVIES).all()
+        characters = conn.execute(CHARACTERS).all()
+        lines = conn.execute(LINES).all()
+    return Snapshot(movies, characters, lines)
+
+
+# (snapshot, monotonic time it was built, write generation it was loaded at),
+# replaced whole so readers never see a half-updated state
+_state = (None, 0.0, 0)
+# every write through this worker takes the next generation; a snapshot
+# loaded at an older one is stale
+_writes = itertools.count(1)
+_generation = 0
+_build_lock = threading.Lock()
+ENABLED, SNAPSHOT_TTL = snapshot_settings()
+
+
+def current():
+    """
+    The snapshot to answer a list request from, or None to use the database:
+    when the mode is off, or while another request builds the first snapshot
+    or replaces a stale one. The request that finds it missing, stale or older
+    than SNAPSHOT_TTL rebuilds it; concurrent callers keep using one that is
+    merely old.
+    """
+    global _state
+    if not ENABLED:
+        return None
+    snapshot, built_at, generation = _state
+    stale = generation != _generation
+    if (
+        snapshot is not None
+        and not stale
+        and time.monotonic() - built_at < SNAPSHOT_TTL
+    ):
+        return snapshot
+    # never block on the lock: on the async path every request shares one thread
+    if not _build_lock.acquire(blocking=False):
+        return None if stale else snapshot
+    try:
+        generation = _generation
+        # a replica may not have replayed the write that made it stale yet
+        snapshot = load_snapshot(primary=stale)
+        _state = (snapshot, time.monotonic(), generation)
+    finally:
+        _build_lock.release()
+    # a write during the load leaves it stale, and the next request reloads it
+    return snapshot if generation == _generation else None
+
+
+def invalidate():
+    """Marks the snapshot stale. Call after a write commits."""
+    global _generation
+    _generation = next(_writes)
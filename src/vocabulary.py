@@ -0,0 +1,79 @@
+import math
+import re
+
+# Terms behind the vocabulary endpoints, and the word counts of the rollups:
+# lowercased runs of ASCII letters and digits, joined across apostrophes
+# ("don't"). Postgres (regexp_matches, see src/rollups.py) and Python find the
+# same terms with TERM_PATTERN. The term rollups are an inverted index of the
+# lines: each term's uses per character and per movie, indexed by term.
+
+TERM_PATTERN = "[a-z0-9]+(?:'[a-z0-9]+)*"
+TERM_RE = re.compile(TERM_PATTERN)
+
+# TERM_PATTERN as a quoted SQL string
+TERM_PATTERN_SQL = "'" + TERM_PATTERN.replace("'", "''") + "'"
+
+# left out of top_terms and distinctive_terms unless `stop_words` is set
+STOP_WORDS = frozenset(
+    """
+    a about after all also am an and any are as at be because been but by can
+    could did do does don't for from get go got had has have he her him his how
+    i i'm if in into is it it's just know let's like me my no not now of oh ok
+    okay on one or our out over right say see she so some that that's the them
+    then there they this to up us want was we well were what when where who why
+    will with would yeah yes you you're your
+""".split()
+)
+
+# add-α smoothing of the term rates compared by distinctive_terms
+SMOOTHING = 0.5
+# terms used fewer times are never distinctive
+MIN_DISTINCTIVE_USES = 2
+
+
+def terms(text):
+    return TERM_RE.findall((text or "").lower())
+
+
+def summarize(rows, other_words, limit, stop_words):
+    """
+    The vocabulary of a character or movie from its (term, uses, uses
+    elsewhere) rows, where "elsewhere" is the rest of the movie or corpus and
+    `other_words` its total words. Returns (words, terms, type/token ratio,
+    [(term, uses)], [(term, uses, uses elsewhere, score)]) with the top and
+    distinctive terms, most first, at most `limit` of each.
+
+    A term's score is the log of how much more often it is used here than
+    elsewhere, per word, after smoothing both rates; terms used fewer than
+    MIN_DISTINCTIVE_USES times, or no more often than elsewhere, are skipped.
+    """
+    words = sum(uses for _, uses, _ in rows)
+    number_of_terms = len(rows)
+    ratio = round(number_of_terms / words, 4) if words else None
+    if not stop_words:
+        rows = [row for row in rows if row[0] not in STOP_WORDS]
+
+    top = sorted(rows, key=lambda row: (-row[1], row[0]))[:limit]
+
+    smoothed = SMOOTHING * max(number_of_terms, 1)
+    scored = [
+        (
+            term,
+            uses,
+            other,
+            round(
+                math.log(
+                    ((uses + SMOOTHING) / (words + smoothed))
+                    / ((other + SMOOTHING) / (other_words + smoothed))
+                ),
+                3,
+            ),
+        )
+        for term, uses, other in rows
+        if uses >= MIN_DISTINCTIVE_USES
+    ]
+    distinctive = sorted(
+        (row for row in scored if row[3] > 0),
+        key=lambda row: (-row[3], -row[1], row[0]),
+    )[:limit]
+    return words, number_of_terms, ratio, [row[:2] for row in top], distinctive
@@ -0,0 +1,145 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from src import admission, metrics
+from src.admission import AdmissionMiddleware, Limiter
+
+
+def test_limiter_queues_and_sheds():
+    async def main():
+        limiter = Limiter("test", limit=2, queue_size=1, timeout=5)
+        assert await limiter.acquire() is None
+        assert await limiter.acquire() is None
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats() == {
+            "limit": 2,
+            "queue_size": 1,
+            "active": 2,
+            "waiting": 1,
+        }
+        # the queue is full
+        assert await limiter.acquire() == "queue_full"
+        limiter.release()
+        assert await queued is None
+        assert limiter.stats()["active"] == 2 and limiter.stats()["waiting"] == 0
+        limiter.release()
+        limiter.release()
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_limiter_timeout():
+    async def main():
+        limiter = Limiter("test", limit=1, queue_size=4, timeout=0.01)
+        assert await limiter.acquire() is None
+        assert await limiter.acquire() == "timeout"
+        assert limiter.stats()["waiting"] == 0
+        limiter.release()
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def main():
+        limiter = Limiter("test", limit=1, queue_size=4, timeout=5)
+        assert await limiter.acquire() is None
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        queued.cancel()
+        await asyncio.gather(queued, return_exceptions=True)
+        assert limiter.stats()["waiting"] == 0
+        limiter.release()
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def test_zero_limit_admits_everything():
+    async def main():
+        limiter = Limiter("test", limit=0, queue_size=0, timeout=5)
+        for _ in range(100):
+            assert await limiter.acquire() is None
+        assert limiter.stats()["active"] == 0
+
+    asyncio.run(main())
+
+
+def make_app(limiters):
+    app = FastAPI()
+    release = asyncio.Event()
+
+    @app.get("/heavy", tags=["test"])
+    async def heavy():
+        await release.wait()
+        return {"route": "heavy"}
+
+    @app.get("/cheap/{id}", tags=["test"])
+    async def cheap(id: int):
+        return {"route": "cheap", "id": id}
+
+    @app.get("/untagged")
+    async def untagged():
+        return {"route": "untagged"}
+
+    app.add_middleware(
+        AdmissionMiddleware,
+        limiters=limiters,
+        route_classes={"/heavy": "list"},
+        retry_after=3,
+    )
+    return app, release
+
+
+def test_heavy_routes_are_shed_without_blocking_cheap_ones():
+    limiters = {
+        "detail": Limiter("detail", 1, 1, 5),
+        "list": Limiter("list-test", 1, 1, 5),
+    }
+    app, release = make_app(limiters)
+
+    async def main():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://t"
+        ) as client:
+            running = asyncio.ensure_future(client.get("/heavy"))
+            queued = asyncio.ensure_future(client.get("/heavy"))
+            while limiters["list"].stats()["waiting"] < 1:
+                await asyncio.sleep(0.001)
+
+            shed = await client.get("/heavy")
+            cheap = await client.get("/cheap/7")
+            untagged = await client.get("/untagged")
+            release.set()
+            return shed, cheap, untagged, await running, await queued
+
+    shed, cheap, untagged, running, queued = asyncio.run(main())
+    assert shed.status_code == 503
+    assert shed.headers["retry-after"] == "3"
+    assert shed.json() == {"detail": "the server is busy, try again later."}
+    assert cheap.json() == {"route": "cheap", "id": 7}
+    assert untagged.status_code == 200
+    assert running.status_code == 200 and queued.status_code == 200
+    assert limiters["list"].stats()["active"] == 0
+    shed_total = (
+        'movie_api_shed_requests_total{route_class="list-test",reason="queue_full"} 1'
+    )
+    assert shed_total in metrics.expose()
+
+
+def test_api_route_classes():
+    from src.api.server import app
+
+    middleware = AdmissionMiddleware(app)
+    scope = {"type": "http", "method": "GET", "path": "/lines/", "app": app}
+    assert middleware.route_class(scope) == "list"
+    assert middleware.route_class({**scope, "path": "/lines/conv/12"}) == "detail"
+    assert middleware.route_class({**scope, "path": "/movies/3/lines/export"}) == "list"
+    assert middleware.route_class({**scope, "path": "/metrics"}) is None
+    for path in ("/conversations/bulk", "/movies/3/conversations/"):
+        post = {**scope, "method": "POST", "path": path}
+        assert middleware.route_class(post) == "write"
+    assert set(admission.limiters) == {"detail", "list", "write"}
@@ -0,0 +1,21 @@
+from fastapi import HTTPException
+from src import batch
+
+import pytest
+
+
+def test_parse_ids_keeps_order_and_drops_duplicates():
+    assert batch.parse_ids("3, 1,3,,2") == [3, 1, 2]
+
+
+def test_parse_ids_rejects_non_integers():
+    with pytest.raises(HTTPException) as e:
+        batch.parse_ids("1,two")
+    assert e.value.status_code == 400
+
+
+def test_parse_ids_limit():
+    batch.parse_ids(",".join(map(str, range(batch.MAX_IDS))))
+    with pytest.raises(HTTPException) as e:
+        batch.parse_ids(",".join(map(str, range(batch.MAX_IDS + 1))))
+    assert e.value.status_code == 400
@@ -0,0 +1,142 @@
+from fastapi import HTTPException
+from src.cache import EntityCache, character_tag, movie_tag
+
+import pytest
+
+
+def loader(value, tags, calls):
+    def load():
+        calls.append(value)
+        return value, tags
+
+    return load
+
+
+def test_hit_and_miss():
+    cache = EntityCache(10, 60)
+    calls = []
+    assert cache.get_or_load("a", loader(1, [], calls)) == 1
+    assert cache.get_or_load("a", loader(2, [], calls)) == 1
+    assert calls == [1]
+    assert cache.hits == 1 and cache.misses == 1
+
+
+def test_lru_eviction():
+    cache = EntityCache(2, 60)
+    calls = []
+    cache.get_or_load("a", loader("a", [], calls))
+    cache.get_or_load("b", loader("b", [], calls))
+    cache.get_or_load("a", loader("a", [], calls))
+    cache.get_or_load("c", loader("c", [], calls))
+    assert cache.evictions == 1
+    # "b" was least recently used
+    cache.get_or_load("b", loader("b", [], calls))
+    assert calls == ["a", "b", "c", "b"]
+
+
+def test_ttl_expiry():
+    now = [100.0]
+    cache = EntityCache(10, 60, clock=lambda: now[0])
+    calls = []
+    cache.get_or_load("a", loader(1, [], calls))
+    now[0] += 59
+    cache.get_or_load("a", loader(2, [], calls))
+    now[0] += 1
+    assert cache.get_or_load("a", loader(3, [], calls)) == 3
+    assert calls == [1, 3]
+
+
+def test_invalidate_by_tag():
+    cache = EntityCache(10, 60)
+    calls = []
+    cache.get_or_load("movie", loader(1, [movie_tag(44)], calls))
+    cache.get_or_load("character", loader(2, [character_tag(7421)], calls))
+    cache.invalidate([movie_tag(44)])
+    cache.get_or_load("movie", loader(1, [movie_tag(44)], calls))
+    cache.get_or_load("character", loader(2, [character_tag(7421)], calls))
+    assert calls == [1, 2, 1]
+
+
+def test_invalidate_during_load_is_not_cached():
+    cache = EntityCache(10, 60)
+    calls = []
+
+    def racing_load():
+        calls.append("old")
+        cache.invalidate([movie_tag(44)])
+        return "old", [movie_tag(44)]
+
+    assert cache.get_or_load("movie", racing_load) == "old"
+    assert cache.get_or_load("movie", loader("new", [movie_tag(44)], calls)) == "new"
+
+
+def test_errors_not_cached():
+    cache = EntityCache(10, 60)
+
+    def missing():
+        raise HTTPException(status_code=404, detail="movie not found.")
+
+    with pytest.raises(HTTPException):
+        cache.get_or_load("movie", missing)
+    assert cache.stats()["size"] == 0
+
+
+def test_get_many_loads_only_missing_keys():
+    cache = EntityCache(10, 60)
+    cache.get_or_load("a", loader(1, [], []))
+    requested = []
+
+    def load_many(keys):
+        requested.append(keys)
+        return {key: (key.upper(), []) for key in keys if key != "missing"}
+
+    found = cache.get_many(["a", "b", "missing"], load_many)
+    assert found == {"a": 1, "b": "B"}
+    assert requested == [["b", "missing"]]
+    assert cache.get_many(["b"], load_many) == {"b": "B"}
+    assert len(requested) == 1
+
+
+def test_loads_after_invalidation_are_cached():
+    cache = EntityCache(10, 60)
+    calls = []
+    cache.get_or_load("movie", loader(1, [movie_tag(44)], calls))
+    cache.invalidate([movie_tag(44)])
+    cache.get_or_load("movie", loader(2, [movie_tag(44)], calls))
+    assert cache.get_or_load("movie", loader(3, [movie_tag(44)], calls)) == 2
+    assert calls == [1, 2]
+    assert cache.hits == 1
+
+
+def test_invalidations_are_forgotten_once_no_load_needs_them():
+    cache = EntityCache(10, 60)
+    for movie_id in range(100):
+        cache.invalidate([movie_tag(movie_id)])
+    assert cache.stats()["invalidations"] == 0
+
+    def racing_load():
+        cache.invalidate([movie_tag(44)])
+        # this load is still running, so the invalidation must be kept
+        assert cache.stats()["invalidations"] == 1
+        return "old", [movie_tag(44)]
+
+    cache.get_or_load("movie", racing_load)
+    assert cache.stats()["size"] == 0
+    cache.invalidate([movie_tag(45)])
+    assert cache.stats()["invalidations"] == 0
+
+
+def test_loads_right_after_an_invalidation_are_not_cached_with_replicas():
+    now = [100.0]
+    cache = EntityCache(10, 60, clock=lambda: now[0], replica_lag=5)
+    calls = []
+    cache.invalidate([movie_tag(44)])
+    now[0] += 4
+    # a replica may not have the write yet
+    cache.get_or_load("movie", loader(1, [movie_tag(44)], calls))
+    cache.get_or_load("character", loader(2, [character_tag(7421)], calls))
+    cache.get_or_load("character", loader(3, [character_tag(7421)], calls))
+    now[0] += 1
+    cache.get_or_load("movie", loader(4, [movie_tag(44)], calls))
+    assert cache.get_or_load("movie", loader(5, [movie_tag(44)], calls)) == 4
+    assert calls == [1, 2, 4]
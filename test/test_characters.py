@@ -22,6 +22,7 @@ def test_characters():
     with open("test/characters/root.json", encoding="utf-8") as f:
         assert response.json() == json.load(f)
 
+
 # New test case (includes multiple conversation partners)
 def test_get_character2():
     response = client.get("/characters/2")
@@ -43,11 +44,10 @@ def test_sort_filter():
     ) as f:
         assert response.json() == json.load(f)
 
+
 # New test case ()
 def test_sort_filter2():
-    response = client.get(
-        "/characters/?name=%20&limit=250&offset=42&sort=movie"
-    )
+    response = client.get("/characters/?name=%20&limit=250&offset=42&sort=movie")
     assert response.status_code == 200
 
     with open(
@@ -60,3 +60,27 @@ def test_sort_filter2():
 def test_404():
     response = client.get("/characters/400")
     assert response.status_code == 404
+
+
+def test_get_characters_by_ids():
+    response = client.get("/characters/?ids=7421,400,2")
+    assert response.status_code == 200
+
+    with open("test/characters/7421.json", encoding="utf-8") as f:
+        first = json.load(f)
+    with open("test/characters/2.json", encoding="utf-8") as f:
+        second = json.load(f)
+    assert response.json() == [first, second]
+
+
+def test_character_vocabulary():
+    response = client.get("/characters/7421/vocabulary?stop_words=true")
+    assert response.status_code == 200
+
+    vocabulary = response.json()
+    assert vocabulary["character_id"] == 7421
+    assert vocabulary["number_of_terms"] <= vocabulary["number_of_words"]
+    for term in vocabulary["distinctive_terms"]:
+        assert term["score"] > 0
+
+    assert client.get("/characters/999999/vocabulary").status_code == 404
@@ -0,0 +1,99 @@
+import json
+import threading
+import time
+from fastapi import HTTPException, Request
+from src import cache, etags, singleflight
+
+import pytest
+
+
+def request_with(if_none_match=None):
+    headers = []
+    if if_none_match is not None:
+        headers.append((b"if-none-match", if_none_match.encode("latin-1")))
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": headers})
+
+
+def test_etag_matching():
+    etag = etags.make_etag(("line", 238, None), 3)
+    assert etag == '"line-238-v3"'
+    assert etags.matches(etag, etag)
+    assert etags.matches(f'"other", W/{etag}', etag)
+    assert etags.matches("*", etag)
+    assert not etags.matches('"line-238-v2"', etag)
+
+
+def test_conditional_get_sets_headers():
+    response = etags.conditional_get(
+        request_with(),
+        ("test", "headers"),
+        lambda: (etags.Versioned({"a": 1}, 4), []),
+        lambda: pytest.fail("version is only looked up for conditional requests"),
+    )
+    assert json.loads(response.body) == {"a": 1}
+    assert response.headers["etag"] == '"test-headers-v4"'
+    assert response.headers["cache-control"] == etags.CACHE_CONTROL
+
+
+def test_not_modified_skips_load():
+    with pytest.raises(HTTPException) as e:
+        etags.conditional_get(
+            request_with('"test-skip-v2"'),
+            ("test", "skip"),
+            lambda: pytest.fail("a 304 must not load the entity"),
+            lambda: 2,
+        )
+    assert e.value.status_code == 304
+    assert e.value.headers["ETag"] == '"test-skip-v2"'
+
+
+def test_stale_etag_loads():
+    response = etags.conditional_get(
+        request_with('"test-stale-v1"'),
+        ("test", "stale"),
+        lambda: (etags.Versioned({"a": 2}, 2), []),
+        lambda: 2,
+    )
+    assert json.loads(response.body) == {"a": 2}
+
+
+def test_concurrent_misses_share_a_load():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(len(calls))
+        started.set()
+        release.wait(5)
+        return etags.Versioned({"calls": len(calls)}, 1), [cache.movie_tag(-1)]
+
+    bodies = []
+
+    def request():
+        response = etags.conditional_get(
+            request_with(), ("test", "coalesce"), load, lambda: 1
+        )
+        bodies.append(json.loads(response.body))
+
+    coalesced = singleflight.entities.stats()["coalesced"]
+    threads = [threading.Thread(target=request)]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads[1:]:
+        thread.start()
+    while singleflight.entities.stats()["coalesced"] < coalesced + 3:
+        time.sleep(0.001)
+    # a request after a write must not join the load that started before it
+    cache.entities.invalidate([cache.movie_tag(-1)])
+    late = threading.Thread(target=request)
+    late.start()
+    while len(calls) < 2:
+        time.sleep(0.001)
+    release.set()
+    for thread in [*threads, late]:
+        thread.join(5)
+
+    assert calls == [0, 1]
+    assert sorted(body["calls"] for body in bodies) == [2, 2, 2, 2, 2]
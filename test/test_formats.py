@@ -0,0 +1,178 @@
+import asyncio
+import zlib
+
+import httpx
+import pytest
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from src import compression, formats
+from src.datatypes import Line, LinePage
+
+
+def test_parse_accept():
+    assert formats.parse_accept("application/json;q=0.5, */*; q=0.1, text/html") == {
+        "application/json": 0.5,
+        "*/*": 0.1,
+        "text/html": 1.0,
+    }
+    assert formats.parse_accept("gzip;q=bad") == {"gzip": 0.0}
+
+
+def test_negotiate(monkeypatch):
+    monkeypatch.setattr(formats, "installed", lambda package: package != "pyarrow")
+    assert formats.negotiate(None) == "json"
+    assert formats.negotiate("*/*") == "json"
+    assert formats.negotiate("text/html") == "json"
+    assert formats.negotiate("application/x-msgpack") == "msgpack"
+    assert formats.negotiate("application/json;q=0.9, application/msgpack") == "msgpack"
+    # Arrow isn't available, but JSON is acceptable
+    accept = "application/vnd.apache.arrow.stream, application/json;q=0.1"
+    assert formats.negotiate(accept) == "json"
+    with pytest.raises(HTTPException) as e:
+        formats.negotiate("application/vnd.apache.arrow.stream")
+    assert e.value.status_code == 406
+
+
+def test_choose_encoding(monkeypatch):
+    monkeypatch.setattr(compression, "BROTLI", False)
+    assert compression.choose_encoding("gzip, deflate, br") == "gzip"
+    assert compression.choose_encoding("identity") is None
+    assert compression.choose_encoding(None) is None
+    monkeypatch.setattr(compression, "BROTLI", True)
+    assert compression.choose_encoding("gzip, br") == "br"
+    assert compression.choose_encoding("gzip, br;q=0") == "gzip"
+
+
+def get(app, path, headers):
+    async def request():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://test"
+        ) as client:
+            return await client.get(path, headers=headers)
+
+    return asyncio.run(request())
+
+
+def test_compression_middleware(monkeypatch):
+    monkeypatch.setattr(compression, "MIN_SIZE", 100)
+    app = FastAPI()
+    app.add_middleware(compression.CompressionMiddleware)
+
+    @app.get("/big")
+    def big():
+        return PlainTextResponse("x" * 1000, headers={"ETag": '"v1"'})
+
+    @app.get("/small")
+    def small():
+        return PlainTextResponse("x" * 10)
+
+    @app.get("/cached")
+    def cached():
+        # as src/etags.py answers a matching If-None-Match
+        raise HTTPException(status_code=304, headers={"ETag": '"v1"'})
+
+    response = get(app, "/big", {"Accept-Encoding": "gzip"})
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["etag"] == '"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+    assert response.text == "x" * 1000
+    assert int(response.headers["content-length"]) < 100
+
+    response = get(app, "/small", {"Accept-Encoding": "gzip"})
+    assert "content-encoding" not in response.headers
+    assert "Accept-Encoding" in response.headers["vary"]
+    response = get(app, "/big", {"Accept-Encoding": "identity"})
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == '"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+
+    # a 304 has the validator and Vary of the 200 it stands for
+    response = get(app, "/cached", {"Accept-Encoding": "gzip"})
+    assert response.status_code == 304
+    assert response.headers["etag"] == '"v1"'
+    assert "Accept-Encoding" in response.headers["vary"]
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "br"])
+def test_streamed_chunks_are_flushed(encoding):
+    if encoding == "br":
+        decompress = pytest.importorskip("brotli").Decompressor().process
+    else:
+        decompress = zlib.decompressobj(31).decompress
+    chunks = [b'{"line_id": 1}\n', b'{"line_id": 2}\n']
+
+    async def export(scope, receive, send):
+        headers = [(b"content-type", b"application/x-ndjson")]
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+        for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", encoding.encode())]}
+    middleware = compression.CompressionMiddleware(export)
+    asyncio.run(middleware(scope, None, send))
+    bodies = [message["body"] for message in sent[1:]]
+    # each chunk can be decoded as soon as it arrives
+    assert [decompress(body) for body in bodies[:2]] == chunks
+    assert decompress(bodies[2]) == b""
+
+
+class FakeRequest:
+    def __init__(self, accept):
+        self.headers = {"accept": accept}
+
+
+ROWS = [
+    Line(1, "alien", "RIPLEY", 1, "Get away from her"),
+    Line(2, None, "ASH", 2, None),
+]
+
+
+def test_respond_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    response = formats.respond(
+        FakeRequest("application/msgpack"), LinePage(ROWS, "abc"), Line
+    )
+    assert response.media_type == "application/msgpack"
+    page = msgpack.unpackb(response.body)
+    assert page["next_cursor"] == "abc"
+    assert page["results"][1] == {
+        "line_id": 2,
+        "movie_title": None,
+        "character_name": "ASH",
+        "line_sort": 2,
+        "line_text": None,
+    }
+
+
+def test_respond_arrow():
+    pa = pytest.importorskip("pyarrow")
+    response = formats.respond(
+        FakeRequest(formats.ARROW_STREAM), LinePage(ROWS, "abc"), Line
+    )
+    table = pa.ipc.open_stream(response.body).read_all()
+    assert table.column("line_id").to_pylist() == [1, 2]
+    assert table.schema.field("movie_title").type == pa.string()
+    assert table.schema.metadata[b"next_cursor"] == b"abc"
+    # an empty page still has the columns
+    response = formats.respond(FakeRequest(formats.ARROW_STREAM), [], Line)
+    assert pa.ipc.open_stream(response.body).read_all().column_names == [
+        "line_id",
+        "movie_title",
+        "character_name",
+        "line_sort",
+        "line_text",
+    ]
+
+
+def test_respond_json():
+    response = formats.respond(FakeRequest("*/*"), b'[{"line_id":1}]', Line)
+    assert response.body == b'[{"line_id":1}]'
+    assert response.headers["vary"] == "Accept"
@@ -0,0 +1,49 @@
+from src import graph
+from src.graph import CharacterGraph
+
+CHARACTERS = [(1, "A", 10), (2, "B", 10), (3, "C", 10), (4, "D", 10), (5, "E", 20)]
+# 1 - 2 - 3 - 4, with both orientations of the 1-2 pair counted; 5 on its own
+PAIRS = [(1, 2, 3), (2, 1, 2), (3, 2, 4), (3, 4, 1)]
+
+
+def ids(network, indexes):
+    return [network.ids[i] for i in indexes]
+
+
+def test_network():
+    network = CharacterGraph(CHARACTERS, PAIRS)
+    distances, edges = network.network(2, 1)
+    assert {network.ids[i]: d for i, d in distances.items()} == {2: 0, 1: 1, 3: 1}
+    by_id = sorted((network.ids[i], network.ids[j], n) for i, j, n in edges)
+    assert by_id == [(1, 2, 5), (2, 3, 4)]
+
+    distances, edges = network.network(1, 3)
+    assert {network.ids[i]: d for i, d in distances.items()} == {1: 0, 2: 1, 3: 2, 4: 3}
+    assert len(edges) == 3
+
+
+def test_path():
+    network = CharacterGraph(CHARACTERS, PAIRS)
+    assert ids(network, network.path(1, 4)) == [1, 2, 3, 4]
+    assert ids(network, network.path(3, 3)) == [3]
+    assert network.path(1, 5) is None
+
+
+def test_add_lines():
+    network = CharacterGraph(CHARACTERS, PAIRS)
+    network.add_lines(1, 4, 2)
+    assert ids(network, network.path(1, 4)) == [1, 4]
+    network.add_lines(2, 1, 1)
+    assert network.edges(network.index[1])[network.index[2]] == 6
+    # unknown characters are left for the next rebuild
+    network.add_lines(1, 99, 1)
+
+
+def test_pending_lines_are_folded_in(monkeypatch):
+    monkeypatch.setattr(graph, "MAX_PENDING", 2)
+    network = CharacterGraph(CHARACTERS, PAIRS)
+    for _ in range(3):
+        network.add_lines(4, 5, 1)
+    assert network.state[3] == {}
+    assert network.edges(network.index[5]) == {network.index[4]: 3}
+    assert ids(network, network.path(1, 5)) == [1, 2, 3, 4, 5]
@@ -15,6 +15,18 @@ def test_get_line():
         assert response.json() == json.load(f)
 
 
+def test_get_line_context():
+    response = client.get("/lines/238?context=1")
+    assert response.status_code == 200
+
+    with open("test/lines/238.json", encoding="utf-8") as f:
+        full = json.load(f)
+    line = response.json()
+    # line 238 opens its conversation, so only the next line is context
+    assert line["text"] == full["text"]
+    assert line["conversation"] == full["conversation"][:2]
+
+
 def test_lines():
     response = client.get("/lines/")
     assert response.status_code == 200
@@ -24,9 +36,7 @@ def test_lines():
 
 
 def test_sort_filter():
-    response = client.get(
-        "/lines/?name=what&limit=15&offset=60&sort=movie_title"
-    )
+    response = client.get("/lines/?name=what&limit=15&offset=60&sort=movie_title")
     assert response.status_code == 200
 
     with open(
@@ -37,9 +47,7 @@ def test_sort_filter():
 
 
 def test_conv():
-    response = client.get(
-        "/lines/conv/500"
-    )
+    response = client.get("/lines/conv/500")
     assert response.status_code == 200
 
     with open(
@@ -49,6 +57,25 @@ def test_conv():
         assert response.json() == json.load(f)
 
 
+def test_get_by_ids():
+    response = client.get("/lines/?ids=238,400")
+    assert response.status_code == 200
+
+    with open("test/lines/238.json", encoding="utf-8") as f:
+        assert response.json() == [json.load(f)]
+
+    response = client.get("/lines/conv/?ids=500")
+    assert response.status_code == 200
+
+    with open("test/lines/conv-500.json", encoding="utf-8") as f:
+        assert response.json() == [json.load(f)]
+
+
+def test_invalid_ids():
+    response = client.get("/lines/?ids=238,abc")
+    assert response.status_code == 400
+
+
 def test_404():
     response = client.get("/lines/400")
     assert response.status_code == 404
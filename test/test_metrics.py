@@ -0,0 +1,48 @@
+import sqlalchemy
+from src import metrics
+
+
+def test_histogram_exposition():
+    histogram = metrics.Histogram("h", "help", ("route",), buckets=(1, 5))
+    histogram.observe(0.5, "/a")
+    histogram.observe(3, "/a")
+    histogram.observe(7, "/a")
+    lines = histogram.expose()
+    assert 'h_bucket{route="/a",le="1"} 1' in lines
+    assert 'h_bucket{route="/a",le="5"} 2' in lines
+    assert 'h_bucket{route="/a",le="+Inf"} 3' in lines
+    assert 'h_sum{route="/a"} 10.5' in lines
+    assert 'h_count{route="/a"} 3' in lines
+
+
+def test_counter_escapes_labels():
+    counter = metrics.Counter("c", "help", ("route",))
+    counter.inc(2, 'a"b')
+    assert 'c{route="a\\"b"} 2' in counter.expose()
+
+
+def test_server_timing():
+    stats = metrics.RequestStats()
+    stats.queries = 3
+    stats.db_seconds = 0.0125
+    assert stats.server_timing(0.02) == (
+        'db;desc="3 queries";dur=12.50, pool;dur=0.00, total;dur=20.00'
+    )
+
+
+def test_queries_counted_per_request(monkeypatch):
+    # instrument() registers the engine for the pool gauge; keep it out of
+    # the module-global list other tests see
+    monkeypatch.setattr(metrics, "engines", [])
+    engine = sqlalchemy.create_engine("sqlite://")
+    metrics.instrument(engine)
+    stats = metrics.RequestStats()
+    token = metrics._current.set(stats)
+    try:
+        with engine.connect() as conn:
+            conn.execute(sqlalchemy.text("SELECT 1"))
+            conn.execute(sqlalchemy.text("SELECT 2"))
+    finally:
+        metrics._current.reset(token)
+    assert stats.queries == 2
+    assert stats.db_seconds > 0
@@ -22,6 +22,7 @@ def test_movies():
     with open("test/movies/root.json", encoding="utf-8") as f:
         assert response.json() == json.load(f)
 
+
 # New test case
 def test_get_movie2():
     # tests null character in top characters
@@ -42,6 +43,7 @@ def test_sort_filter():
     ) as f:
         assert response.json() == json.load(f)
 
+
 # New test case
 def test_sort_filter2():
     # Tests going past end of db
@@ -55,6 +57,96 @@ def test_sort_filter2():
         assert response.json() == json.load(f)
 
 
+def test_get_movie_not_modified():
+    response = client.get("/movies/44")
+    etag = response.headers["ETag"]
+
+    response = client.get("/movies/44", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.headers["ETag"] == etag
+    assert response.content == b""
+
+
+def test_get_movies_by_ids():
+    response = client.get("/movies/?ids=436,44")
+    assert response.status_code == 200
+
+    with open("test/movies/436.json", encoding="utf-8") as f:
+        first = json.load(f)
+    with open("test/movies/44.json", encoding="utf-8") as f:
+        second = json.load(f)
+    assert response.json() == [first, second]
+
+
 def test_404():
     response = client.get("/movies/1")
     assert response.status_code == 404
+
+
+def test_export_lines():
+    response = client.get("/movies/44/lines/export")
+    assert response.status_code == 200
+
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert len(rows) > 0
+    keys = [(row["conversation_id"], row["line_sort"]) for row in rows]
+    assert keys == sorted(keys)
+
+
+def test_export_lines_csv():
+    response = client.get("/movies/44/lines/export?format=csv")
+    assert response.status_code == 200
+    assert response.text.splitlines()[0] == (
+        "line_id,conversation_id,line_sort,character_id,character,line_text"
+    )
+
+
+def test_export_404():
+    response = client.get("/movies/1/lines/export")
+    assert response.status_code == 404
+
+
+def test_movie_stats():
+    response = client.get("/movies/44/stats")
+    assert response.status_code == 200
+
+    stats = response.json()
+    assert stats["movie_id"] == 44
+    assert stats["number_of_lines"] == sum(
+        c["number_of_lines"] for c in stats["characters"]
+    )
+    assert stats["number_of_words"] == sum(
+        c["number_of_words"] for c in stats["characters"]
+    )
+    assert stats["number_of_conversations"] == sum(
+        c["number_of_conversations"] for c in stats["conversation_lengths"]
+    )
+    assert (
+        sum(g["number_of_lines"] for g in stats["lines_by_gender"])
+        == stats["number_of_lines"]
+    )
+    # the top characters of /movies/44 come from the same rollup
+    top = client.get("/movies/44").json()["top_characters"]
+    assert [c["character_id"] for c in stats["characters"][:5]] == [
+        c["character_id"] for c in top
+    ]
+
+
+def test_movie_stats_not_found():
+    response = client.get("/movies/999999/stats")
+    assert response.status_code == 404
+
+
+def test_movie_vocabulary():
+    response = client.get("/movies/44/vocabulary?limit=10")
+    assert response.status_code == 200
+
+    vocabulary = response.json()
+    assert (
+        vocabulary["number_of_words"]
+        == client.get("/movies/44/stats").json()["number_of_words"]
+    )
+    assert len(vocabulary["top_terms"]) == 10
+    uses = [term["number_of_uses"] for term in vocabulary["top_terms"]]
+    assert uses == sorted(uses, reverse=True)
+    assert "the" not in [term["term"] for term in vocabulary["top_terms"]]
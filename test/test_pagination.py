@@ -0,0 +1,66 @@
+from fastapi import HTTPException
+from src import pagination
+from src.datatypes import Movie
+
+import pytest
+
+
+def test_cursor_round_trip():
+    cursor = pagination.encode_cursor("movie_title", "big", 44)
+    assert pagination.decode_cursor(cursor, "movie_title") == ("big", 44)
+
+
+def test_cursor_null_value():
+    cursor = pagination.encode_cursor("character", None, 7421)
+    assert pagination.decode_cursor(cursor, "character") == (None, 7421)
+
+
+def test_cursor_wrong_sort():
+    cursor = pagination.encode_cursor("year", "1999", 0)
+    with pytest.raises(HTTPException) as e:
+        pagination.decode_cursor(cursor, "rating")
+    assert e.value.status_code == 400
+
+
+def test_cursor_garbage():
+    with pytest.raises(HTTPException) as e:
+        pagination.decode_cursor("not a cursor", "year")
+    assert e.value.status_code == 400
+
+
+def test_next_cursor():
+    json = [Movie(3, "a", "1968", None, None), Movie(0, "b", "1999", None, None)]
+    assert pagination.next_cursor(json, 3, "year", "year", "movie_id") is None
+    cursor = pagination.next_cursor(json, 2, "year", "year", "movie_id")
+    assert pagination.decode_cursor(cursor, "year") == ("1999", 0)
+
+
+def test_cursor_and_offset():
+    with pytest.raises(HTTPException):
+        pagination.check_paging("", 10)
+    pagination.check_paging(None, 10)
+    pagination.check_paging("", 0)
+
+
+@pytest.mark.parametrize(
+    "sort,value",
+    [
+        ("movie_title", {"a": 1}),
+        ("character_name", [1]),
+        ("year", 1999),
+        ("number_of_lines", "12"),
+        ("rating", True),
+    ],
+)
+def test_cursor_value_of_the_wrong_type(sort, value):
+    cursor = pagination.encode_cursor(sort, value, 7)
+    with pytest.raises(HTTPException) as e:
+        pagination.decode_cursor(cursor, sort)
+    assert e.value.status_code == 400
+
+
+def test_cursor_numeric_values():
+    cursor = pagination.encode_cursor("rating", 7.5, 1)
+    assert pagination.decode_cursor(cursor, "rating") == (7.5, 1)
+    cursor = pagination.encode_cursor("number_of_lines", 12, 1)
+    assert pagination.decode_cursor(cursor, "number_of_lines") == (12, 1)
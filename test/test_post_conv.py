@@ -1,4 +1,3 @@
-from src import database as db
 from fastapi.testclient import TestClient
 
 from src.api.server import app
@@ -8,53 +7,73 @@ import json
 client = TestClient(app)
 
 
-
 def test_post_conv_1():
     data = {
         "character_1_id": 4386,
         "character_2_id": 4376,
         "lines": [
-            {
-                "character_id": 4386,
-                "line_text": "Nice to meet you."
-            },
-            {
-                "character_id": 4376,
-                "line_text": "You too!"
-            }
-        ]
+            {"character_id": 4386, "line_text": "Nice to meet you."},
+            {"character_id": 4376, "line_text": "You too!"},
+        ],
     }
 
-    response = client.post(
-        "/movies/290/conversations/",
-        json=data
-    ) 
-    
+    etag = client.get("/movies/290").headers["ETag"]
+
+    response = client.post("/movies/290/conversations/", json=data)
+
     assert response.status_code == 200
 
+    # the write bumps the movie's version, so the old ETag no longer matches
+    response = client.get("/movies/290", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
 
 def test_post_error():
     data = {
         "character_1_id": 0,
         "character_2_id": 1,
         "lines": [
-            {
-                "character_id": 0,
-                "line_text": "Hi"
-            },
-            {
-                "character_id": 4,
-                "line_text": "How are you?"
-            }
-        ]
+            {"character_id": 0, "line_text": "Hi"},
+            {"character_id": 4, "line_text": "How are you?"},
+        ],
     }
-    response = client.post(
-        "/movies/0/conversations/",
-        json=data
-    )
+    response = client.post("/movies/0/conversations/", json=data)
     assert response.status_code == 404
 
-# These following tests work, but pytest sometimes times out when more than one post call test??
+
+def test_post_bulk():
+    records = [
+        {
+            "movie_id": 290,
+            "character_1_id": 4386,
+            "character_2_id": 4376,
+            "lines": [
+                {"character_id": 4386, "line_text": "Nice to meet you."},
+                {"character_id": 4376, "line_text": "You too!"},
+            ],
+        },
+        # character from another movie
+        {
+            "movie_id": 0,
+            "character_1_id": 4386,
+            "character_2_id": 4376,
+            "lines": [{"character_id": 4386, "line_text": "Hi"}],
+        },
+    ]
+    body = "\n".join(json.dumps(record) for record in records) + "\nnot json\n"
+
+    response = client.post("/conversations/bulk", content=body)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["conversations_added"] == 1
+    assert result["lines_added"] == 2
+    assert [error["record"] for error in result["errors"]] == [2, 3]
+
+
+# These following tests work, but pytest sometimes times out when more than one
+# post call test??
 # A lot of successful testing has been done manually, but had some issues with pytest
 
 # def test_post_conv_2():
@@ -84,8 +103,8 @@ def test_post_error():
 #     response = client.post(
 #         "/movies/3/conversations/",
 #         json=data
-#     ) 
-    
+#     )
+
 #     assert response.status_code == 200
 #     assert len(db.conv_log) == len_conv_log + 1
 #     assert len(db.lines_log) == len_lines_log + 3
@@ -123,8 +142,8 @@ def test_post_error():
 #     response = client.post(
 #         "/movies/0/conversations/",
 #         json=data
-#     ) 
-    
+#     )
+
 #     assert response.status_code == 200
 #     assert len(db.conv_log) == len_conv_log + 1
 #     assert len(db.lines_log) == len_lines_log + 3
@@ -0,0 +1,65 @@
+import types
+import sqlalchemy
+from src import prepared
+from src.prepared import Statement
+
+import pytest
+
+
+def test_positional_parameters():
+    statement = Statement(
+        "test_positional",
+        """
+        SELECT CAST(:ids AS integer[]), :id, CAST(:ids AS integer[])::text
+    """,
+    )
+    assert statement.params == ["ids", "id"]
+    sql = statement.prepare_sql
+    assert "CAST($1 AS integer[]), $2, CAST($1 AS integer[])::text" in sql
+    assert sql.startswith("PREPARE test_positional AS")
+    assert statement.execute_text.text == "EXECUTE test_positional(:ids, :id)"
+
+
+def test_names_are_unique():
+    Statement("test_unique", "SELECT 1")
+    with pytest.raises(ValueError):
+        Statement("test_unique", "SELECT 2")
+
+
+def test_other_drivers_run_the_text():
+    statement = Statement("test_sqlite", "SELECT :a + 1")
+    with sqlalchemy.create_engine("sqlite://").connect() as conn:
+        assert statement.execute(conn, [{"a": 1}]).scalar_one() == 2
+
+
+class FakeConnection:
+    """Records what a psycopg2 connection would be sent."""
+
+    def __init__(self, info):
+        self.dialect = types.SimpleNamespace(driver="psycopg2")
+        self.connection = types.SimpleNamespace(info=info)
+        self.sent = []
+
+    def exec_driver_sql(self, sql, execution_options=None):
+        self.sent.append(sql)
+
+    def execute(self, statement, parameters=None):
+        self.sent.append(statement.text)
+
+
+def test_prepared_once_per_connection(monkeypatch):
+    monkeypatch.setattr(prepared, "ENABLED", True)
+    statement = Statement("test_once", "SELECT :id")
+    dbapi_info = {}
+    first = FakeConnection(dbapi_info)
+    statement.execute(first, [{"id": 1}])
+    # a later checkout of the same DBAPI connection
+    second = FakeConnection(dbapi_info)
+    statement.execute(second, [{"id": 2}])
+    assert first.sent == ["PREPARE test_once AS SELECT $1", "EXECUTE test_once(:id)"]
+    assert second.sent == ["EXECUTE test_once(:id)"]
+
+    monkeypatch.setattr(prepared, "ENABLED", False)
+    third = FakeConnection({})
+    statement.execute(third, [{"id": 3}])
+    assert third.sent == ["SELECT :id"]
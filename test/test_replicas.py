@@ -0,0 +1,142 @@
+import asyncio
+import httpx
+import sqlalchemy
+from fastapi import FastAPI
+from src import database as db
+from src.database import Replica
+
+import pytest
+
+
+@pytest.fixture
+def replicas(monkeypatch):
+    """A sqlite "primary" and two replicas with a settable replication lag."""
+    primary = sqlalchemy.create_engine("sqlite://")
+    lags = {"a": 0.0, "b": 0.0}
+
+    def replication_lag(self):
+        if lags[self.server] is None:
+            raise sqlalchemy.exc.OperationalError(
+                "SELECT", {}, Exception("connection refused")
+            )
+        return lags[self.server]
+
+    monkeypatch.setattr(Replica, "replication_lag", replication_lag)
+    replicas = [
+        Replica(server, sqlalchemy.create_engine("sqlite://")) for server in lags
+    ]
+    monkeypatch.setattr(db, "_engine", primary)
+    monkeypatch.setattr(db, "_primary_reads", db.autocommit(primary))
+    monkeypatch.setattr(db, "_replicas", replicas)
+    monkeypatch.setattr(db, "REPLICA_CHECK_INTERVAL", 0)
+    monkeypatch.setattr(db, "REPLICA_SERVERS", list(lags))
+    return primary, replicas, lags
+
+
+def test_reads_round_robin(replicas):
+    primary, (a, b), lags = replicas
+    chosen = {db.reader() for _ in range(4)}
+    assert chosen == {a.reads, b.reads}
+    assert db.engine is primary
+    assert db._primary_reads.get_execution_options()["isolation_level"] == "AUTOCOMMIT"
+
+
+def test_unhealthy_replicas_are_skipped(replicas):
+    primary, (a, b), lags = replicas
+    lags["a"] = db.REPLICA_MAX_LAG + 1
+    assert {db.reader() for _ in range(4)} == {b.reads}
+    lags["b"] = None
+    assert db.reader() is db._primary_reads
+    assert db.replica_stats() == [
+        {"server": "a", "healthy": False, "lag": db.REPLICA_MAX_LAG + 1},
+        {"server": "b", "healthy": False, "lag": None},
+    ]
+    lags["a"] = 0.0
+    assert db.reader() is a.reads
+
+
+def test_failed_connect_takes_a_replica_out(replicas, monkeypatch):
+    primary, (a, b), lags = replicas
+    monkeypatch.setattr(db, "REPLICA_CHECK_INTERVAL", 60)
+    broken = Replica(
+        "a", sqlalchemy.create_engine("sqlite:////nonexistent/dir/replica.db")
+    )
+    monkeypatch.setattr(db, "_replicas", [broken, b])
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        broken.reads.connect()
+    assert not broken.healthy
+    assert {db.reader() for _ in range(4)} == {b.reads}
+
+
+def test_only_the_writing_request_reads_primary(replicas):
+    primary, (a, b), lags = replicas
+    writer = db._request_reads.set([True, False])
+    db.wrote()
+    assert db.reader() is db._primary_reads
+    db._request_reads.reset(writer)
+    # another client's request in the same worker
+    other = db._request_reads.set([True, False])
+    assert db.reader() in (a.reads, b.reads)
+    assert db.reader(primary=True) is db._primary_reads
+    db._request_reads.reset(other)
+
+
+def test_writing_client_reads_primary(replicas):
+    primary, (a, b), lags = replicas
+    app = FastAPI()
+
+    @app.post("/write")
+    def write():
+        db.wrote()
+        return {"primary": db.reader() is db._primary_reads}
+
+    @app.get("/read")
+    def read():
+        return {"primary": db.reader() is db._primary_reads}
+
+    app.add_middleware(db.ReadYourWritesMiddleware)
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://t"
+        ) as client:
+            before = (await client.get("/read")).json()
+            written = await client.post("/write")
+            after = (await client.get("/read")).json()
+            async with httpx.AsyncClient(
+                transport=httpx.ASGITransport(app=app), base_url="http://t"
+            ) as other:
+                other_client = (await other.get("/read")).json()
+            return before, written, after, other_client
+
+    before, written, after, other_client = asyncio.run(main())
+    assert before == {"primary": False}
+    assert written.json() == {"primary": True}
+    assert "primary_until=" in written.headers["set-cookie"]
+    assert after == {"primary": True}
+    assert other_client == {"primary": False}
+
+
+@pytest.mark.skipif(
+    not db.REPLICA_SERVERS, reason="set POSTGRES_REPLICAS to test against real replicas"
+)
+def test_new_conversation_is_readable_at_once():
+    from fastapi.testclient import TestClient
+    from src.api.server import app
+
+    client = TestClient(app)
+    assert all(replica["healthy"] for replica in client.get("/replicas/").json())
+    response = client.post(
+        "/movies/290/conversations/",
+        json={
+            "character_1_id": 4386,
+            "character_2_id": 4376,
+            "lines": [{"character_id": 4386, "line_text": "Read me."}],
+        },
+    )
+    assert response.status_code == 200
+    assert "primary_until" in response.cookies
+    # only the cookie sends the read to the primary
+    conversation = client.get(f"/lines/conv/{response.json()}")
+    assert conversation.status_code == 200
+    assert conversation.json()["lines"][0]["line"] == "Read me."
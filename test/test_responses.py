@@ -0,0 +1,35 @@
+import decimal
+import json
+from src.datatypes import CharacterDetail, ConversationPartner, Movie
+from src.responses import ORJSONResponse
+
+
+def test_rows_are_slotted():
+    movie = Movie(44, "big", "1988", 7.3, 91000)
+    assert not hasattr(movie, "__dict__")
+    assert movie == Movie(44, "big", "1988", 7.3, 91000)
+
+
+def test_render_nested_rows():
+    character = CharacterDetail(
+        7421, "AMY", "big", "F", [ConversationPartner(2, "JOSH", "M", 12)]
+    )
+    assert json.loads(ORJSONResponse(character).body) == {
+        "character_id": 7421,
+        "character": "AMY",
+        "movie": "big",
+        "gender": "F",
+        "top_conversations": [
+            {
+                "character_id": 2,
+                "character": "JOSH",
+                "gender": "M",
+                "number_of_lines_together": 12,
+            }
+        ],
+    }
+
+
+def test_render_decimal():
+    body = ORJSONResponse([Movie(1, "a", "1999", decimal.Decimal("7.5"), 10)]).body
+    assert json.loads(body)[0]["imdb_rating"] == 7.5
@@ -0,0 +1,35 @@
+from src import rollups
+
+
+def test_histogram_median():
+    assert rollups.histogram_median([]) is None
+    assert rollups.histogram_median([(7, 1)]) == 7
+    assert rollups.histogram_median([(1, 1), (3, 1)]) == 2
+    assert rollups.histogram_median([(1, 2), (5, 1), (9, 2)]) == 5
+    assert rollups.histogram_median([(2, 3), (10, 1)]) == 2
+
+
+def test_line_counts():
+    counts = rollups.LineCounts()
+    counts.add_conversation(1, 10, 11, [(10, "hi there"), (11, "hey"), (10, "  bye\n")])
+    counts.add_conversation(1, 10, 12, [])
+    counts.add_conversation(2, 20, 21, [(21, "")])
+
+    assert counts.characters == {10: 2, 11: 1, 21: 1}
+    assert counts.character_words == {10: 3, 11: 1, 21: 0}
+    assert counts.movies == {1: 3, 2: 1}
+    assert counts.pairs == {(10, 11): 3, (20, 21): 1}
+    assert counts.conversation_lengths == {(1, 3): 1, (1, 0): 1, (2, 1): 1}
+    assert counts.line_lengths == {(1, 8): 1, (1, 3): 1, (1, 6): 1, (2, 0): 1}
+    assert counts.character_terms == {
+        (10, "hi"): 1,
+        (10, "there"): 1,
+        (10, "bye"): 1,
+        (11, "hey"): 1,
+    }
+    assert counts.movie_terms == {
+        (1, "hi"): 1,
+        (1, "there"): 1,
+        (1, "bye"): 1,
+        (1, "hey"): 1,
+    }
@@ -0,0 +1,83 @@
+import asyncio
+import httpx
+from src import similarity
+from src.api.server import app
+
+import pytest
+
+LINES = [
+    (1, "Where were you last night?"),
+    (2, "I was at home last night."),
+    (3, "Where is the car?"),
+    (5, "The car is in the garage."),
+    (8, "Nice weather."),
+    (9, None),
+    (12, "Where were you? Where?"),
+]
+
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    path = tmp_path / "index"
+    monkeypatch.setattr(similarity, "INDEX_PATH", str(path))
+    monkeypatch.setattr(similarity, "_index", None)
+    monkeypatch.setattr(similarity, "_loaded_from", None)
+    return path
+
+
+def test_scores_are_cosine_similarities():
+    pytest.importorskip("numpy")
+    index = similarity.build(LINES)
+    assert index.size == len(LINES)
+    results = index.top_k(index.line_vector(1), 10, exclude=1)
+    assert [line_id for line_id, _ in results] == [12, 2, 3]
+    assert all(0 < score < 1 for _, score in results)
+    # a line is most like itself
+    assert index.top_k(index.line_vector(5), 1) == [(5, 1.0)]
+    assert index.top_k(index.line_vector(9), 10) == []
+    assert index.top_k(index.vectorize("WHERE is the car"), 2) == index.top_k(
+        index.line_vector(3), 2
+    )
+    assert index.top_k(index.vectorize("unknown words only"), 10) == []
+
+
+def test_lines_must_be_in_order():
+    pytest.importorskip("numpy")
+    with pytest.raises(ValueError):
+        similarity.build([(2, "a"), (1, "b")])
+
+
+def test_saved_index_is_memory_mapped(index_path):
+    np = pytest.importorskip("numpy")
+    built = similarity.build(LINES)
+    assert similarity.current() is None
+    similarity.save(built, index_path)
+    loaded = similarity.current()
+    assert isinstance(loaded.term_lines, np.memmap)
+    assert similarity.current() is loaded
+    for line_id, _ in LINES:
+        assert loaded.top_k(loaded.line_vector(line_id), 3) == built.top_k(
+            built.line_vector(line_id), 3
+        )
+    assert similarity.stats()["lines"] == len(LINES)
+
+    # a rebuild replaces it in every worker
+    similarity.save(similarity.build(LINES[:2]), index_path)
+    assert similarity.current().size == 2
+
+
+def test_routes_need_the_index(index_path):
+    async def main():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://t"
+        ) as client:
+            return (
+                await client.get("/lines/1/similar"),
+                await client.post("/lines/similar", json={"text": "where were you"}),
+                await client.get("/lines/1/similar?k=0"),
+            )
+
+    by_line, by_text, bad_k = asyncio.run(main())
+    assert by_line.status_code == 503
+    assert by_text.status_code == 503
+    assert bad_k.status_code == 422
@@ -0,0 +1,130 @@
+import asyncio
+import threading
+import time
+from fastapi import HTTPException
+from sqlalchemy.util import await_only, greenlet_spawn
+from src import metrics
+from src.singleflight import SingleFlight
+
+import pytest
+
+
+def test_sequential_calls_each_load():
+    flights = SingleFlight("test")
+    assert flights.do("a", lambda: 1) == 1
+    assert flights.do("a", lambda: 2) == 2
+    assert flights.stats() == {"loads": 2, "coalesced": 0, "in_flight": 0}
+
+
+def test_concurrent_threads_share_one_load():
+    flights = SingleFlight("test-threads")
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return {"movie_id": 1}
+
+    results = []
+
+    def request():
+        results.append(flights.do("movie", load))
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    waiters = [threading.Thread(target=request) for _ in range(8)]
+    for thread in waiters:
+        thread.start()
+    while flights.stats()["coalesced"] < 8:
+        time.sleep(0.001)
+    release.set()
+    for thread in [leader, *waiters]:
+        thread.join(5)
+
+    assert calls == [1]
+    assert results == [{"movie_id": 1}] * 9
+    assert flights.stats() == {"loads": 1, "coalesced": 8, "in_flight": 0}
+    coalesced = 'movie_api_coalesced_requests_total{group="test-threads"} 8'
+    assert coalesced in metrics.expose()
+
+
+def test_errors_are_shared():
+    flights = SingleFlight("test")
+    started = threading.Event()
+    release = threading.Event()
+
+    def load():
+        started.set()
+        release.wait(5)
+        raise HTTPException(status_code=404, detail="movie not found.")
+
+    errors = []
+
+    def request():
+        try:
+            flights.do("missing", load)
+        except HTTPException as e:
+            errors.append(e.status_code)
+
+    leader = threading.Thread(target=request)
+    leader.start()
+    started.wait(5)
+    waiter = threading.Thread(target=request)
+    waiter.start()
+    while flights.stats()["coalesced"] < 1:
+        time.sleep(0.001)
+    release.set()
+    leader.join(5)
+    waiter.join(5)
+    assert errors == [404, 404]
+    assert flights.stats()["loads"] == 1
+
+
+def test_concurrent_greenlets_share_one_load():
+    # the async path: handlers run in greenlets on the event loop, and the load
+    # awaits the database with await_only()
+    flights = SingleFlight("test-async")
+    calls = []
+
+    def load():
+        calls.append(1)
+        await_only(asyncio.sleep(0.05))
+        return "result"
+
+    def handler():
+        return flights.do("conv", load)
+
+    async def main():
+        return await asyncio.gather(*(greenlet_spawn(handler) for _ in range(10)))
+
+    assert asyncio.run(main()) == ["result"] * 10
+    assert calls == [1]
+    assert flights.stats() == {"loads": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_cancelled_leader_hands_over():
+    flights = SingleFlight("test-cancel")
+    calls = []
+
+    def load():
+        calls.append(1)
+        await_only(asyncio.sleep(0.05))
+        return len(calls)
+
+    async def main():
+        leader = asyncio.ensure_future(greenlet_spawn(flights.do, "key", load))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(greenlet_spawn(flights.do, "key", load))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await waiter
+
+    # the waiter loads itself instead of failing with the leader's cancellation
+    assert asyncio.run(main()) == 2
+    assert flights.stats()["in_flight"] == 0
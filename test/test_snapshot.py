@@ -0,0 +1,148 @@
+import json
+
+from src import pagination, snapshot
+from src.snapshot import Snapshot
+
+
+def ranked(rows, *keys):
+    """Appends each row's place in the order given by each of `keys`."""
+    places = []
+    for key in keys:
+        order = sorted(range(len(rows)), key=lambda i: key(rows[i]))
+        place = [0] * len(rows)
+        for p, i in enumerate(order):
+            place[i] = p
+        places.append(place)
+    return [
+        tuple(row) + tuple(place[i] for place in places) for i, row in enumerate(rows)
+    ]
+
+
+MOVIES = ranked(
+    [
+        (1, "Brazil", "1985", 8.0, 100),
+        (2, "alien", "1979", 8.5, 300),
+        (3, "Big", "1988", 7.0, 50),
+    ],
+    lambda r: (r[1].lower(), r[0]),
+    lambda r: (r[2], r[0]),
+    lambda r: (-r[3], r[0]),
+)
+CHARACTERS = ranked(
+    [(10, "RIPLEY", 2, 5), (11, "JOSH", 3, 9), (12, "SAM", 1, 5)],
+    lambda r: (r[1], r[0]),
+    lambda r: ({1: "brazil", 2: "alien", 3: "big"}[r[2]], r[0]),
+    lambda r: (-r[3], r[0]),
+)
+LINES = ranked(
+    [
+        (100, 2, "RIPLEY", 1, "Get away from her"),
+        (101, 3, "JOSH", 1, "I wish I were big"),
+        (102, 1, "SAM", 1, "Big brother is watching"),
+        (103, 2, "RIPLEY", 2, "Stay away"),
+    ],
+    lambda r: ({1: "brazil", 2: "alien", 3: "big"}[r[1]], r[0]),
+    lambda r: (r[2], r[0]),
+)
+
+
+def make():
+    return Snapshot(MOVIES, CHARACTERS, LINES)
+
+
+def ids(body, key):
+    return [row[key] for row in json.loads(body)]
+
+
+def test_list_movies():
+    columns = make()
+
+    def movie_ids(name, sort, limit, offset):
+        return ids(columns.list_movies(name, sort, limit, offset, None), "movie_id")
+
+    assert movie_ids("", "movie_title", 50, 0) == [2, 3, 1]
+    assert movie_ids("", "rating", 2, 1) == [1, 3]
+    assert movie_ids("B", "year", 50, 0) == [1, 3]
+    assert json.loads(columns.list_movies("", "year", 1, 0, None)) == [
+        {
+            "movie_id": 2,
+            "movie_title": "alien",
+            "year": "1979",
+            "imdb_rating": 8.5,
+            "imdb_votes": 300,
+        }
+    ]
+    # LIKE wildcards are left to the database
+    assert columns.list_movies("b_g", "year", 50, 0, None) is None
+
+
+def test_list_characters():
+    columns = make()
+
+    def names(name, sort):
+        return ids(columns.list_characters(name, sort, 50, 0, None), "character")
+
+    rows = json.loads(columns.list_characters("", "number_of_lines", 50, 0, None))
+    found = [(c["character_id"], c["movie"], c["number_of_lines"]) for c in rows]
+    assert found == [(11, "Big", 9), (10, "alien", 5), (12, "Brazil", 5)]
+    assert names("", "movie") == ["RIPLEY", "JOSH", "SAM"]
+    assert names("o", "character") == ["JOSH"]
+
+
+def test_list_lines():
+    columns = make()
+
+    def line_ids(name, sort, limit, offset):
+        return ids(columns.list_lines(name, sort, limit, offset, None), "line_id")
+
+    rows = json.loads(columns.list_lines("BIG", "character_name", 50, 0, None))
+    found = [
+        (line["line_id"], line["movie_title"], line["character_name"]) for line in rows
+    ]
+    assert found == [(101, "Big", "JOSH"), (102, "Brazil", "SAM")]
+    assert line_ids("away", "movie_title", 1, 1) == [103]
+    # matches never run across two lines
+    assert line_ids("herstay", "movie_title", 50, 0) == []
+    assert columns.list_lines("her\x00stay", "movie_title", 50, 0, None) is None
+
+
+def test_cursor():
+    columns = make()
+
+    def page(cursor):
+        return json.loads(columns.list_lines("", "movie_title", 2, 0, cursor))
+
+    first = page("")
+    assert [line["line_id"] for line in first["results"]] == [100, 103]
+    assert first["next_cursor"] == pagination.encode_cursor("movie_title", "alien", 103)
+    second = page(first["next_cursor"])
+    assert [line["line_id"] for line in second["results"]] == [101, 102]
+    last = page(second["next_cursor"])
+    assert last == {"results": [], "next_cursor": None}
+    # a cursor row that has changed since goes to the database
+    changed = pagination.encode_cursor("movie_title", "Aliens", 103)
+    assert columns.list_lines("", "movie_title", 2, 0, changed) is None
+
+
+def test_current_goes_to_database_while_stale(monkeypatch):
+    loads = []
+
+    def load(primary=False):
+        loads.append(primary)
+        return make()
+
+    monkeypatch.setattr(snapshot, "ENABLED", True)
+    monkeypatch.setattr(snapshot, "load_snapshot", load)
+    monkeypatch.setattr(snapshot, "_state", (None, 0.0, snapshot._generation))
+    built = snapshot.current()
+    assert built is not None and snapshot.current() is built and loads == [False]
+
+    snapshot.invalidate()
+    # another request holds the build lock: a stale snapshot is not used
+    assert snapshot._build_lock.acquire()
+    try:
+        assert snapshot.current() is None
+    finally:
+        snapshot._build_lock.release()
+    # reloaded from the primary, which has the write
+    assert snapshot.current() is not built and loads == [False, True]
@@ -0,0 +1,18 @@
+import subprocess
+import sys
+
+
+def test_import_does_not_connect():
+    # a fresh interpreter, since other tests may already have used the engine
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import src.api.server; from src import database as db; "
+            "print(db._engine is None)",
+        ],
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == "True"
@@ -0,0 +1,43 @@
+import re
+
+from src import vocabulary
+
+
+def test_terms():
+    assert vocabulary.terms("Don't you DARE -- 'cause I'm 42... rock'n'roll!") == [
+        "don't",
+        "you",
+        "dare",
+        "cause",
+        "i'm",
+        "42",
+        "rock'n'roll",
+    ]
+    assert vocabulary.terms(None) == []
+    # the SQL literal is the same pattern, quoted
+    assert (
+        vocabulary.TERM_PATTERN_SQL[1:-1].replace("''", "'") == vocabulary.TERM_PATTERN
+    )
+    assert re.fullmatch(vocabulary.TERM_PATTERN, "o'neil")
+
+
+def test_summarize():
+    rows = [
+        ("the", 10, 100),
+        ("ship", 4, 1),
+        ("alien", 3, 0),
+        ("run", 2, 400),
+        ("once", 1, 0),
+    ]
+    words, terms, ratio, top, distinctive = vocabulary.summarize(
+        rows, 1000, 3, stop_words=False
+    )
+    assert (words, terms, ratio) == (20, 5, 0.25)
+    assert top == [("ship", 4), ("alien", 3), ("run", 2)]
+    # "once" is too rare, "run" is no more common here than elsewhere
+    assert [row[0] for row in distinctive] == ["alien", "ship"]
+    assert distinctive[0][3] > distinctive[1][3] > 0
+
+    _, _, _, top, _ = vocabulary.summarize(rows, 1000, 1, stop_words=True)
+    assert top == [("the", 10)]
+    assert vocabulary.summarize([], 1000, 3, stop_words=False) == (0, 0, None, [], [])